@@ -1,45 +1,33 @@
-import json
-from openai import AzureOpenAI
-
-def load_api_data(file_path) :
-    """API接続情報をJSONファイルから読み込む関数"""
-    with open(file_path, 'r', encoding='utf-8') as file:
-        return json.load(file)
-
-def create_client(api_data) :
-    """提供されたAPI情報を使ってAzureOpenAIクライアントを作成する関数"""
-    return AzureOpenAI(
-        azure_endpoint=api_data["azure_endpoint"],
-        api_key=api_data["api_key"],
-        api_version=api_data["api_version"],
-    ),  api_data["model"]
-
-def get_response(client, model, content) :
-    """
-    チャットを実行し、レスポンスのメッセージコンテンツを返す関数
-
-    Args:
-        client: AzureOpenAIクライアントインスタンス
-        model: 使用するモデル名（文字列）
-        content: ユーザーからのメッセージ内容（文字列）
-
-    Returns:
-        str: チャットの応答メッセージ内容
-    """
-    system_message = {
-        "role": "system",
-        "content": "あなたは優秀なアシスタントです。"
-    }
-    user_message = {
-        "role": "user",
-        "content": content
-    }
-
-    response = client.chat.completions.create(
-        messages=[system_message, user_message],
-        max_completion_tokens=1000,
-        model=model
-    )
-
-    return response.choices[0].message.content
-
+"""
+API接続情報の読み込み、AzureOpenAIクライアントの作成、
+およびチャット応答取得のためのユーティリティ関数群を提供します。
+
+実装は ソースコード/api_utils.py に一本化しており、このモジュールはそれを読み込んで公開するだけです。
+（api_utils2.py も同じ実装を公開します）
+"""
+
+import importlib.util
+import os
+import sys
+
+_SOURCE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ソースコード")
+_CORE_MODULE = "_api_utils_core"
+
+
+def _load_core():
+    """ソースコード/api_utils.py を1回だけ読み込み、読み込み済みのモジュールを返す"""
+    if _CORE_MODULE in sys.modules:
+        return sys.modules[_CORE_MODULE]
+    # response_cache など、同じフォルダのモジュールを読み込めるようにする
+    # （ルートの api_utils.py を隠さないよう末尾に追加する）
+    if _SOURCE_DIR not in sys.path:
+        sys.path.append(_SOURCE_DIR)
+    spec = importlib.util.spec_from_file_location(_CORE_MODULE, os.path.join(_SOURCE_DIR, "api_utils.py"))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[_CORE_MODULE] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+_load_core()
+from _api_utils_core import *  # noqa: E402,F401,F403
@@ -1,63 +1,70 @@
-from flask import Flask, request, jsonify, send_from_directory
-import os
-import json
-from datetime import datetime
-
-app = Flask(__name__, static_folder='static', static_url_path='')
-
-DATA_FILE = 'schedule_data.json'
-
-def load_schedule():
-    if not os.path.exists(DATA_FILE):
-        return {}
-    with open(DATA_FILE, 'r', encoding='utf-8') as f:
-        try:
-            return json.load(f)
-        except json.JSONDecodeError:
-            return {}
-
-def save_schedule(data):
-    with open(DATA_FILE, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
-
-@app.route('/')
-def index():
-    return send_from_directory('static', 'index.html')
-
-@app.route('/api/schedule', methods=['GET'])
-def get_schedule():
-    year = request.args.get('year')
-    month = request.args.get('month')
-    if not year or not month:
-        return jsonify({"error": "year and month parameters are required"}), 400
-    schedule = load_schedule()
-    # Filter schedule for the requested year and month
-    filtered = {}
-    for date_str, text in schedule.items():
-        try:
-            dt = datetime.strptime(date_str, '%Y-%m-%d')
-            if dt.year == int(year) and dt.month == int(month):
-                filtered[date_str] = text
-        except ValueError:
-            continue
-    return jsonify(filtered)
-
-@app.route('/api/schedule', methods=['POST'])
-def post_schedule():
-    data = request.get_json()
-    if not data or 'date' not in data or 'text' not in data:
-        return jsonify({"error": "date and text fields are required"}), 400
-    date_str = data['date']
-    text = data['text']
-    # Validate date format
-    try:
-        datetime.strptime(date_str, '%Y-%m-%d')
-    except ValueError:
-        return jsonify({"error": "date format must be YYYY-MM-DD"}), 400
-    schedule = load_schedule()
-    schedule[date_str] = text
-    save_schedule(schedule)
-    return jsonify({"message": "Schedule saved successfully"})
-
-if __name__ == '__main__':
-    app.run(debug=True)
+from flask import Flask, request, jsonify, send_from_directory
+import os
+from datetime import datetime
+from schedule_store import create_store
+
+app = Flask(__name__, static_folder='static', static_url_path='')
+
+DATA_FILE = 'schedule_data.json'
+DB_FILE = 'schedule_data.sqlite3'
+
+# 'json' (default) or 'sqlite'. Switching to sqlite is a one-way migration: a new
+# database is seeded from DATA_FILE once, and later writes go only to DB_FILE.
+store = create_store(os.environ.get('SCHEDULE_BACKEND', 'json'), DATA_FILE, DB_FILE)
+
+def is_valid_date(date_str):
+    try:
+        datetime.strptime(date_str, '%Y-%m-%d')
+    except (TypeError, ValueError):
+        return False
+    return True
+
+@app.route('/')
+def index():
+    return send_from_directory('static', 'index.html')
+
+@app.route('/api/schedule', methods=['GET'])
+def get_schedule():
+    year = request.args.get('year')
+    month = request.args.get('month')
+    if not year or not month:
+        return jsonify({"error": "year and month parameters are required"}), 400
+    try:
+        year, month = int(year), int(month)
+    except ValueError:
+        return jsonify({"error": "year and month must be integers"}), 400
+    return jsonify(store.get_month(year, month))
+
+@app.route('/api/schedule', methods=['POST'])
+def post_schedule():
+    data = request.get_json()
+    if not data or 'date' not in data or 'text' not in data:
+        return jsonify({"error": "date and text fields are required"}), 400
+    date_str = data['date']
+    text = data['text']
+    # Validate date format
+    if not is_valid_date(date_str):
+        return jsonify({"error": "date format must be YYYY-MM-DD"}), 400
+    if not isinstance(text, str):
+        return jsonify({"error": "text must be a string"}), 400
+    store.put(date_str, text)
+    return jsonify({"message": "Schedule saved successfully"})
+
+@app.route('/api/schedule/bulk', methods=['POST'])
+def post_schedule_bulk():
+    # Body: {"entries": {"YYYY-MM-DD": "text", ...}}; all dates are saved in one write
+    data = request.get_json()
+    if not isinstance(data, dict) or not isinstance(data.get('entries'), dict):
+        return jsonify({"error": "entries object mapping dates to text is required"}), 400
+    entries = data['entries']
+    invalid_dates = [date_str for date_str in entries if not is_valid_date(date_str)]
+    if invalid_dates:
+        return jsonify({"error": "date format must be YYYY-MM-DD", "invalid_dates": invalid_dates}), 400
+    invalid_texts = [date_str for date_str, text in entries.items() if not isinstance(text, str)]
+    if invalid_texts:
+        return jsonify({"error": "text must be a string", "invalid_dates": invalid_texts}), 400
+    store.put_many(entries)
+    return jsonify({"message": f"{len(entries)} schedule entries saved successfully"})
+
+if __name__ == '__main__':
+    app.run(debug=True)
@@ -0,0 +1,300 @@
+
+"""
+ベンチマーク用に Azure OpenAI の chat.completions を模擬するローカルサーバーを提供します。
+
+- 通常の応答とストリーミング(SSE)応答に対応
+- 応答までの待ち時間(latency)と、1秒あたりに生成するトークン数(token_rate)を設定可能
+- rate_limit_ratio の割合で 429 (Retry-After付き) を返す
+- slow_ratio の割合で、応答開始までの待ち時間を slow_latency 秒にする（まれに極端に遅い応答を再現する）
+- invalid_ratio の割合で、作業日報の抽出結果を途中で切れたJSONにする（抽出の失敗を再現する）
+- response_format に JSONスキーマが指定された場合や、プロンプトで作業日報のフォーマット（"work_date"）を指示された場合は、
+  作業日報の抽出結果として妥当なJSONを返す
+  （複数の画像をまとめた PackedDescriptions / "reports" の場合は、メッセージ中の file_name ごとに1件ずつ返す）
+
+単体で起動する場合:
+    python mock_openai_server.py --port 8765 --latency 0.5
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# response_format 指定時に返す作業日報の抽出結果
+SAMPLE_REPORT = {
+    "work_date": "2024/02/01",
+    "name": "鈴木一郎",
+    "items": [
+        {"hinmei": "タイヤ", "quantity": 10, "start_time": "09:30", "end_time": "11:20"},
+        {"hinmei": "ホイール", "quantity": 5, "start_time": "13:00", "end_time": "15:45"},
+    ],
+}
+
+
+def message_texts(messages):
+    """メッセージ中のテキストを順に返す"""
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            yield content
+        elif isinstance(content, list):
+            for part in content:
+                if part.get("type") == "text":
+                    yield part.get("text", "")
+
+
+def packed_reports(messages):
+    """メッセージ中の "file_name: ..." ごとに、作業日報の抽出結果を1件ずつ並べたJSONを返す"""
+    reports = []
+    for message in messages:
+        content = message.get("content")
+        if not isinstance(content, list):
+            continue
+        for part in content:
+            text = part.get("text", "") if part.get("type") == "text" else ""
+            if text.startswith("file_name: "):
+                reports.append({"file_name": text[len("file_name: "):], **SAMPLE_REPORT})
+    return {"reports": reports}
+
+
+class MockOpenAIServer:
+    """
+    chat.completions を模擬するHTTPサーバー（別スレッドで動作する）
+
+    with文で使うと、ブロックを抜けるときにサーバーを停止する。
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.2, token_rate=200.0,
+                 completion_tokens=100, rate_limit_ratio=0.0, retry_after=0.1, seed=None,
+                 slow_ratio=0.0, slow_latency=5.0, invalid_ratio=0.0):
+        """
+        Args:
+            host (str, optional): 待ち受けるアドレス
+            port (int, optional): 待ち受けるポート。0なら空いているポートを使う
+            latency (float, optional): 最初のトークンを返すまでの秒数
+            token_rate (float, optional): 1秒あたりに生成するトークン数
+            completion_tokens (int, optional): 1回の応答で生成するトークン数
+            rate_limit_ratio (float, optional): 429を返すリクエストの割合(0～1)
+            retry_after (float, optional): 429で返すRetry-Afterの秒数
+            seed (int, optional): 429を返すかどうか、遅い応答にするかどうかを決める乱数のシード
+            slow_ratio (float, optional): 応答開始までの待ち時間を slow_latency 秒にするリクエストの割合(0～1)
+            slow_latency (float, optional): 遅い応答の、最初のトークンを返すまでの秒数
+            invalid_ratio (float, optional): 作業日報の抽出結果を途中で切れたJSONにするリクエストの割合(0～1)
+        """
+        self.latency = latency
+        self.token_rate = token_rate
+        self.completion_tokens = completion_tokens
+        self.rate_limit_ratio = rate_limit_ratio
+        self.retry_after = retry_after
+        self.slow_ratio = slow_ratio
+        self.slow_latency = slow_latency
+        self.invalid_ratio = invalid_ratio
+        self.requests = 0
+        self.rate_limited = 0
+        self.slow = 0
+        self.invalid = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        """AzureOpenAIクライアントの azure_endpoint に指定するURL"""
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def api_data(self, model="mock-model"):
+        """
+        load_api_data() が返すのと同じ形式の、このサーバーへの接続情報を返す
+        """
+        return {
+            "azure_endpoint": self.url,
+            "api_key": "mock-key",
+            "api_version": "2024-10-21",
+            "model": model,
+        }
+
+    def stats(self):
+        """受け付けたリクエスト数と、そのうち429を返した数、遅い応答にした数、不正なJSONを返した数を返す"""
+        with self._lock:
+            return {"requests": self.requests, "rate_limited": self.rate_limited, "slow": self.slow,
+                    "invalid": self.invalid}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _should_rate_limit(self):
+        with self._lock:
+            self.requests += 1
+            limited = self._random.random() < self.rate_limit_ratio
+            if limited:
+                self.rate_limited += 1
+            return limited
+
+    def _first_token_latency(self):
+        with self._lock:
+            slow = self._random.random() < self.slow_ratio
+            if slow:
+                self.slow += 1
+        return self.slow_latency if slow else self.latency
+
+    def _should_break_json(self):
+        with self._lock:
+            broken = self._random.random() < self.invalid_ratio
+            if broken:
+                self.invalid += 1
+            return broken
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                if not self.path.split("?")[0].endswith("/chat/completions"):
+                    self._send_json(404, {"error": {"code": "404", "message": "not found"}})
+                    return
+                if server._should_rate_limit():
+                    self._send_json(
+                        429,
+                        {"error": {"code": "429", "message": "Rate limit exceeded (mock)"}},
+                        {"Retry-After": str(server.retry_after)},
+                    )
+                    return
+
+                model = body.get("model", "mock-model")
+                prompt_tokens = length // 4
+                response_format = body.get("response_format") or {}
+                messages = body.get("messages", [])
+                prompt = "".join(message_texts(messages))
+                if response_format.get("type") == "json_schema" or '"work_date"' in prompt:
+                    schema_name = response_format.get("json_schema", {}).get("name")
+                    if schema_name == "PackedDescriptions" or '{"reports"' in prompt:
+                        report = packed_reports(messages)
+                    else:
+                        report = SAMPLE_REPORT
+                    text = json.dumps(report, ensure_ascii=False)
+                    if server._should_break_json():
+                        text = text[:len(text) // 2]
+                    pieces = [text]
+                else:
+                    pieces = [f"モック応答{i} " for i in range(server.completion_tokens)]
+
+                latency = server._first_token_latency()
+                if body.get("stream"):
+                    self._send_stream(model, pieces, latency)
+                else:
+                    time.sleep(latency + len(pieces) / server.token_rate)
+                    self._send_json(200, {
+                        "id": "chatcmpl-mock",
+                        "object": "chat.completion",
+                        "created": int(time.time()),
+                        "model": model,
+                        "choices": [{
+                            "index": 0,
+                            "message": {"role": "assistant", "content": "".join(pieces)},
+                            "finish_reason": "stop",
+                        }],
+                        "usage": {
+                            "prompt_tokens": prompt_tokens,
+                            "completion_tokens": len(pieces),
+                            "total_tokens": prompt_tokens + len(pieces),
+                        },
+                    })
+
+            def _send_json(self, status, payload, headers=None):
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _write_chunk(self, data):
+                # HTTP/1.1 の chunked 転送で1チャンク書き出す
+                self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+                self.wfile.flush()
+
+            def _send_event(self, payload):
+                self._write_chunk(f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8"))
+
+            def _send_stream(self, model, pieces, latency):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+
+                def chunk(delta, finish_reason=None):
+                    return {
+                        "id": "chatcmpl-mock",
+                        "object": "chat.completion.chunk",
+                        "created": int(time.time()),
+                        "model": model,
+                        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+                    }
+
+                time.sleep(latency)
+                self._send_event(chunk({"role": "assistant", "content": ""}))
+                for piece in pieces:
+                    self._send_event(chunk({"content": piece}))
+                    time.sleep(1 / server.token_rate)
+                self._send_event(chunk({}, "stop"))
+                self._write_chunk(b"data: [DONE]\n\n")
+                self._write_chunk(b"")
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Azure OpenAI chat.completions のモックサーバー")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--token-rate", type=float, default=200.0)
+    parser.add_argument("--completion-tokens", type=int, default=100)
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.0)
+    parser.add_argument("--slow-ratio", type=float, default=0.0)
+    parser.add_argument("--slow-latency", type=float, default=5.0)
+    args = parser.parse_args()
+
+    server = MockOpenAIServer(
+        port=args.port,
+        latency=args.latency,
+        token_rate=args.token_rate,
+        completion_tokens=args.completion_tokens,
+        rate_limit_ratio=args.rate_limit_ratio,
+        slow_ratio=args.slow_ratio,
+        slow_latency=args.slow_latency,
+    )
+    print(f"モックサーバーを起動しました: {server.url}")
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,399 @@
+
+"""
+ローカルのモックサーバー (mock_openai_server.py) を相手に、各スクリプトの処理性能を測定するベンチマークです。
+
+測定対象:
+    get_response         : api_utils2.get_response（通常応答）を concurrency 並列で requests 回（--hedge でヘッジあり）
+    get_response_stream  : api_utils2.get_response(stream=True) の最初のチャンクまでの時間(TTFT)と全体の時間
+    process_pdf_to_text  : 3_図表資料のテキスト化.process_pdf_to_text（サンプルPDF）
+    daily_reports        : 4_作業日報集計.main（サンプル画像を reports 枚に増やしたフォルダ）
+    retry_failed_reports : 抽出に失敗した日報が、次の実行でキャッシュではなくAPIに送り直されることの確認
+    schedule_api         : app.py の GET/POST /api/schedule（JSON/SQLiteそれぞれ years 年分のデータ）
+
+各測定は別プロセスで実行し、スループット、p50/p95/p99のレイテンシ、TTFT、ピークメモリ(RSS)を記録します。
+結果は JSON で保存し、--compare に以前の結果を指定すると差分を表示します。
+
+使い方:
+    python benchmarks/run_benchmarks.py --latency 0.3 --concurrency 8
+    python benchmarks/run_benchmarks.py --workloads get_response,schedule_api --compare benchmarks/results/前回.json
+    python benchmarks/run_benchmarks.py --workloads get_response --slow-ratio 0.02 --hedge
+"""
+
+import argparse
+import contextlib
+import importlib
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+SOURCE_DIR = os.path.join(ROOT_DIR, "ソースコード")
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+
+# 測定用のプロセスで、ルートのモジュール(app, api_utils2)と ソースコード のモジュールを読み込めるようにする
+for path in (BENCH_DIR, ROOT_DIR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+if SOURCE_DIR not in sys.path:
+    sys.path.append(SOURCE_DIR)
+
+from telemetry import percentile
+
+WORKLOADS = {}
+
+
+def workload(name):
+    """測定対象の関数を登録するデコレーター"""
+    def register(func):
+        WORKLOADS[name] = func
+        return func
+    return register
+
+
+def latency_summary(latencies):
+    """レイテンシ（秒）の一覧を集計した辞書を返す"""
+    if not latencies:
+        return {"count": 0}
+    return {
+        "count": len(latencies),
+        "mean": sum(latencies) / len(latencies),
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "max": max(latencies),
+    }
+
+
+def peak_rss_mb():
+    """このプロセスのピークメモリ使用量(MB)を返す（取得できない環境ではNone）"""
+    try:
+        import resource
+    except ImportError:  # Windows
+        try:
+            import psutil
+        except ImportError:
+            return None
+        return psutil.Process().memory_info().peak_wset / (1024 * 1024)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux は KB 単位、macOS はバイト単位
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def write_api_json(api_data, path="api_gpt4o.json"):
+    """スクリプトが読み込むAPI接続情報ファイルを、モックサーバー向けの内容で作成する"""
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(api_data, f)
+
+
+def timed_calls(func, count, concurrency):
+    """func(i) を concurrency 並列で count 回呼び出し、(全体の秒数, 各呼び出しの秒数) を返す"""
+    def run(i):
+        start = time.perf_counter()
+        func(i)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(executor.map(run, range(count)))
+    return time.perf_counter() - start, latencies
+
+
+@workload("get_response")
+def bench_get_response(config):
+    import api_utils2
+    client, model = api_utils2.create_client(config["api_data"])
+    hedging = api_utils2.Hedging() if config.get("hedge") else None
+    wall, latencies = timed_calls(
+        lambda i: api_utils2.get_response(client, model, f"質問{i}", hedging=hedging),
+        config["requests"], config["concurrency"],
+    )
+    result = {
+        "wall_seconds": wall,
+        "throughput_per_second": config["requests"] / wall,
+        "latency": latency_summary(latencies),
+    }
+    if hedging is not None:
+        result["hedges"] = hedging.hedges
+        result["hedge_wins"] = hedging.hedge_wins
+    return result
+
+
+@workload("get_response_stream")
+def bench_get_response_stream(config):
+    import api_utils2
+    client, model = api_utils2.create_client(config["api_data"])
+    ttfts = []
+
+    def call(i):
+        start = time.perf_counter()
+        first = None
+        for _ in api_utils2.get_response(client, model, f"質問{i}", stream=True):
+            if first is None:
+                first = time.perf_counter() - start
+        ttfts.append(first)
+
+    wall, latencies = timed_calls(call, config["requests"], config["concurrency"])
+    return {
+        "wall_seconds": wall,
+        "throughput_per_second": config["requests"] / wall,
+        "latency": latency_summary(latencies),
+        "ttft": latency_summary([t for t in ttfts if t is not None]),
+    }
+
+
+@workload("process_pdf_to_text")
+def bench_process_pdf_to_text(config):
+    import fitz
+    module = importlib.import_module("3_図表資料のテキスト化")
+    write_api_json(config["api_data"])
+    pdf_path = shutil.copy(os.path.join(SOURCE_DIR, "3_図表資料サンプル.pdf"), "sample.pdf")
+    with fitz.open(pdf_path) as doc:
+        pages = doc.page_count
+
+    start = time.perf_counter()
+    module.process_pdf_to_text(pdf_path, "pages", max_in_flight=config["concurrency"], use_cache=False)
+    wall = time.perf_counter() - start
+    return {"wall_seconds": wall, "pages": pages, "throughput_per_second": pages / wall}
+
+
+def make_report_images(folder, count):
+    """サンプルの日報画像を、1画素ずつ変えて count 枚に増やす（ファイルの内容が別になるようにする）
+
+    送信前の縮小で1画素の違いは消え、応答キャッシュには当たってしまうため、
+    計測ではキャッシュを使わずに実行する。
+    """
+    from PIL import Image
+    samples_dir = os.path.join(SOURCE_DIR, "4_作業日報")
+    samples = sorted(os.path.join(samples_dir, name) for name in os.listdir(samples_dir) if name.lower().endswith(".jpg"))
+    os.makedirs(folder, exist_ok=True)
+    for i in range(count):
+        with Image.open(samples[i % len(samples)]) as img:
+            img = img.convert("RGB")
+            img.putpixel((0, 0), (i % 256, (i // 256) % 256, 0))
+            img.save(os.path.join(folder, f"report{i:05d}.jpg"), quality=95)
+
+
+@workload("daily_reports")
+def bench_daily_reports(config):
+    module = importlib.import_module("4_作業日報集計")
+    write_api_json(config["api_data"])
+    make_report_images("4_作業日報", config["reports"])
+
+    start = time.perf_counter()
+    module.main(max_workers=config["concurrency"], pack=config.get("pack", False), use_cache=False)
+    wall = time.perf_counter() - start
+    return {"wall_seconds": wall, "reports": config["reports"], "throughput_per_second": config["reports"] / wall}
+
+
+@workload("retry_failed_reports")
+def bench_retry_failed_reports(config):
+    """
+    1回目の実行では全ての応答を不正なJSONにし、2回目の実行で失敗した日報がAPIに送り直されることを確かめる
+    （不正な応答がキャッシュに残っていると、2回目もAPIを呼ばずに同じ失敗を繰り返す）
+    """
+    from mock_openai_server import MockOpenAIServer
+    module = importlib.import_module("4_作業日報集計")
+    reports = min(config["reports"], 4)
+    make_report_images("4_作業日報", reports)
+
+    with MockOpenAIServer(latency=0.0, invalid_ratio=1.0) as server:
+        write_api_json(server.api_data())
+        module.main(max_workers=config["concurrency"])
+        first = server.stats()["requests"]
+        server.invalid_ratio = 0.0
+        module.main(max_workers=config["concurrency"])
+        second = server.stats()["requests"] - first
+    if second < reports:
+        raise AssertionError(f"失敗した{reports}件の日報のうち、2回目の実行でAPIに送られたのは{second}件です")
+    return {"reports": reports, "first_run_requests": first, "second_run_requests": second}
+
+
+@workload("schedule_api")
+def bench_schedule_api(config):
+    import app as app_module
+    from schedule_store import create_store
+
+    rng = random.Random(0)
+    years = config["years"]
+    first_year = 2020
+    entries = {}
+    for year in range(first_year, first_year + years):
+        for month in range(1, 13):
+            for day in range(1, 29):
+                entries[f"{year}-{month:02d}-{day:02d}"] = f"予定 {year}/{month}/{day}"
+
+    results = {}
+    client = app_module.app.test_client()
+    for backend in ("json", "sqlite"):
+        app_module.store = create_store(backend, f"schedule_{backend}.json", f"schedule_{backend}.sqlite3")
+        client.post("/api/schedule/bulk", json={"entries": entries})
+
+        def get(i):
+            year = rng.randrange(first_year, first_year + years)
+            response = client.get(f"/api/schedule?year={year}&month={rng.randint(1, 12)}")
+            assert response.status_code == 200
+
+        def post(i):
+            response = client.post("/api/schedule", json={"date": f"{first_year}-01-{i % 28 + 1:02d}", "text": f"更新{i}"})
+            assert response.status_code == 200
+
+        get_wall, get_latencies = timed_calls(get, config["requests"], config["concurrency"])
+        post_wall, post_latencies = timed_calls(post, config["requests"], config["concurrency"])
+        results[backend] = {
+            "entries": len(entries),
+            "get": {"throughput_per_second": config["requests"] / get_wall, "latency": latency_summary(get_latencies)},
+            "post": {"throughput_per_second": config["requests"] / post_wall, "latency": latency_summary(post_latencies)},
+        }
+    return results
+
+
+def run_worker(name, config_json, result_path):
+    """測定用のプロセスで1つの測定を実行し、結果を result_path に書き出す"""
+    config = json.loads(config_json)
+    # スクリプトの進捗表示は捨てる
+    with open(os.devnull, "w", encoding="utf-8") as devnull, contextlib.redirect_stdout(devnull):
+        result = WORKLOADS[name](config)
+    result["peak_rss_mb"] = peak_rss_mb()
+    with open(result_path, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False)
+
+
+def run_in_subprocess(name, config):
+    """測定ごとに作業フォルダを分けた別プロセスで実行し、結果を返す"""
+    with tempfile.TemporaryDirectory(prefix=f"bench_{name}_") as work_dir:
+        result_path = os.path.join(work_dir, "result.json")
+        completed = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--worker", name,
+             "--config", json.dumps(config), "--result", result_path],
+            cwd=work_dir,
+        )
+        if completed.returncode != 0:
+            # 1つの測定が失敗しても残りの測定は続ける
+            return {"error": f"exit status {completed.returncode}"}
+        with open(result_path, encoding="utf-8") as f:
+            return json.load(f)
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def flatten_metrics(result, prefix=""):
+    """比較用に、結果の中の数値を "a.b.c" 形式のキーで取り出す"""
+    metrics = {}
+    for key, value in result.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            metrics.update(flatten_metrics(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            metrics[name] = value
+    return metrics
+
+
+def print_comparison(previous, current):
+    """以前の結果と今回の結果で、スループット・レイテンシ・メモリの変化を表示する"""
+    print(f"\n比較: {previous.get('git_commit')} ({previous.get('timestamp')}) → {current.get('git_commit')}")
+    old = flatten_metrics(previous["results"])
+    new = flatten_metrics(current["results"])
+    watched = ("throughput_per_second", "p50", "p95", "p99", "peak_rss_mb", "wall_seconds")
+    for key in sorted(new):
+        if key in old and key.endswith(watched) and old[key]:
+            change = (new[key] - old[key]) / old[key]
+            print(f"  {key:60s} {old[key]:12.4f} → {new[key]:12.4f} ({change:+.1%})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="モックサーバーを使ったベンチマーク")
+    parser.add_argument("--workloads", default=",".join(WORKLOADS), help="カンマ区切りの測定対象")
+    parser.add_argument("--latency", type=float, default=0.2, help="モックサーバーの応答開始までの秒数")
+    parser.add_argument("--token-rate", type=float, default=200.0, help="モックサーバーの1秒あたりの生成トークン数")
+    parser.add_argument("--completion-tokens", type=int, default=100, help="モックサーバーの1応答あたりのトークン数")
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.0, help="429を返すリクエストの割合")
+    parser.add_argument("--slow-ratio", type=float, default=0.0, help="モックサーバーが極端に遅い応答を返すリクエストの割合")
+    parser.add_argument("--slow-latency", type=float, default=5.0, help="極端に遅い応答の、応答開始までの秒数")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=100, help="get_response / schedule_api の呼び出し回数")
+    parser.add_argument("--reports", type=int, default=50, help="daily_reports の日報画像の枚数")
+    parser.add_argument("--years", type=int, default=10, help="schedule_api のデータの年数")
+    parser.add_argument("--pack", action="store_true", help="daily_reports で複数の画像を1回のリクエストにまとめて送る")
+    parser.add_argument("--hedge", action="store_true", help="get_response で遅いリクエストを重複して送る（ヘッジ）")
+    parser.add_argument("--output", help="結果のJSONファイル（省略時は benchmarks/results/日時.json）")
+    parser.add_argument("--compare", help="比較する以前の結果のJSONファイル")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--config", help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker, args.config, args.result)
+        return
+
+    from mock_openai_server import MockOpenAIServer
+
+    names = [name.strip() for name in args.workloads.split(",") if name.strip()]
+    unknown = [name for name in names if name not in WORKLOADS]
+    if unknown:
+        parser.error(f"unknown workloads: {', '.join(unknown)}")
+
+    report = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "git_commit": git_commit(),
+        "config": {key: value for key, value in vars(args).items()
+                   if key not in ("worker", "config", "result", "output", "compare")},
+        "results": {},
+    }
+
+    server = MockOpenAIServer(
+        latency=args.latency,
+        token_rate=args.token_rate,
+        completion_tokens=args.completion_tokens,
+        rate_limit_ratio=args.rate_limit_ratio,
+        slow_ratio=args.slow_ratio,
+        slow_latency=args.slow_latency,
+        seed=0,
+    )
+    with server:
+        for name in names:
+            config = {
+                "api_data": server.api_data(),
+                "concurrency": args.concurrency,
+                "requests": args.requests,
+                "reports": args.reports,
+                "years": args.years,
+                "pack": args.pack,
+                "hedge": args.hedge,
+            }
+            before = server.stats()
+            print(f"測定中: {name}")
+            result = run_in_subprocess(name, config)
+            after = server.stats()
+            result["server"] = {key: after[key] - before[key] for key in after}
+            report["results"][name] = result
+            print(json.dumps(result, ensure_ascii=False, indent=2))
+
+    output = args.output or os.path.join(RESULTS_DIR, datetime.now().strftime("%Y%m%d_%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"結果を保存しました: {output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            print_comparison(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
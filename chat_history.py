@@ -0,0 +1,144 @@
+
+"""
+チャット履歴をトークン数の上限内に収めて送信するための履歴マネージャーを提供します。
+
+古いメッセージは送信対象から外し、要約関数が指定されていれば外したメッセージを要約して
+1件のシステムメッセージとして先頭に付けます。要約は外すメッセージが出たときにだけ作り直し、
+それ以外のターンでは保存済みの要約を使い回します。
+"""
+
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken が無い環境では文字数で概算する
+    tiktoken = None
+
+# gpt-4o / o3-mini 系のトークナイザー
+ENCODING_NAME = "o200k_base"
+
+# 1メッセージあたりの役割名などの付加トークン数（概算）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+@lru_cache(maxsize=1)
+def _get_encoding():
+    if tiktoken is None:
+        return None
+    try:
+        # 初回はエンコーディングのファイルをダウンロードするため、オフラインでは失敗する
+        return tiktoken.get_encoding(ENCODING_NAME)
+    except Exception:
+        return None
+
+
+@lru_cache(maxsize=4096)
+def count_tokens(text: str) -> int:
+    """
+    文字列のトークン数を数える。同じ文字列は2回目以降キャッシュから返す。
+
+    Args:
+        text (str): 対象の文字列
+
+    Returns:
+        int: トークン数（tiktoken が使えない場合は文字数。日本語ではほぼ上限側の見積もりになる）
+    """
+    encoding = _get_encoding()
+    if encoding is None:
+        return len(text)
+    return len(encoding.encode(text))
+
+
+def message_tokens(message: Dict[str, Any]) -> int:
+    """
+    1件のメッセージのトークン数を返す。
+
+    Args:
+        message (Dict[str, Any]): {"role": ..., "content": ...} 形式のメッセージ
+
+    Returns:
+        int: 本文と付加分を合わせたトークン数
+    """
+    return count_tokens(str(message["content"])) + MESSAGE_OVERHEAD_TOKENS
+
+
+class ChatHistoryManager:
+    """
+    送信するチャット履歴をトークン数の上限内に収める履歴マネージャー
+
+    送信対象（ウィンドウ）が max_tokens を超えたら、古い側から low_watermark の割合まで
+    まとめて外す。一度に多めに外すことで、要約の作り直しは数ターンに1回で済む。
+    インスタンスはセッションの間保持して使う（Streamlitでは st.session_state に置く）。
+    """
+
+    def __init__(self, max_tokens: int = 16000, low_watermark: float = 0.75,
+                 summarizer: Optional[Callable[[str, List[Dict[str, Any]]], str]] = None):
+        """
+        Args:
+            max_tokens (int): 送信する履歴（要約を含む）のトークン数の上限
+            low_watermark (float): 上限を超えたときに、上限のこの割合まで古いメッセージを外す
+            summarizer (Callable, optional): (これまでの要約, 新たに外したメッセージ) を受け取り、
+                新しい要約を返す関数。省略時は外したメッセージを単に捨てる
+        """
+        self.max_tokens = max_tokens
+        self.low_watermark = low_watermark
+        self.summarizer = summarizer
+        self.summary = ""
+        self.window_start = 0  # 送信対象の先頭メッセージの位置（これより前は要約済み）
+
+    def _summary_message(self, summary: Optional[str] = None) -> Optional[Dict[str, str]]:
+        if summary is None:
+            summary = self.summary
+        if not summary:
+            return None
+        return {"role": "system", "content": f"これまでの会話の要約:\n{summary}"}
+
+    def _summary_tokens(self, summary: str) -> int:
+        summary_message = self._summary_message(summary)
+        return message_tokens(summary_message) if summary_message else 0
+
+    def build_messages(self, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        履歴全体から、送信するメッセージのリストを作る。
+
+        Args:
+            messages (List[Dict[str, Any]]): 先頭から順に追加されていく履歴全体
+
+        Returns:
+            List[Dict[str, Any]]: 要約（あれば）と最近のメッセージからなる、上限内のメッセージ
+        """
+        if self.window_start > len(messages):
+            # 履歴がリセットされた
+            self.summary = ""
+            self.window_start = 0
+
+        summary_used = self._summary_tokens(self.summary)
+        window_used = sum(message_tokens(m) for m in messages[self.window_start:])
+
+        if summary_used + window_used > self.max_tokens:
+            # 最新のメッセージは必ず残し、古い側から目標値まで外す。
+            # 新しい要約も含めて目標値に収まるまで、外して要約し直すことを繰り返す
+            target = self.max_tokens * self.low_watermark
+            summary = self.summary
+            new_start = self.window_start
+            while True:
+                start = new_start
+                while summary_used + window_used > target and new_start < len(messages) - 1:
+                    window_used -= message_tokens(messages[new_start])
+                    new_start += 1
+                dropped = messages[start:new_start]
+                if self.summarizer is None or not dropped:
+                    break
+                summary = self.summarizer(summary, dropped)
+                summary_used = self._summary_tokens(summary)
+                if summary_used + window_used <= target:
+                    break
+            # 要約が例外で失敗した場合は状態を変えず、次のターンで同じメッセージから要約し直す
+            self.summary = summary
+            self.window_start = new_start
+
+        summary_message = self._summary_message()
+
+        window = messages[self.window_start:]
+        return [summary_message, *window] if summary_message else list(window)
@@ -0,0 +1,228 @@
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+
+def load_schedule(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        try:
+            return json.load(f)
+        except json.JSONDecodeError:
+            return {}
+
+
+def save_schedule(data, path):
+    # Write to a temporary file in the same directory and rename it over the
+    # old file, so readers see either the old or the new file, never a
+    # partially written one.
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.schedule-', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+@contextmanager
+def file_lock(path):
+    """Hold an exclusive lock on path + '.lock' across threads and processes."""
+    with open(path + '.lock', 'a+b') as f:
+        if os.name == 'nt':
+            import msvcrt
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def index_by_month(schedule):
+    """Group schedule entries by (year, month); keys that are not dates are skipped."""
+    by_month = {}
+    for date_str, text in schedule.items():
+        try:
+            dt = datetime.strptime(date_str, '%Y-%m-%d')
+        except ValueError:
+            continue
+        by_month.setdefault((dt.year, dt.month), {})[date_str] = text
+    return by_month
+
+
+def _file_signature(path):
+    # inode, mtime and size change whenever any process rewrites the file
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+class JsonScheduleStore:
+    """Keeps the whole schedule in a single JSON file (the original format).
+
+    The parsed file and a month index are cached in memory and reloaded only
+    when the file's signature (inode, mtime, size) changes, so a GET is a
+    stat() plus a dictionary lookup. Other processes writing the file are
+    picked up through the changed signature.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._signature = None
+        self._by_month = None
+
+    def _month_index(self):
+        signature = _file_signature(self.path)
+        with self._lock:
+            if self._by_month is None or signature != self._signature:
+                self._by_month = index_by_month(load_schedule(self.path))
+                self._signature = signature
+            return self._by_month
+
+    def get_month(self, year, month):
+        # the returned dict is shared by readers and must not be modified;
+        # writes replace the index instead of updating it in place
+        return self._month_index().get((year, month), {})
+
+    def put(self, date_str, text):
+        self.put_many({date_str: text})
+
+    def put_many(self, entries):
+        # the file lock serialises read-modify-write across workers, so
+        # concurrent POSTs cannot overwrite each other's entries
+        with file_lock(self.path):
+            schedule = load_schedule(self.path)
+            schedule.update(entries)
+            save_schedule(schedule, self.path)
+            signature = _file_signature(self.path)
+        by_month = index_by_month(schedule)
+        with self._lock:
+            self._by_month = by_month
+            self._signature = signature
+
+
+class SqliteScheduleStore:
+    """Stores one row per date, indexed by (year, month).
+
+    A month lookup only touches the rows of that month and a write only
+    touches one row, so neither grows with the total history size.
+    One connection is opened and shared by all request threads behind a lock.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS schedule ('
+            ' date TEXT PRIMARY KEY,'
+            ' year INTEGER NOT NULL,'
+            ' month INTEGER NOT NULL,'
+            ' text TEXT NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS schedule_year_month ON schedule(year, month)')
+        self._conn.commit()
+
+    def is_empty(self):
+        with self._lock:
+            return self._conn.execute('SELECT 1 FROM schedule LIMIT 1').fetchone() is None
+
+    def get_month(self, year, month):
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT date, text FROM schedule WHERE year = ? AND month = ? ORDER BY date',
+                (year, month),
+            )
+            return dict(rows.fetchall())
+
+    def put(self, date_str, text):
+        self.put_many({date_str: text})
+
+    def put_many(self, entries):
+        rows = []
+        for date_str, text in entries.items():
+            dt = datetime.strptime(date_str, '%Y-%m-%d')
+            rows.append((date_str, dt.year, dt.month, text))
+        # one transaction (and one fsync) for the whole batch
+        with self._lock, self._conn:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO schedule (date, year, month, text) VALUES (?, ?, ?, ?)',
+                rows,
+            )
+
+    def import_json(self, json_path):
+        """Copy the entries of a schedule_data.json file into the database.
+
+        Keys that are not valid YYYY-MM-DD dates and null values are skipped;
+        other non-string values are stored as their JSON text. Returns the
+        number of imported entries.
+        """
+        rows = []
+        for date_str, text in load_schedule(json_path).items():
+            try:
+                dt = datetime.strptime(date_str, '%Y-%m-%d')
+            except ValueError:
+                continue
+            if text is None:
+                continue
+            if not isinstance(text, str):
+                text = json.dumps(text, ensure_ascii=False)
+            rows.append((date_str, dt.year, dt.month, text))
+        with self._lock, self._conn:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO schedule (date, year, month, text) VALUES (?, ?, ?, ?)',
+                rows,
+            )
+        return len(rows)
+
+
+def create_store(backend, json_path, db_path):
+    """Create the schedule store for the given backend name ('json' or 'sqlite').
+
+    A new, empty SQLite database is seeded from the JSON file if one exists.
+    This is a one-way migration: later writes go only to the database, so
+    the JSON file goes stale and switching back to 'json' does not see them.
+    """
+    if backend == 'json':
+        return JsonScheduleStore(json_path)
+    if backend == 'sqlite':
+        store = SqliteScheduleStore(db_path)
+        if store.is_empty() and os.path.exists(json_path):
+            store.import_json(json_path)
+        return store
+    raise ValueError(f"unknown schedule backend: {backend}")
+
+
+if __name__ == '__main__':
+    import sys
+
+    if len(sys.argv) != 3:
+        print('usage: python schedule_store.py <schedule_data.json> <schedule_data.sqlite3>')
+        sys.exit(1)
+    count = SqliteScheduleStore(sys.argv[2]).import_json(sys.argv[1])
+    print(f"imported {count} entries")
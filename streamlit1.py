@@ -1,94 +1,168 @@
-import streamlit as st
-import api_utils
-from typing import List, Dict, Any, Tuple
-
-
-def load_api_client(file_path: str) -> Tuple[Any, str]:
-    """
-    API接続情報を読み込み、AIクライアントとモデル名を作成する。
-
-    Args:
-        file_path (str): API接続情報のファイルパス
-
-    Returns:
-        client: AIクライアントオブジェクト
-        model (str): モデル名
-    """
-    api_data = api_utils.load_api_data(file_path)
-    client, model = api_utils.create_client(api_data)
-    return client, model
-
-
-def display_messages(messages: List[Dict[str, str]]) -> None:
-    """
-    セッションステートのメッセージ履歴をStreamlitのチャットメッセージとして表示する。
-
-    Args:
-        messages (List[Dict[str, str]]): メッセージ履歴
-    """
-    for message in messages:
-        with st.chat_message(message["role"]):
-            st.markdown(message["content"])
-
-
-def stream_ai_response(client: Any, model: str, messages: List[Dict[str, str]]) -> str:
-    """
-    AIからの応答をストリーミングで取得し、表示する。
-
-    Args:
-        client: AIクライアントオブジェクト
-        model (str): モデル名
-        messages (List[Dict[str, str]]): チャットメッセージ履歴
-
-    Returns:
-        str: AIの応答内容
-    """
-    response = client.chat.completions.create(
-        messages=[
-            {"role": "system", "content": "あなたは優秀なアシスタントです。"},
-            *messages,
-        ],
-        model=model,
-        stream=True,
-        reasoning_effort="medium"  # low, medium, high
-    )
-
-    response_content = ""
-    message_container = st.empty()
-    for chunk in response:
-        if len(chunk.choices) > 0:
-            message = chunk.choices[0].delta.content
-            try:
-                response_content += message
-            except Exception:
-                response_content += '\n'
-            message_container.markdown(response_content)
-    return response_content
-
-
-def main():
-    st.title("AIチャットアプリ")
-
-    # API接続情報ファイルパス（必要に応じて変更してください）
-    file_path = 'api_o3_mini.json'
-
-    client, model = load_api_client(file_path)
-
-    if "messages" not in st.session_state:
-        st.session_state.messages = []
-
-    display_messages(st.session_state.messages)
-
-    if prompt := st.chat_input("メッセージを入力してください"):
-        st.session_state.messages.append({"role": "user", "content": prompt})
-
-        with st.chat_message("user"):
-            st.markdown(prompt)
-
-        response_content = stream_ai_response(client, model, st.session_state.messages)
-
-        st.session_state.messages.append({"role": "assistant", "content": response_content})
-
-
-if __name__ == "__main__":
-    main()
+import time
+import streamlit as st
+import api_utils
+from chat_history import ChatHistoryManager
+from telemetry import Telemetry
+from typing import List, Dict, Any, Optional, Tuple
+
+# ストリーミング応答のトークン数をテレメトリーに記録するかどうか
+# stream_options に対応した api_version (2024-09-01-preview 以降) の場合だけ True にする
+STREAM_USAGE = False
+
+
+def load_api_client(file_path: str) -> Tuple[Any, str]:
+    """
+    API接続情報を読み込み、AIクライアントとモデル名を取得する。
+    クライアントはプロセス内で共有され、再実行のたびに作り直さない。
+
+    Args:
+        file_path (str): API接続情報のファイルパス
+
+    Returns:
+        client: AIクライアントオブジェクト
+        model (str): モデル名
+    """
+    return api_utils.get_client(file_path)
+
+
+def display_messages(messages: List[Dict[str, str]]) -> None:
+    """
+    セッションステートのメッセージ履歴をStreamlitのチャットメッセージとして表示する。
+
+    Args:
+        messages (List[Dict[str, str]]): メッセージ履歴
+    """
+    for message in messages:
+        with st.chat_message(message["role"]):
+            st.markdown(message["content"])
+
+
+def stream_ai_response(client: Any, model: str, messages: List[Dict[str, str]],
+                       flush_interval: float = 0.05, flush_chars: int = 2000,
+                       telemetry: Optional[Telemetry] = None) -> str:
+    """
+    AIからの応答をストリーミングで取得し、表示する。
+
+    受け取ったチャンクはリストに溜めておき、前回の表示から flush_interval 秒経過するか、
+    未表示の文字数が flush_chars を超えたときだけ画面を更新する。
+    チャンクごとに全文を再描画しないため、長い応答でもトークンあたりの処理量がほぼ一定になる。
+
+    Args:
+        client: AIクライアントオブジェクト
+        model (str): モデル名
+        messages (List[Dict[str, str]]): チャットメッセージ履歴
+        flush_interval (float): 画面を更新する最短間隔（秒）
+        flush_chars (int): この文字数が溜まったら間隔に関わらず画面を更新する
+        telemetry (Telemetry, optional): 応答の所要時間・TTFT・トークン数を記録するテレメトリー
+
+    Returns:
+        str: AIの応答内容
+    """
+    response = api_utils.create_chat_completion(
+        client,
+        telemetry=telemetry,
+        stream_usage=STREAM_USAGE,
+        messages=[
+            {"role": "system", "content": "あなたは優秀なアシスタントです。"},
+            *messages,
+        ],
+        model=model,
+        stream=True,
+        reasoning_effort="medium"  # low, medium, high
+    )
+
+    parts: List[str] = []
+    pending_chars = 0
+    last_flush = time.monotonic()
+    message_container = st.empty()
+    for chunk in response:
+        if len(chunk.choices) == 0:
+            continue
+        message = chunk.choices[0].delta.content
+        if message is None:
+            # 役割だけのチャンクや終了チャンクには本文が無い
+            continue
+        parts.append(message)
+        pending_chars += len(message)
+        now = time.monotonic()
+        if pending_chars >= flush_chars or now - last_flush >= flush_interval:
+            # 連結済みの文字列を1要素にまとめ直し、次回の連結を未表示分だけにする
+            parts = ["".join(parts)]
+            message_container.markdown(parts[0])
+            pending_chars = 0
+            last_flush = now
+
+    response_content = "".join(parts)
+    message_container.markdown(response_content)
+    return response_content
+
+
+def summarize_history(client: Any, model: str, summary: str, messages: List[Dict[str, str]]) -> str:
+    """
+    これまでの要約と、新たに送信対象から外れたメッセージから、新しい要約を作成する。
+
+    Args:
+        client: AIクライアントオブジェクト
+        model (str): モデル名
+        summary (str): これまでの要約（初回は空文字）
+        messages (List[Dict[str, str]]): 新たに送信対象から外れたメッセージ
+
+    Returns:
+        str: 新しい要約
+    """
+    transcript = "\n".join(f"{message['role']}: {message['content']}" for message in messages)
+    content = f"""
+以下の「これまでの要約」と「その後の会話」をまとめて、会話の要約を作成してください。
+- 後の会話で参照されそうな事実、決定事項、数値、ユーザーの要望は残すこと。
+- 要約のみを出力すること。
+
+# これまでの要約
+{summary or "なし"}
+
+# その後の会話
+{transcript}
+"""
+    return api_utils.get_response(client, model, content)
+
+
+def main():
+    st.title("AIチャットアプリ")
+
+    # API接続情報ファイルパス（必要に応じて変更してください）
+    file_path = 'api_o3_mini.json'
+
+    client, model = load_api_client(file_path)
+
+    if "messages" not in st.session_state:
+        st.session_state.messages = []
+
+    # 送信する履歴をトークン数の上限内に収める（要約は再実行をまたいで使い回す）
+    if "history" not in st.session_state:
+        st.session_state.history = ChatHistoryManager(
+            max_tokens=16000,
+            summarizer=lambda summary, messages: summarize_history(client, model, summary, messages),
+        )
+
+    # 応答ごとの所要時間やトークン数をセッションの間記録する
+    if "telemetry" not in st.session_state:
+        st.session_state.telemetry = Telemetry("streamlit")
+
+    display_messages(st.session_state.messages)
+
+    if prompt := st.chat_input("メッセージを入力してください"):
+        st.session_state.messages.append({"role": "user", "content": prompt})
+
+        with st.chat_message("user"):
+            st.markdown(prompt)
+
+        send_messages = st.session_state.history.build_messages(st.session_state.messages)
+        response_content = stream_ai_response(client, model, send_messages, telemetry=st.session_state.telemetry)
+
+        st.session_state.messages.append({"role": "assistant", "content": response_content})
+
+    if st.session_state.telemetry.records:
+        st.sidebar.text(st.session_state.telemetry.report())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,40 +1,185 @@
-
-from api_utils import load_api_data, create_client
-import base64
-
-def encode_image(image_path):
-    with open(image_path,"rb") as image_file:
-        return base64.b64encode(image_file.read()).decode('utf-8')
-
-# API接続情報の読み込み
-api_data = load_api_data("api_gpt4o.json")
-
-# AzureOpenAIクライアントとモデル名の作成
-client, model = create_client(api_data)
-
-image_path =r'2_画像サンプル1.jpg'
-base64_image = encode_image(image_path)
-
-image_path2 =r'2_画像サンプル2.jpg'
-base64_image2 = encode_image(image_path2)
-
-str_system ="あなたは画像について説明する賢いアシスタントです。"
-str_user  = """
-以下の２つの画像を比較して、違う点を全て抽出してください。
-- 抽出した結果はMarkdownで表形式で出力すること。
-""" 
-
-response = client.chat.completions.create(
-    model=model,
-    messages=[
-        {"role":"system","content":str_system},
-        {"role":"user","content":[
-            {"type":"text","text":str_user},
-            {"type":"image_url","image_url":{"url":f"data:image/jpeg;base64,{base64_image}"}},
-            {"type":"image_url","image_url":{"url":f"data:image/jpeg;base64,{base64_image2}"}},
-        ]}
-    ]
-)
-
-print(response.choices[0].message.content)
-
+from api_utils import get_client, get_response, AdaptiveBackoff
+from image_utils import prepare_image, prepare_image_file, image_part, PayloadStats
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import os
+
+try:
+    from image_diff import compare_images
+except ImportError:  # NumPy / Pillow が無い場合は差分を取らずに画像全体を送る
+    compare_images = None
+
+str_system ="あなたは画像について説明する賢いアシスタントです。"
+str_user  = """
+以下の２つの画像を比較して、違う点を全て抽出してください。
+- 抽出した結果はMarkdownで表形式で出力すること。
+"""
+str_user_regions = """
+以下は、変更前と変更後の２つの画像のうち、違いのあった領域だけを切り出したものです。
+領域ごとに「変更前」「変更後」の順に画像を示します。
+領域ごとに違う点を全て抽出してください。
+- 抽出した結果はMarkdownで表形式（列: 領域, 変更前, 変更後）で出力すること。
+"""
+
+# 切り出して送る領域の数と、画像全体に対する面積の割合の上限
+# これを超える場合（大部分が変わっている、位置合わせできないなど）は画像全体を送る
+MAX_REGIONS = 8
+MAX_REGION_AREA = 0.5
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff")
+
+
+def crop_to_url(img, box, payload_stats=None):
+    """
+    画像の一部を切り出し、モデルの実効解像度まで縮小したデータURLを返す
+    """
+    piece = img.crop(box)
+    (url,), sent_bytes, sent_pixels = prepare_image(piece)
+    if payload_stats is not None:
+        payload_stats.add(0, sent_bytes, piece.width * piece.height, sent_pixels)
+    return url
+
+
+def compare_pair(client, model, before_path, after_path, backoff=None, payload_stats=None,
+                 max_regions=MAX_REGIONS, max_region_area=MAX_REGION_AREA):
+    """
+    2枚の画像の違いをAIに抽出させる関数
+
+    先にローカルで画素の差分を取り、違いが無ければAIを呼ばずに返す。
+    違いのあった領域が少なければ、その領域の変更前/変更後だけを切り出して送る。
+    NumPy / Pillow が無い場合は、差分を取らずに2枚の画像全体を送る。
+
+    Args:
+        client (AzureOpenAI): AzureOpenAIクライアントインスタンス
+        model (str): 使用するモデル名
+        before_path (str): 変更前の画像ファイルのパス
+        after_path (str): 変更後の画像ファイルのパス
+        backoff (AdaptiveBackoff, optional): 並行して比較するスレッド間で共有する429時の待機制御
+        payload_stats (PayloadStats, optional): 送信量の集計
+        max_regions (int, optional): 切り出して送る領域の数の上限
+        max_region_area (float, optional): 切り出して送る領域の面積の、画像全体に対する割合の上限
+
+    Returns:
+        tuple: (比較の方法 "同一" / "領域" / "全体", AIの応答またはメッセージ)
+    """
+    diff = compare_images(before_path, after_path) if compare_images is not None else None
+    if diff is not None and not diff.boxes:
+        return "同一", "違いはありません。"
+
+    if diff is not None:
+        width, height = diff.before.size
+        region_area = sum((right - left) * (bottom - top) for left, top, right, bottom in diff.boxes) / (width * height)
+    if diff is None or len(diff.boxes) > max_regions or region_area > max_region_area:
+        # 変化が広範囲に及ぶ場合は、2枚の画像全体を送る（2枚を対応付けて比較するためタイル分割はしない）
+        image_url, = prepare_image_file(before_path, stats=payload_stats)
+        image_url2, = prepare_image_file(after_path, stats=payload_stats)
+        content = [
+            {"type":"text","text":str_user},
+            image_part(image_url),
+            image_part(image_url2),
+        ]
+        return "全体", get_response(client, model, content, system_prompt=str_system, backoff=backoff)
+
+    # 位置合わせ済みの画像から、同じ領域の変更前/変更後を切り出して送る
+    content = [{"type":"text","text":str_user_regions}]
+    for number, box in enumerate(diff.boxes, start=1):
+        left, top, right, bottom = box
+        position = f"x={left}, y={top}, 幅={right - left}, 高さ={bottom - top}"
+        content += [
+            {"type":"text","text":f"領域{number} 変更前 ({position})"},
+            image_part(crop_to_url(diff.before, box, payload_stats)),
+            {"type":"text","text":f"領域{number} 変更後 ({position})"},
+            image_part(crop_to_url(diff.after, box, payload_stats)),
+        ]
+    return "領域", get_response(client, model, content, system_prompt=str_system, backoff=backoff)
+
+
+def find_pairs(before_dir, after_dir):
+    """
+    2つのフォルダで同じファイル名の画像を対にして返す
+
+    Returns:
+        tuple: ((ファイル名, 変更前のパス, 変更後のパス) のリスト, 片方のフォルダにしか無いファイル名のリスト)
+    """
+    def images(folder):
+        return {name for name in os.listdir(folder) if name.lower().endswith(IMAGE_EXTENSIONS)}
+
+    before_names = images(before_dir)
+    after_names = images(after_dir)
+    pairs = [
+        (name, os.path.join(before_dir, name), os.path.join(after_dir, name))
+        for name in sorted(before_names & after_names)
+    ]
+    return pairs, sorted(before_names ^ after_names)
+
+
+def compare_folders(client, model, before_dir, after_dir, output_md, max_workers=4):
+    """
+    2つのフォルダの同じファイル名の画像どうしを並行して比較し、結果をMarkdownファイルに書き出す関数
+
+    Args:
+        client (AzureOpenAI): AzureOpenAIクライアントインスタンス
+        model (str): 使用するモデル名
+        before_dir (str): 変更前の画像のフォルダ
+        after_dir (str): 変更後の画像のフォルダ
+        output_md (str): 結果を書き出すMarkdownファイルのパス
+        max_workers (int, optional): 同時に比較する画像の組の数。デフォルトは4。
+    """
+    pairs, unmatched = find_pairs(before_dir, after_dir)
+    print(f"比較する画像の組: {len(pairs)}件")
+
+    backoff = AdaptiveBackoff()
+    payload_stats = PayloadStats()
+
+    def worker(pair):
+        name, before_path, after_path = pair
+        try:
+            mode, result = compare_pair(client, model, before_path, after_path, backoff, payload_stats)
+        except Exception as e:
+            mode, result = "失敗", f"比較に失敗しました: {e}"
+        print(f"{mode}: {name}")
+        return mode, result
+
+    # 差分の計算（NumPy）とAIの応答待ちを、画像の組ごとに並行して進める
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(worker, pairs))
+
+    counts = {}
+    with open(output_md, "w", encoding="utf-8") as f:
+        f.write("# 画像比較結果\n\n")
+        for (name, _, _), (mode, result) in zip(pairs, results):
+            counts[mode] = counts.get(mode, 0) + 1
+            f.write(f"## {name}（{mode}）\n\n{result}\n\n")
+        if unmatched:
+            f.write("## 片方のフォルダにしか無い画像\n\n")
+            f.write("".join(f"- {name}\n" for name in unmatched))
+
+    print(", ".join(f"{mode}: {count}件" for mode, count in counts.items()))
+    print(payload_stats.summary())
+    print(f"{output_md} に比較結果を出力しました。")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="2つの画像（または2つのフォルダの同じ名前の画像）の違いを抽出する")
+    parser.add_argument("before", nargs="?", default=r'2_画像サンプル1.jpg', help="変更前の画像、またはフォルダ")
+    parser.add_argument("after", nargs="?", default=r'2_画像サンプル2.jpg', help="変更後の画像、またはフォルダ")
+    parser.add_argument("--output", default="2_画像比較結果.md", help="フォルダを比較する場合の結果のファイル")
+    parser.add_argument("--workers", type=int, default=4, help="フォルダを比較する場合に同時に比較する組の数")
+    args = parser.parse_args()
+
+    # AzureOpenAIクライアントとモデル名の取得（API接続情報ファイルごとに共有）
+    client, model = get_client("api_gpt4o.json")
+
+    if os.path.isdir(args.before) and os.path.isdir(args.after):
+        compare_folders(client, model, args.before, args.after, args.output, max_workers=args.workers)
+        return
+
+    payload_stats = PayloadStats()
+    mode, result = compare_pair(client, model, args.before, args.after, payload_stats=payload_stats)
+    print(f"比較の方法: {mode}")
+    print(payload_stats.summary())
+    print(result)
+
+
+if __name__ == "__main__":
+    main()
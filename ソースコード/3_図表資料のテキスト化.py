@@ -1,105 +1,456 @@
-from api_utils import load_api_data, create_client
-import fitz  # PyMuPDF
-import base64
-import os
-
-def encode_image(image_path):
-    """
-    画像ファイルをBase64エンコードする関数
-
-    Args:
-        image_path (str): エンコードする画像ファイルのパス
-
-    Returns:
-        str: Base64エンコードされた文字列
-    """
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode('utf-8')
-
-def process_pdf_to_text(pdf_path, output_folder, dpi=200):
-    """
-    PDFをページごとにJPEG変換し、画像をAIに渡して内容を取得しテキストとして保存する関数
-
-    Args:
-        pdf_path (str): 処理対象のPDFファイルパス
-        output_folder (str): 画像およびテキストの出力先フォルダ
-        dpi (int, optional): 画像変換時の解像度。デフォルトは200。
-
-    処理の流れ:
-        1. API接続情報を読み込み、AzureOpenAIクライアントを作成
-        2. PDFファイルを開き、ページ数を表示
-        3. 各ページをJPEG画像に変換し、指定フォルダに保存
-        4. 画像をBase64エンコードし、AIに送信して内容を取得
-        5. 取得した内容を連結し、テキストファイルとして保存
-        6. 処理完了メッセージを表示
-    """
-    # API接続情報の読み込み
-    api_data = load_api_data("api_gpt4o.json")
-
-    # AzureOpenAIクライアントとモデル名の作成
-    client, model = create_client(api_data)
-
-    # プロンプトの定義
-    str_system = "あなたは画像について説明する賢いアシスタントです。"
-    str_user = """
-以下の画像に含まれる内容を読み取ってください。
-- 文章についてはそのままの文字を読み取ること（つまり、要約などの変換は不要）。
-- 表についてはそのままの内容をMarkdownで出力すること。 
-- 図については読み取れる内容を詳細にMarkdownで出力すること。
-- 全体的に、数値の間違いは無いようにしっかりと確認すること。
-- 読み取った内容のみを出力すること。（ つまり、"以下に画像の内容を読み取った結果を示します。" のようなコメントは不要）  
-"""
-
-    # 出力フォルダがなければ作成
-    os.makedirs(output_folder, exist_ok=True)
-
-    # PDFファイルを開く
-    doc = fitz.open(pdf_path)
-    print(f'ページ数: {doc.page_count}')
-
-    contents_all = ""
-
-    for page_number in range(doc.page_count):
-        print(f'処理中：{page_number + 1}/{doc.page_count}')
-        page = doc.load_page(page_number)
-
-        # PDF → JPEG 変換
-        pix = page.get_pixmap(dpi=dpi)
-
-        # JPEGとして保存
-        image_path = os.path.join(output_folder, f'{page_number}.jpg')
-        pix.save(image_path)
-
-        # JPEG → base64 変換
-        base64_image = encode_image(image_path)
-
-        # base64 を AIで読み取る
-        response = client.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": str_system},
-                {"role": "user", "content": [
-                    {"type": "text", "text": str_user},
-                    {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}},
-
-                ]}
-            ]
-        )
-
-        print(response.choices[0].message.content)
-        contents_all += response.choices[0].message.content + "\n"
-
-    # PDFファイルを閉じる
-    doc.close()
-
-    # 抽出したテキストを保存する
-    output_txt = '3_図表資料サンプルPDFをテキスト化.txt'
-    with open(output_txt, mode='w', encoding='utf-8') as f:
-        f.write(contents_all)
-
-    print("処理完了")
-
-if __name__ == "__main__":
-    pdf_path = r"3_図表資料サンプル.pdf"
-    output_folder = "./3_図表関連"
-    process_pdf_to_text(pdf_path, output_folder)
+from api_utils import get_client, get_responses, set_api_slots, Hedging
+from image_utils import render_page, image_part, PayloadStats
+from response_cache import ResponseCache
+from job_journal import JobJournal, file_hash, make_hash
+from telemetry import Telemetry
+from image_dedup import (PerceptualIndex, Merge, THUMBNAIL_SIZE, pixmap_dhash, pixmap_thumbnail, group_duplicates, hamming,
+                         thumbnails_match, write_merge_report)
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import argparse
+import glob
+import hashlib
+import multiprocessing
+import fitz  # PyMuPDF
+import os
+
+def classify_page(page, min_text_chars=100, max_drawings=10):
+    """
+    ページを、PyMuPDFで文字を抽出すれば済むページか、AIに画像として読ませるページかに分類する関数
+
+    埋め込み画像がある、線などの描画が多い（表や図の可能性が高い）、
+    または抽出できる文字が少ない（スキャン画像など）ページは画像として扱う。
+
+    Args:
+        page (fitz.Page): 分類するページ
+        min_text_chars (int, optional): 文字のみのページとみなすのに必要な文字数。デフォルトは100。
+        max_drawings (int, optional): 文字のみのページとみなせる描画の数の上限。デフォルトは10。
+
+    Returns:
+        tuple: (文字のみのページならTrue, 抽出した文字列)
+    """
+    text = page.get_text()
+    if page.get_images():
+        return False, text
+    if len(page.get_drawings()) > max_drawings:
+        return False, text
+    if len(text.strip()) < min_text_chars:
+        return False, text
+    return True, text
+
+def iter_page_contents(doc, page_numbers, str_user, dpi, output_folder, save_images, tile=False, payload_stats=None):
+    """
+    指定したページをJPEG画像に変換し、AIに送るユーザーメッセージの内容を順に返すジェネレータ
+
+    get_responses から送信枠が空くたびに1ページずつ取り出されるため、
+    応答を待つ間に次のページの変換が進み、メモリ上の画像も送信中のページ分だけで済む。
+
+    Args:
+        doc (fitz.Document): 処理対象のPDF
+        page_numbers (list[int]): AIに送るページ番号（0始まり）
+        str_user (str): ユーザープロンプト
+        dpi (int): 画像変換時の解像度の上限
+        output_folder (str): 画像の出力先フォルダ（save_images=Trueの場合のみ使用）
+        save_images (bool): ページ画像をJPEGファイルとしても保存するかどうか
+        tile (bool, optional): 大きなページをタイルに分割して送るかどうか
+        payload_stats (PayloadStats, optional): 送信量の削減量の集計
+
+    Yields:
+        list: ユーザープロンプトとページ画像からなるメッセージ内容
+    """
+    for page_number in page_numbers:
+        print(f'処理中：{page_number + 1}/{doc.page_count}')
+        page = doc.load_page(page_number)
+
+        # PDF → JPEG → データURL 変換（ディスクを介さず、モデルの実効解像度に合わせて描画する）
+        image_urls, pix = render_page(page, dpi, tile=tile, stats=payload_stats)
+
+        # JPEGとして保存（指定時のみ）
+        if save_images:
+            pix.save(os.path.join(output_folder, f'{page_number}.jpg'))
+        pix = None  # 変換後のピクセルデータはすぐに解放する
+
+        yield [
+            {"type": "text", "text": str_user},
+            *[image_part(image_url) for image_url in image_urls],
+        ]
+
+def page_fingerprint(page, dpi=36):
+    """
+    ページを低い解像度のグレースケールで描画し、同じページを見つけるための知覚ハッシュと、
+    完全に同じ内容かをすぐに確かめるための内容のハッシュ（ページの文字と描画した画素から作る）を返す関数
+    """
+    pix = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY)
+    return pixmap_dhash(pix), make_hash(page.get_text(), hashlib.sha256(pix.samples).hexdigest())
+
+def page_thumbnail(page):
+    """
+    ページを長辺が THUMBNAIL_SIZE のグレースケールで描画し、内容のハッシュが違うページどうしを
+    画素の差分で比べるための縮小画像を返す関数
+    """
+    pix = page.get_pixmap(dpi=int(THUMBNAIL_SIZE * 72 / max(page.rect.width, page.rect.height)), colorspace=fitz.csGRAY)
+    return pixmap_thumbnail(pix)
+
+def process_pdf_to_text(pdf_path, output_folder, dpi=200, max_in_flight=4, save_images=False, use_cache=True, tile=False,
+                        hybrid=False, resume=True, output_txt=None, dedup=False, hedge=False, deadline=None):
+    """
+    PDFをページごとにJPEG変換し、画像をAIに渡して内容を取得しテキストとして保存する関数
+
+    Args:
+        pdf_path (str): 処理対象のPDFファイルパス
+        output_folder (str): 画像の出力先フォルダ（save_images=Trueの場合のみ使用）
+        dpi (int, optional): 画像変換時の解像度の上限。モデルの実効解像度を超える分は描画しない。デフォルトは200。
+        max_in_flight (int, optional): 同時にAIへ送信するページ数の上限。1なら1ページずつ順に処理する。デフォルトは4。
+        save_images (bool, optional): ページ画像をJPEGファイルとしても保存するかどうか。デフォルトはFalse。
+        use_cache (bool, optional): 応答キャッシュを使うかどうか。Trueなら変更のないページはAPIを呼ばない。デフォルトはTrue。
+        tile (bool, optional): 大きな図面のページを dpi で描画し、タイルに分割して送るかどうか。デフォルトはFalse。
+        hybrid (bool, optional): 文字のみのページはPyMuPDFで文字を抽出し、図や表のあるページだけAIに送るかどうか。デフォルトはFalse。
+        resume (bool, optional): 前回までに処理済みのページを飛ばして続きから処理するかどうか。デフォルトはTrue。
+        output_txt (str, optional): 出力するテキストファイルのパス。省略時はPDFと同じ場所に拡張子を.txtにして出力する。
+        dedup (bool, optional): 知覚ハッシュで同じ内容のページ（繰り返し挿入された図や、過去に読み取った資料と同じページ）を
+            見つけ、1ページだけAIに送って結果を使い回すかどうか。デフォルトはFalse。
+        hedge (bool, optional): 応答がこれまでのp95より遅いページは同じリクエストを重複して送り、先に返った応答を使うかどうか。
+            重複して送るのは全体の1割まで。デフォルトはFalse。
+        deadline (float, optional): 1ページの読み取りの期限（秒）。過ぎたページは失敗扱いにし、再実行時に処理し直す。
+
+    Returns:
+        int: 読み取りに失敗したページ数
+
+    処理の流れ:
+        1. API接続情報を読み込み、共有のAzureOpenAIクライアントを取得
+        2. PDFファイルを開き、ページ数を表示。ジャーナルに記録済みのページは飛ばす
+           （hybrid=Trueなら各ページを分類し、文字のみのページはその場で文字を抽出して記録）
+        3. 各ページをメモリ上でJPEG画像に変換（save_images=Trueなら指定フォルダにも保存）
+        4. 画像をデータURLに変換し、AIに送信して内容を取得（最大 max_in_flight ページを並行処理）
+           送信中の応答を待つ間に次のページの画像変換を進め、届いた応答は順次ジャーナルに記録
+        5. ジャーナルからページ順に読み出してテキストファイルに書き出す（失敗したページは印を残す）
+        6. 処理完了メッセージを表示
+    """
+    # API接続情報を読み込み、プロセス内で共有するAzureOpenAIクライアントとモデル名を取得
+    client, model = get_client("api_gpt4o.json")
+
+    # プロンプトの定義
+    str_system = "あなたは画像について説明する賢いアシスタントです。"
+    str_user = """
+以下の画像に含まれる内容を読み取ってください。
+- 文章についてはそのままの文字を読み取ること（つまり、要約などの変換は不要）。
+- 表についてはそのままの内容をMarkdownで出力すること。 
+- 図については読み取れる内容を詳細にMarkdownで出力すること。
+- 全体的に、数値の間違いは無いようにしっかりと確認すること。
+- 読み取った内容のみを出力すること。（ つまり、"以下に画像の内容を読み取った結果を示します。" のようなコメントは不要）  
+"""
+
+    # 画像を保存する場合、出力フォルダがなければ作成
+    if save_images:
+        os.makedirs(output_folder, exist_ok=True)
+
+    # PDFファイルを開く
+    doc = fitz.open(pdf_path)
+    page_count = doc.page_count
+    print(f'ページ数: {page_count}')
+
+    # ページごとの結果をジャーナルに記録し、中断しても続きから再開できるようにする
+    # PDFの内容や設定が変わったページは記録と一致しないため、処理し直す
+    journal = JobJournal(os.path.abspath(pdf_path))
+    if not resume:
+        journal.clear()
+    pdf_hash = file_hash(pdf_path)
+    page_hashes = [
+        make_hash(pdf_hash, page_number, model, str_system, str_user, dpi, tile, hybrid)
+        for page_number in range(page_count)
+    ]
+    pending_pages = [n for n in range(page_count) if not journal.has(str(n), page_hashes[n])]
+    print(f'処理済みのページ: {page_count - len(pending_pages)}/{page_count}')
+
+    # 同じページ画像・プロンプトの応答はキャッシュから返す
+    cache = ResponseCache() if use_cache else None
+
+    # 縮小による送信量の削減量を集計する
+    payload_stats = PayloadStats()
+
+    # API呼び出しごとの所要時間・トークン数を記録する
+    telemetry = Telemetry(os.path.basename(pdf_path), log_path="api_telemetry.jsonl")
+
+    # 極端に遅い応答に全体の時間が引きずられないよう、遅いページは重複して送る
+    hedging = Hedging() if hedge else None
+
+    # 文字のみのページは文字を抽出してそのまま記録し、それ以外のページをAIに送る
+    api_page_numbers = []
+    for page_number in pending_pages:
+        if hybrid:
+            is_text_page, text = classify_page(doc.load_page(page_number))
+            if is_text_page:
+                journal.record(str(page_number), page_hashes[page_number], text.strip())
+                continue
+        api_page_numbers.append(page_number)
+    if hybrid:
+        print(f'文字を抽出したページ: {len(pending_pages) - len(api_page_numbers)}/{len(pending_pages)}')
+
+    # 同じ内容のページは代表の1ページだけをAIに送り、残りは代表の結果を使い回す
+    duplicates = {}  # 代表のページ -> [(同じ内容のページ, 距離), ...]
+    merges = []
+    if dedup:
+        index = PerceptualIndex(make_hash(model, str_system, str_user, dpi, tile))
+
+        def page_key(page_number):
+            # 索引でのページの識別子（"PDFのパス#ページ番号"）
+            return f"{os.path.abspath(pdf_path)}#{page_number + 1}"
+
+        image_hashes = {}
+        page_digests = {}
+        for n in api_page_numbers:
+            image_hashes[n], page_digests[n] = page_fingerprint(doc.load_page(n))
+
+        page_thumbnails = {}
+
+        def thumbnail_of(page_number):
+            # 縮小画像は内容のハッシュが違うページを比べる場合と、索引に保存する場合だけ描画する
+            if page_number not in page_thumbnails:
+                page_thumbnails[page_number] = page_thumbnail(doc.load_page(page_number))
+            return page_thumbnails[page_number]
+
+        def confirm_indexed(page_number, digest, thumbnail):
+            # 索引のページと内容のハッシュが一致するか、保存した縮小画像との画素の差分で変化が無い場合だけ使い回す
+            if digest == page_digests[page_number]:
+                return True
+            return thumbnail is not None and thumbnails_match(thumbnail_of(page_number), thumbnail)
+
+        representatives = []
+        groups = group_duplicates([(n, image_hashes[n]) for n in api_page_numbers])
+        # 知覚ハッシュが近いだけでは数字だけが違う別のページのことがあるため、内容のハッシュが一致するか、
+        # 縮小画像の画素の差分で変化が無いと確かめられた場合だけ使い回す
+        # 代表と同じ内容と確かめられなかったページは、それらだけで新しいグループとして後ろに加えて処理し直す
+        for group in groups:
+            (representative, _), members = group[0], group[1:]
+            confirmed, rest = [], []
+            for n, d in members:
+                if page_digests[n] == page_digests[representative] or thumbnails_match(thumbnail_of(representative), thumbnail_of(n)):
+                    confirmed.append((n, d))
+                else:
+                    rest.append(n)
+            if rest:
+                groups.append([(n, hamming(image_hashes[n], image_hashes[rest[0]])) for n in rest])
+            members = confirmed
+            found = index.find(image_hashes[representative], exclude=page_key(representative),
+                               confirm=lambda key, digest, thumbnail: confirm_indexed(representative, digest, thumbnail))
+            if found is None:
+                representatives.append(representative)
+                duplicates[representative] = members
+                continue
+            # 過去に読み取ったページと同じ内容なら、グループ全体にその結果を使う
+            source, distance, content = found
+            journal.record(str(representative), page_hashes[representative], content)
+            merges.append(Merge(page_key(representative), source, distance, "過去の実行"))
+            for page_number, member_distance in members:
+                journal.record(str(page_number), page_hashes[page_number], content)
+                merges.append(Merge(page_key(page_number), page_key(representative), member_distance, "同じバッチ"))
+        print(f'同じ内容として統合したページ: {len(api_page_numbers) - len(representatives)}/{len(api_page_numbers)}')
+        api_page_numbers = representatives
+
+    def record_page(index, content):
+        # 応答が届いたページから順にジャーナルへ記録する
+        page_number = api_page_numbers[index]
+        journal.record(str(page_number), page_hashes[page_number], content)
+        print(f'ページ{page_number + 1}:')
+        print(content)
+
+    # AIで読み取る（最大 max_in_flight ページを並行して送信する）
+    results = get_responses(
+        client, model,
+        iter_page_contents(doc, api_page_numbers, str_user, dpi, output_folder, save_images, tile, payload_stats),
+        concurrency=max_in_flight,
+        system_prompt=str_system,
+        cache=cache,
+        on_result=record_page,
+        telemetry=telemetry,
+        hedging=hedging,
+        deadline=deadline,
+    )
+    for page_number, result in zip(api_page_numbers, results):
+        if result.error is not None:
+            print(f'ページ{page_number + 1}の読み取りに失敗しました: {result.error}')
+
+    if dedup:
+        # 代表の結果を索引に保存し、同じ内容のページにも使う（代表の読み取りに失敗した場合は再実行時に処理する）
+        for representative, members in duplicates.items():
+            content = journal.get(str(representative), page_hashes[representative])
+            if content is None:
+                continue
+            index.add(page_key(representative), image_hashes[representative], content, page_digests[representative],
+                      thumbnail_of(representative))
+            for page_number, distance in members:
+                journal.record(str(page_number), page_hashes[page_number], content)
+                merges.append(Merge(page_key(page_number), page_key(representative), distance, "同じバッチ"))
+        index.close()
+
+    # PDFファイルを閉じる
+    doc.close()
+
+    print(f"送信画像: {payload_stats.summary()}")
+    print(telemetry.report())
+    if hedging is not None:
+        print(hedging.summary())
+
+    if cache is not None:
+        print(f"キャッシュ: {cache.stats()}")
+        cache.close()
+
+    # ジャーナルからページ順に1ページずつ読み出してテキストファイルに書き出す
+    # （失敗したページは印を残し、再実行時にそのページだけ処理し直す）
+    if output_txt is None:
+        output_txt = os.path.splitext(pdf_path)[0] + '.txt'
+    failed_pages = 0
+    with open(output_txt, mode='w', encoding='utf-8') as f:
+        for page_number in range(page_count):
+            content = journal.get(str(page_number), page_hashes[page_number])
+            if content is None:
+                failed_pages += 1
+                f.write(f"<!-- ページ{page_number + 1}の読み取りに失敗しました -->\n")
+            else:
+                f.write(content + "\n")
+    journal.close()
+
+    if merges:
+        merge_report = os.path.splitext(output_txt)[0] + '_重複統合.csv'
+        write_merge_report(merge_report, merges)
+        print(f"{merge_report} に統合したページの一覧を出力しました。")
+
+    if failed_pages:
+        print(f"{failed_pages}ページの読み取りに失敗しました。再実行すると失敗したページだけを処理します。")
+    print("処理完了")
+    return failed_pages
+
+def find_pdfs(patterns):
+    """
+    ファイル・フォルダ・ワイルドカードの指定から、処理するPDFを探す関数
+
+    フォルダを指定した場合はサブフォルダも含めて探す。
+
+    Args:
+        patterns (list[str]): PDFファイル、フォルダ、またはワイルドカード（例: "資料/**/*.pdf"）
+
+    Returns:
+        list[tuple]: (PDFのパス, 出力先を決めるときの基準フォルダ) のリスト（重複なし）
+    """
+    found = {}
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for path in glob.glob(os.path.join(glob.escape(pattern), "**", "*.pdf"), recursive=True):
+                found.setdefault(os.path.abspath(path), pattern)
+        else:
+            for path in glob.glob(pattern, recursive=True) or [pattern]:
+                if path.lower().endswith(".pdf"):
+                    found.setdefault(os.path.abspath(path), os.path.dirname(path))
+    return sorted(found.items())
+
+
+def output_path_for(pdf_path, base_dir, output_dir):
+    """
+    PDFに対応する出力テキストファイルのパスを返す（output_dir を指定した場合は base_dir からの相対位置に出力）
+    """
+    if output_dir is None:
+        return os.path.splitext(pdf_path)[0] + ".txt"
+    relative = os.path.relpath(pdf_path, os.path.abspath(base_dir or "."))
+    return os.path.join(output_dir, os.path.splitext(relative)[0] + ".txt")
+
+
+def _init_worker(api_slots):
+    # 全てのプロセスで同時送信数の枠を共有する
+    set_api_slots(api_slots)
+
+
+def _convert_document(pdf_path, output_txt, options):
+    os.makedirs(os.path.dirname(os.path.abspath(output_txt)), exist_ok=True)
+    output_folder = os.path.splitext(output_txt)[0] + "_画像"
+    return process_pdf_to_text(pdf_path, output_folder, output_txt=output_txt, **options)
+
+
+def process_documents(pdf_paths, output_dir=None, workers=None, api_concurrency=8, **options):
+    """
+    複数のPDFをプロセスプールで並行してテキスト化する関数
+
+    PDFごとに別のプロセスでページの画像変換を行い、CPUの各コアを使う。
+    APIへの同時送信数は全てのプロセスで共有する api_concurrency 件の枠で制限する。
+
+    Args:
+        pdf_paths (list[tuple]): find_pdfs が返す (PDFのパス, 基準フォルダ) のリスト
+        output_dir (str, optional): 出力先フォルダ。省略時は各PDFと同じ場所に出力する
+        workers (int, optional): 同時に処理するPDFの数（プロセス数）。省略時はCPUのコア数
+        api_concurrency (int, optional): 全体でAPIへ同時に送信するリクエスト数の上限。デフォルトは8。
+        **options: process_pdf_to_text に渡す引数（dpi, max_in_flight, hybrid など）
+
+    Returns:
+        dict: PDFのパス -> 読み取りに失敗したページ数（処理自体が失敗した場合は例外）
+    """
+    workers = workers or os.cpu_count() or 1
+    api_slots = multiprocessing.BoundedSemaphore(api_concurrency)
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(api_slots,)) as executor:
+        futures = {
+            executor.submit(_convert_document, pdf_path, output_path_for(pdf_path, base_dir, output_dir), options): pdf_path
+            for pdf_path, base_dir in pdf_paths
+        }
+        for future in as_completed(futures):
+            pdf_path = futures[future]
+            try:
+                results[pdf_path] = future.result()
+            except Exception as e:
+                results[pdf_path] = e
+            print(f"完了: {len(results)}/{len(futures)} {pdf_path}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PDFをページごとに画像としてAIに読ませ、テキスト化する")
+    parser.add_argument("paths", nargs="*", help="PDFファイル、フォルダ、またはワイルドカード。省略時はサンプルPDFを処理する")
+    parser.add_argument("--output-dir", help="出力先フォルダ。省略時は各PDFと同じ場所に .txt を出力する")
+    parser.add_argument("--workers", type=int, help="同時に処理するPDFの数（プロセス数）。省略時はCPUのコア数")
+    parser.add_argument("--api-concurrency", type=int, default=8, help="全体でAPIへ同時に送信するリクエスト数の上限")
+    parser.add_argument("--max-in-flight", type=int, default=4, help="1つのPDFで同時に送信するページ数の上限")
+    parser.add_argument("--dpi", type=int, default=200)
+    parser.add_argument("--hybrid", action="store_true", help="文字のみのページはAIに送らずに文字を抽出する")
+    parser.add_argument("--tile", action="store_true", help="大きな図面のページをタイルに分割して送る")
+    parser.add_argument("--save-images", action="store_true", help="ページ画像をJPEGファイルとしても保存する")
+    parser.add_argument("--no-resume", action="store_true", help="処理済みのページも最初から処理し直す")
+    parser.add_argument("--dedup", action="store_true", help="同じ内容のページは1ページだけAIに送り、結果を使い回す")
+    parser.add_argument("--hedge", action="store_true", help="応答の遅いページは同じリクエストを重複して送り、先に返った応答を使う")
+    parser.add_argument("--deadline", type=float, help="1ページの読み取りの期限（秒）。過ぎたページは失敗扱いにする")
+    args = parser.parse_args()
+
+    if not args.paths:
+        pdf_path = r"3_図表資料サンプル.pdf"
+        output_folder = "./3_図表関連"
+        process_pdf_to_text(pdf_path, output_folder, output_txt="3_図表資料サンプルPDFをテキスト化.txt")
+        return
+
+    pdf_paths = find_pdfs(args.paths)
+    if not pdf_paths:
+        print("PDFが見つかりませんでした。")
+        return
+    print(f"PDF: {len(pdf_paths)}件")
+
+    results = process_documents(
+        pdf_paths,
+        output_dir=args.output_dir,
+        workers=args.workers,
+        api_concurrency=args.api_concurrency,
+        dpi=args.dpi,
+        max_in_flight=args.max_in_flight,
+        save_images=args.save_images,
+        tile=args.tile,
+        hybrid=args.hybrid,
+        resume=not args.no_resume,
+        dedup=args.dedup,
+        hedge=args.hedge,
+        deadline=args.deadline,
+    )
+    failed = {path: result for path, result in results.items() if isinstance(result, Exception) or result}
+    for path, result in sorted(failed.items()):
+        if isinstance(result, Exception):
+            print(f"処理に失敗しました: {path} ({result})")
+        else:
+            print(f"{result}ページの読み取りに失敗しました: {path}")
+    print(f"{len(results) - len(failed)}/{len(results)}件のPDFを処理しました。")
+
+
+if __name__ == "__main__":
+    main()
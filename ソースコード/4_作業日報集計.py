@@ -1,218 +1,985 @@
-
-from api_utils import load_api_data, create_client
-import base64
-from pydantic import BaseModel, ValidationError
-from typing import List
-import os
-import json
-import polars as pl
-
-
-def encode_image(image_path):
-    """
-    画像ファイルを読み込み、base64エンコードして文字列として返す
-    """
-    with open(image_path,"rb") as image_file:
-        return base64.b64encode(image_file.read()).decode('utf-8')
-
-
-class Item(BaseModel):
-    """
-    1つの品目の情報を表すモデル
-    """
-    hinmei : str    # 品名
-    quantity: int   # 生産数
-    start_time: str # 開始時刻
-    end_time: str   # 終了時刻
-
-class ImageDescription(BaseModel):
-    """
-    画像から抽出した情報全体を表すモデル
-    """
-    work_date: str # datetime.date  # 日付
-    name : str # 氏名
-    items: List[Item]
-
-
-def process_image(image_path, client, model, str_system, str_user):
-    """
-    画像をbase64エンコードし、AIに送信してJSON形式の応答を受け取る。
-    受け取ったJSONをパースし、pydanticでバリデーションを行い、
-    polarsのDataFrameに変換して返す。
-    """
-    base64_image = encode_image(image_path)
-    response = client.chat.completions.create(
-        model=model,
-        messages=[
-            {"role":"system","content":str_system},
-            {"role":"user","content":[
-                {"type":"text","text":str_user},
-                {"type":"image_url","image_url":{"url":f"data:image/jpeg;base64,{base64_image}"}}
-            ]}
-        ]
-    )
-    content = response.choices[0].message.content
-    start_idx = content.find('{')
-    end_idx = content.rfind('}')
-    if start_idx != -1 and end_idx != -1 and end_idx > start_idx:
-        json_str = content[start_idx:end_idx+1]
-        try:
-            data = json.loads(json_str)
-            description = ImageDescription.model_validate(data)
-            print(f"パース成功: {image_path}")
-            print(f"作業日: {description.work_date}")
-            print(f"氏名: {description.name}")
-            for item in description.items:
-                print(f"品名: {item.hinmei}, 数量: {item.quantity}, 開始時刻: {item.start_time}   終了時刻：{item.end_time} ")
-            items_dicts = [item.model_dump() for item in description.items]
-            df = pl.DataFrame(items_dicts)
-            df = df.with_columns([
-                pl.lit(description.work_date).alias("work_date"),
-                pl.lit(description.name).alias("name")
-            ])
-            # start_time, end_time を時刻型に変換し別名で追加
-            df = df.with_columns([
-                pl.col("start_time").str.strptime(pl.Time, "%H:%M").alias("start_time_parsed"),
-                pl.col("end_time").str.strptime(pl.Time, "%H:%M").alias("end_time_parsed")
-            ])
-            # 差分時間（分）を計算して追加
-            df = df.with_columns([
-                ((pl.col("end_time_parsed").cast(pl.Int64) - pl.col("start_time_parsed").cast(pl.Int64)) / 60_000_000_000).alias("duration_minutes")
-            ])
-            return df
-        except (json.JSONDecodeError, ValidationError) as e:
-            print(f"JSONのパースまたはバリデーションに失敗しました: {image_path}")
-            print(e)
-            print("AIの返答全文:")
-            print(content)
-            return None
-    else:
-        print(f"JSON形式のデータが見つかりませんでした: {image_path}")
-        print("AIの返答全文:")
-        print(content)
-        return None
-
-def main():
-    """
-    メイン処理
-    - API接続情報の読み込み
-    - 画像フォルダ内のjpgファイルを順に処理
-    - 各画像の解析結果をDataFrameに変換しリストに蓄積
-    - 全てのDataFrameを結合し、詳細データと集計表をHTMLで出力
-    """
-    # API接続情報の読み込み
-    api_data = load_api_data("api_gpt4o.json")
-    #api_data = load_api_data("api_o3_mini.json")
-
-    # AzureOpenAIクライアントとモデル名の作成
-    client, model = create_client(api_data)
-
-    str_system ="あなたは画像から情報を抽出する賢いアシスタントです。"
-    str_user  = """
-    以下の画像に含まれる表について、情報を説明してください。
-    - 数値の間違いは無いようにしっかりと確認すること。
-    - 抽出した結果はJSON形式で以下のフォーマットに従って出力してください。
-    フォーマット例:
-    {
-      "work_date" : "2024/02/01",
-      "name" : "鈴木一郎" ,  
-      "items": [
-        {
-          "hinmei": "タイヤ",
-          "quantity": 10,
-          "start_time": "09:30",
-          "end_time": "11:20"
-        },
-        ...
-      ]
-    }
-
-    JSON出力時の値は以下のデータ型とする。
-      - 日付(work_date)      : 文字列(YYYY/MM/DD)
-      - 氏名(name)           : 文字列
-      - 品名(hinmei)         : 文字列
-      - 生産数(quantity)     : 整数(int)
-      - 開始時刻(start_time) : 文字列(HH:MM)
-      - 終了時刻(end_time)   : 文字列(HH:MM)
-
-    """
-
-    folder_path = "./4_作業日報"
-    all_dfs = []
-
-    for filename in os.listdir(folder_path):
-        if filename.lower().endswith(".jpg"):
-            image_path = os.path.join(folder_path, filename)
-            df = process_image(image_path, client, model, str_system, str_user)
-            if df is not None:
-                all_dfs.append(df)
-
-    if all_dfs:
-        combined_df = pl.concat(all_dfs)
-        print("全画像の結合DataFrame:")
-        print(combined_df)
-
-        # HTML表示用に必要な列を選択し、列名を日本語に変更
-        display_df = combined_df.select([
-            "work_date",
-            "name",
-            "hinmei",
-            "quantity",
-            "start_time",
-            "end_time",
-            "duration_minutes"
-        ]).rename({
-            "work_date": "作業日",
-            "name": "氏名",
-            "hinmei": "品名",
-            "quantity": "生産数",
-            "start_time": "開始時刻",
-            "end_time": "終了時刻",
-            "duration_minutes": "作業時間(分)"
-        })
-
-        # 集計表作成：品名ごとに生産数と作業時間の合計
-        summary_df = combined_df.group_by("hinmei").agg([
-            pl.col("quantity").sum().alias("生産数合計"),
-            pl.col("duration_minutes").sum().alias("作業時間合計(分)")
-        ]).sort("hinmei")
-
-        # HTML生成
-        html = f"""
-        <html>
-        <head>
-        <style>
-        table {{
-            border-collapse: collapse;
-            width: 80%;
-            margin-bottom: 30px;
-        }}
-        th, td {{
-            border: 1px solid #ddd;
-            padding: 8px;
-            text-align: left;
-        }}
-        th {{
-            background-color: #f2f2f2;
-        }}
-        </style>
-        </head>
-        <body>
-        <h2>詳細データ</h2>
-        {display_df.to_pandas().to_html(index=False, escape=False)}
-        <h2>品名ごとの集計</h2>
-        {summary_df.to_pandas().to_html(index=False, escape=False)}
-        </body>
-        </html>
-        """
-
-        # HTMLファイルに保存
-        with open("4_作業日報集計結果.html", "w", encoding="utf-8") as f:
-            f.write(html)
-
-        print("4_作業日報集計結果.html に詳細データと集計表を出力しました。")
-    else:
-        print("有効なデータがありませんでした。")
-
-if __name__ == "__main__":
-    main()
+
+from api_utils import get_client, create_chat_completion, AdaptiveBackoff, Hedging
+from image_utils import prepare_image_file, image_part, PayloadStats
+from response_cache import ResponseCache
+from job_journal import JobJournal, file_hash, make_hash
+from telemetry import Telemetry, estimate_image_file_tokens, percentile
+from report_warehouse import ReportWarehouse, minutes_between
+from image_dedup import (PerceptualIndex, Merge, file_dhash, file_thumbnail, group_duplicates, hamming, images_match,
+                         thumbnails_match, write_merge_report)
+from openai import OpenAIError
+from pydantic import BaseModel
+from typing import List
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, as_completed, wait
+import html
+import os
+import json
+import tempfile
+import threading
+import time
+import polars as pl
+
+
+class Item(BaseModel):
+    """
+    1つの品目の情報を表すモデル
+    """
+    hinmei : str    # 品名
+    quantity: int   # 生産数
+    start_time: str # 開始時刻
+    end_time: str   # 終了時刻
+
+class ImageDescription(BaseModel):
+    """
+    画像から抽出した情報全体を表すモデル
+    """
+    work_date: str # datetime.date  # 日付
+    name : str # 氏名
+    items: List[Item]
+
+
+class PackedReport(ImageDescription):
+    """
+    複数の画像をまとめて送ったときの、1枚分の抽出結果（元の画像のファイル名付き）
+    """
+    file_name: str
+
+class PackedDescriptions(BaseModel):
+    """
+    複数の画像をまとめて送ったときの抽出結果全体
+    """
+    reports: List[PackedReport]
+
+
+def response_format_for(model_class):
+    """
+    pydanticモデルのJSONスキーマを、APIの構造化出力(response_format)の形式で返す。
+    """
+    schema = model_class.model_json_schema()
+    # strictモードでは全てのオブジェクトに additionalProperties: false の指定が必要
+    for obj in [schema, *schema.get("$defs", {}).values()]:
+        obj["additionalProperties"] = False
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": model_class.__name__, "schema": schema, "strict": True},
+    }
+
+
+def description_response_format():
+    """
+    ImageDescriptionのJSONスキーマを、APIの構造化出力(response_format)の形式で返す。
+    """
+    return response_format_for(ImageDescription)
+
+
+def parse_description(content, structured):
+    """
+    AIの応答をImageDescriptionに変換する。
+    structured=Trueなら応答全体をそのままスキーマで検証し、
+    Falseなら応答の中から '{' ～ '}' の範囲を探してJSONとして読み取る。
+    失敗した場合は ValueError（ValidationErrorを含む）を送出する。
+    """
+    if structured:
+        return ImageDescription.model_validate_json(content)
+    start_idx = content.find('{')
+    end_idx = content.rfind('}')
+    if start_idx == -1 or end_idx == -1 or end_idx <= start_idx:
+        raise ValueError("JSON形式のデータが見つかりませんでした")
+    return ImageDescription.model_validate(json.loads(content[start_idx:end_idx+1]))
+
+
+def parse_packed_descriptions(content, file_names):
+    """
+    複数の画像をまとめて送ったときのAIの応答を、ファイル名ごとのImageDescriptionに変換する。
+    1枚分ずつ検証し、検証に失敗した画像や応答に含まれない画像はNoneにする
+    （応答全体がJSONとして読めない場合は全てNone）。
+    """
+    results = {file_name: None for file_name in file_names}
+    start_idx = content.find('{')
+    end_idx = content.rfind('}')
+    try:
+        data = json.loads(content[start_idx:end_idx+1]) if 0 <= start_idx < end_idx else None
+    except ValueError:
+        data = None
+    reports = data.get("reports") if isinstance(data, dict) else None
+    if not isinstance(reports, list):
+        return results
+    for entry in reports:
+        try:
+            report = PackedReport.model_validate(entry)
+        except ValueError:
+            continue
+        if report.file_name in results and results[report.file_name] is None:
+            results[report.file_name] = report
+    return results
+
+
+# 抽出結果の1行（品目1件）の列と型
+ROW_SCHEMA = {
+    "work_date": pl.Utf8,
+    "name": pl.Utf8,
+    "hinmei": pl.Utf8,
+    "quantity": pl.Int64,
+    "start_time": pl.Utf8,
+    "end_time": pl.Utf8,
+}
+
+
+def description_to_rows(description):
+    """
+    ImageDescriptionを、品目1件につき1行の辞書（ROW_SCHEMA の列）のリストに変換する。
+    作業時間などの計算は行わず、集計時に全件まとめて計算する。
+    """
+    return [
+        {"work_date": description.work_date, "name": description.name, **item.model_dump()}
+        for item in description.items
+    ]
+
+
+class ExtractionStats:
+    """
+    バッチ全体の抽出結果の件数（並行処理するスレッド間で共有する）
+    - first_pass : 1回目の応答で抽出に成功した画像の数
+    - retried    : 再試行して抽出に成功した画像の数
+    - failed     : 再試行しても抽出できなかった画像の数
+    """
+
+    def __init__(self):
+        self.first_pass = 0
+        self.retried = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+
+    def record(self, attempts, success):
+        """
+        画像1枚分の結果（試行回数と成否）を記録する
+        """
+        with self._lock:
+            if not success:
+                self.failed += 1
+            elif attempts == 1:
+                self.first_pass += 1
+            else:
+                self.retried += 1
+
+    def summary(self):
+        """
+        件数をまとめた文字列を返す
+        """
+        total = self.first_pass + self.retried + self.failed
+        return f"{total}件中 1回目で成功: {self.first_pass}件, 再試行で成功: {self.retried}件, 失敗: {self.failed}件"
+
+
+def process_image(image_path, client, model, str_system, str_user, cache=None, backoff=None,
+                  structured=False, max_attempts=2, stats=None, payload_stats=None, telemetry=None,
+                  hedging=None, deadline=None):
+    """
+    画像をモデルの実効解像度まで縮小してデータURLに変換し、AIに送信してJSON形式の応答を受け取る。
+    受け取ったJSONをパースし、pydanticでバリデーションを行い、
+    品目ごとの行（辞書）のリストに変換して返す。抽出できなかった場合はNoneを返す。
+    cacheを指定した場合、同じ画像・プロンプトの応答はキャッシュから返す。
+    backoffは並行処理するスレッド間で共有し、429を受けたときにまとめて待機させる。
+    structured=Trueの場合はImageDescriptionのスキーマをresponse_formatとしてAPIに渡し、
+    応答をそのまま検証する。
+    応答が不正な場合は、エラー内容を伝えて max_attempts 回まで再試行する。
+    不正な応答と、エラーを伝えて再試行した応答はキャッシュに保存しない（次回の実行でAPIに送り直す）。
+    statsを指定した場合は試行回数と成否を記録する。
+    payload_statsを指定した場合は縮小による送信量の削減量を記録する。
+    telemetryを指定した場合はAPI呼び出しごとの所要時間・トークン数を記録する。
+    hedgingを指定した場合は、応答の遅いリクエストを重複して送り、先に返った応答を使う。
+    deadlineを指定した場合は、1回の呼び出しをその秒数で打ち切る（例外を送出する）。
+    """
+    image_url, = prepare_image_file(image_path, stats=payload_stats)
+    messages = [
+        {"role":"system","content":str_system},
+        {"role":"user","content":[
+            {"type":"text","text":str_user},
+            image_part(image_url)
+        ]}
+    ]
+    extra_params = {"response_format": description_response_format()} if structured else {}
+
+    def cacheable(response):
+        try:
+            parse_description(response.choices[0].message.content or "", structured)
+        except ValueError:
+            return False
+        return True
+
+    for attempt in range(1, max_attempts + 1):
+        try:
+            response = create_chat_completion(
+                client,
+                # 再試行は不正だった応答を含む会話なので、キャッシュしても次回の実行では使われない
+                cache=cache if attempt == 1 else None,
+                cacheable=cacheable,
+                backoff=backoff,
+                telemetry=telemetry,
+                label=os.path.basename(image_path),
+                hedging=hedging,
+                deadline=deadline,
+                model=model,
+                messages=messages,
+                **extra_params
+            )
+        except (TimeoutError, OpenAIError) as e:
+            # 期限切れやAPIのエラー（コンテンツフィルター、認証エラーなど）は再試行せず、抽出できなかったものとして扱う
+            print(f"APIの呼び出しに失敗しました: {image_path} ({e})")
+            if stats is not None:
+                stats.record(attempt, False)
+            return None
+        content = response.choices[0].message.content or ""
+        try:
+            description = parse_description(content, structured)
+        except ValueError as e:  # json.JSONDecodeError, ValidationError もValueErrorの一種
+            print(f"JSONのパースまたはバリデーションに失敗しました: {image_path} ({attempt}/{max_attempts})")
+            print(e)
+            print("AIの返答全文:")
+            print(content)
+            # 不正だった応答とエラー内容を伝えて再試行する
+            messages = messages + [
+                {"role":"assistant","content":content},
+                {"role":"user","content":f"出力がフォーマットに合っていません。以下のエラーを修正し、JSONのみを出力してください。\n{e}"},
+            ]
+            continue
+
+        print(f"パース成功: {image_path}")
+        print(f"作業日: {description.work_date}")
+        print(f"氏名: {description.name}")
+        for item in description.items:
+            print(f"品名: {item.hinmei}, 数量: {item.quantity}, 開始時刻: {item.start_time}   終了時刻：{item.end_time} ")
+        if stats is not None:
+            stats.record(attempt, True)
+        return description_to_rows(description)
+
+    if stats is not None:
+        stats.record(max_attempts, False)
+    return None
+
+
+def find_inconsistencies(rows):
+    """
+    抽出した行のうち、日報としてあり得ない値（終了時刻が開始時刻より前、生産数が0以下、時刻の形式が不正）を探す。
+
+    Returns:
+        list[str]: 見つかった問題の説明のリスト（問題が無ければ空）
+    """
+    problems = []
+    for row in rows:
+        label = row.get("hinmei") or "(品名なし)"
+        minutes = minutes_between(row.get("start_time"), row.get("end_time"))
+        if minutes is None:
+            problems.append(f"{label}: 時刻の形式が不正です ({row.get('start_time')} - {row.get('end_time')})")
+        elif minutes < 0:
+            problems.append(f"{label}: 終了時刻が開始時刻より前です ({row.get('start_time')} - {row.get('end_time')})")
+        if row.get("quantity") is None or row.get("quantity") <= 0:
+            problems.append(f"{label}: 生産数が0以下です ({row.get('quantity')})")
+    return problems
+
+
+class TierStats:
+    """
+    モデルの段階（速いモデル → 高性能なモデル）ごとの抽出結果と所要時間（並行処理するスレッド間で共有する）
+    - accepted : その段階の結果を採用した画像の数
+    - invalid  : 抽出（JSONのパース・バリデーション）に失敗して次の段階に回した画像の数
+    - inconsistent : 値の矛盾が見つかって次の段階に回した画像の数
+    """
+
+    def __init__(self, models):
+        self.tiers = {model: {"accepted": 0, "invalid": 0, "inconsistent": 0, "seconds": []} for model in models}
+        self._lock = threading.Lock()
+
+    def record(self, model, outcome, seconds):
+        """
+        画像1枚分の、ある段階での結果（"accepted" / "invalid" / "inconsistent"）と所要時間(秒)を記録する
+        """
+        with self._lock:
+            tier = self.tiers[model]
+            tier[outcome] += 1
+            tier["seconds"].append(seconds)
+
+    def summary(self):
+        """
+        段階ごとの成功率と所要時間をまとめた文字列を返す
+        """
+        lines = []
+        for number, (model, tier) in enumerate(self.tiers.items(), start=1):
+            total = tier["accepted"] + tier["invalid"] + tier["inconsistent"]
+            if not total:
+                lines.append(f"  {number}. {model}: 0件")
+                continue
+            p50 = percentile(tier["seconds"], 50)
+            p95 = percentile(tier["seconds"], 95)
+            lines.append(
+                f"  {number}. {model}: {total}件中 採用 {tier['accepted']}件 ({tier['accepted'] / total:.0%}),"
+                f" 抽出失敗 {tier['invalid']}件, 値の矛盾 {tier['inconsistent']}件,"
+                f" 所要時間 p50 {p50:.2f}秒, p95 {p95:.2f}秒"
+            )
+        return "\n".join(lines)
+
+
+def process_image_cascade(image_path, tiers, str_system, str_user, cache=None, backoff=None,
+                          structured=False, stats=None, payload_stats=None, telemetry=None, tier_stats=None,
+                          hedging=None, deadline=None):
+    """
+    速いモデルから順に画像を処理し、抽出に失敗した場合や値の矛盾（find_inconsistencies）が見つかった場合だけ
+    次の（高性能な）モデルで処理し直す。
+
+    途中の段階では再試行せずにすぐ次の段階に回す。最後の段階では process_image と同じく再試行し、
+    値の矛盾が残っていても（夜勤で日付をまたぐ場合など）警告を表示して結果を採用する。
+
+    Args:
+        image_path (str): 画像ファイルのパス
+        tiers (list[tuple]): (AzureOpenAIクライアント, モデル名) のリスト（速いモデルから順に並べる）
+        tier_stats (TierStats, optional): 段階ごとの結果と所要時間の集計
+        その他の引数は process_image と同じ
+
+    Returns:
+        list[dict] or None: 品目ごとの行のリスト。最後の段階でも抽出できなかった場合はNone
+    """
+    for number, (client, model) in enumerate(tiers, start=1):
+        last = number == len(tiers)
+        start = time.perf_counter()
+        rows = process_image(image_path, client, model, str_system, str_user, cache, backoff,
+                             structured=structured, max_attempts=2 if last else 1,
+                             stats=stats if last else None, payload_stats=payload_stats, telemetry=telemetry,
+                             hedging=hedging, deadline=deadline)
+        seconds = time.perf_counter() - start
+        problems = find_inconsistencies(rows) if rows is not None else []
+        if rows is not None and (not problems or last):
+            if problems:
+                print(f"値の矛盾が残っています: {image_path}")
+                print("\n".join(problems))
+            if tier_stats is not None:
+                tier_stats.record(model, "accepted", seconds)
+            if stats is not None and not last:
+                stats.record(1, True)
+            return rows
+        if tier_stats is not None:
+            tier_stats.record(model, "invalid" if rows is None else "inconsistent", seconds)
+        if not last:
+            print(f"{model}の結果を使えないため、次のモデルで処理し直します: {image_path}")
+            if problems:
+                print("\n".join(problems))
+    return None
+
+# 1回のリクエストにまとめる画像の枚数と、画像の入力トークン数の上限
+PACK_MAX_IMAGES = 8
+PACK_IMAGE_TOKEN_BUDGET = 16000
+
+# 画像のサイズが分からない場合の、1枚あたりの入力トークン数の見積もり
+DEFAULT_IMAGE_TOKENS = 1105
+
+
+def plan_packs(image_paths, max_images=PACK_MAX_IMAGES, token_budget=PACK_IMAGE_TOKEN_BUDGET):
+    """
+    画像を、1回のリクエストにまとめて送る組に分ける。
+    画像サイズから見積もった入力トークン数の合計が token_budget を超えないように、
+    先頭から順に最大 max_images 枚ずつまとめる。
+
+    Returns:
+        list[list[str]]: 画像のパスの組のリスト
+    """
+    packs = []
+    pack = []
+    pack_tokens = 0
+    for image_path in image_paths:
+        tokens = estimate_image_file_tokens(image_path) or DEFAULT_IMAGE_TOKENS
+        if pack and (len(pack) >= max_images or pack_tokens + tokens > token_budget):
+            packs.append(pack)
+            pack = []
+            pack_tokens = 0
+        pack.append(image_path)
+        pack_tokens += tokens
+    if pack:
+        packs.append(pack)
+    return packs
+
+
+def process_pack(image_paths, client, model, str_system, str_user, cache=None, backoff=None,
+                 structured=False, stats=None, payload_stats=None, telemetry=None, check_consistency=False,
+                 hedging=None, deadline=None):
+    """
+    複数の画像を1回のリクエストにまとめてAIに送信し、画像ごとの抽出結果を受け取る。
+    システムプロンプトとフォーマットの説明は1回分だけ送るため、画像1枚あたりの入力トークン数とリクエスト数が減る。
+    各画像の直前にファイル名を示し、応答の各要素をファイル名で元の画像に対応付ける。
+    check_consistency=Trueの場合は、値に矛盾（find_inconsistencies）がある画像も抽出できなかったものとして扱う。
+
+    Returns:
+        dict: 画像のパス -> 品目ごとの行（辞書）のリスト。検証に失敗した画像はNone（1枚ずつ処理し直す）
+    """
+    file_names = {os.path.basename(image_path): image_path for image_path in image_paths}
+    str_pack = f"""
+    以下の{len(image_paths)}枚の画像は、それぞれ別の作業日報です。各画像の直前に file_name を示します。
+    画像ごとに上記のフォーマットで情報を抽出し、全ての画像について以下の形式で出力してください。
+    {{"reports": [{{"file_name": "...", "work_date": "...", "name": "...", "items": [...]}}, ...]}}
+    """
+    content = [{"type":"text","text":str_user + str_pack}]
+    for file_name, image_path in file_names.items():
+        image_url, = prepare_image_file(image_path, stats=payload_stats)
+        content.append({"type":"text","text":f"file_name: {file_name}"})
+        content.append(image_part(image_url))
+    extra_params = {"response_format": response_format_for(PackedDescriptions)} if structured else {}
+
+    try:
+        response = create_chat_completion(
+            client,
+            cache=cache,
+            backoff=backoff,
+            telemetry=telemetry,
+            label=",".join(file_names),
+            hedging=hedging,
+            deadline=deadline,
+            model=model,
+            messages=[
+                {"role":"system","content":str_system},
+                {"role":"user","content":content},
+            ],
+            **extra_params
+        )
+    except (TimeoutError, OpenAIError) as e:
+        # 期限切れやAPIのエラーの場合は、全ての画像を1枚ずつ処理し直す
+        print(f"APIの呼び出しに失敗しました: {', '.join(file_names)} ({e})")
+        return {image_path: None for image_path in image_paths}
+    reports = parse_packed_descriptions(response.choices[0].message.content or "", file_names)
+
+    results = {}
+    for file_name, image_path in file_names.items():
+        report = reports[file_name]
+        if report is None:
+            print(f"まとめて送った応答から抽出できませんでした。1枚ずつ処理し直します: {image_path}")
+            results[image_path] = None
+            continue
+        rows = description_to_rows(report)
+        problems = find_inconsistencies(rows) if check_consistency else []
+        if problems:
+            print(f"まとめて送った応答の値に矛盾があります。1枚ずつ処理し直します: {image_path}")
+            print("\n".join(problems))
+            results[image_path] = None
+            continue
+        print(f"パース成功: {image_path}")
+        if stats is not None:
+            stats.record(1, True)
+        results[image_path] = rows
+    return results
+
+
+# 詳細データの列名と、出力時の日本語の列名
+DETAIL_COLUMNS = {
+    "work_date": "作業日",
+    "name": "氏名",
+    "hinmei": "品名",
+    "quantity": "生産数",
+    "start_time": "開始時刻",
+    "end_time": "終了時刻",
+    "duration_minutes": "作業時間(分)",
+}
+
+HTML_HEADER = """
+<html>
+<head>
+<style>
+table {
+    border-collapse: collapse;
+    width: 80%;
+    margin-bottom: 30px;
+}
+th, td {
+    border: 1px solid #ddd;
+    padding: 8px;
+    text-align: left;
+}
+th {
+    background-color: #f2f2f2;
+}
+</style>
+</head>
+<body>
+"""
+
+HTML_FOOTER = """
+</body>
+</html>
+"""
+
+
+def html_table_start(columns):
+    """
+    HTMLの表の開始タグと見出し行を返す
+    """
+    cells = "".join(f"<th>{html.escape(str(column))}</th>" for column in columns)
+    return f"<table>\n<thead><tr>{cells}</tr></thead>\n<tbody>\n"
+
+
+def html_table_rows(rows):
+    """
+    行データ(タプルの並び)をHTMLの表の行に変換して返す
+    """
+    lines = []
+    for row in rows:
+        cells = "".join(f"<td>{html.escape(str(value))}</td>" for value in row)
+        lines.append(f"<tr>{cells}</tr>\n")
+    return "".join(lines)
+
+
+def html_table_end():
+    """
+    HTMLの表の終了タグを返す
+    """
+    return "</tbody>\n</table>\n"
+
+
+class ReportRows:
+    """
+    日報から抽出した行を、届いた順に一時ファイル（JSON Lines）へ書き出していく入れ物
+    行をメモリに溜めず、最後に一時ファイルを1つのLazyFrameとして読み込んで集計する
+    """
+
+    def __init__(self):
+        self._file = tempfile.NamedTemporaryFile("w", encoding="utf-8", suffix=".jsonl", delete=False)
+        self.path = self._file.name
+
+    def add(self, rows):
+        """
+        日報1枚分の行データ（ROW_SCHEMA の列をキーとする辞書の並び）を追加する
+        """
+        for row in rows:
+            self._file.write(json.dumps({name: row.get(name) for name in ROW_SCHEMA}, ensure_ascii=False) + "\n")
+
+    def lazy(self):
+        """
+        追加した全ての行を1つのLazyFrameとして返す（以降は行を追加できない）
+        """
+        self._file.close()
+        return pl.scan_ndjson(self.path, schema=ROW_SCHEMA)
+
+    def close(self):
+        """一時ファイルを削除する"""
+        self._file.close()
+        os.remove(self.path)
+
+
+class HinmeiSummary:
+    """
+    品名ごとの生産数と作業時間の合計を、日報1枚分の結果が届くたびに加算していく集計
+    日報の枚数が増えても、保持するのは品名ごとの合計値だけ。複数スレッドから同時に加算してよい
+    """
+
+    def __init__(self):
+        self.totals = {}  # 品名 -> [生産数合計, 作業時間合計(分)]
+        self._lock = threading.Lock()
+
+    def add(self, rows):
+        """
+        日報1枚分の行データ（ROW_SCHEMA の列をキーとする辞書の並び）を集計に加える
+        """
+        with self._lock:
+            for row in rows:
+                total = self.totals.setdefault(row.get("hinmei"), [0, 0.0])
+                total[0] += row.get("quantity") or 0
+                total[1] += minutes_between(row.get("start_time"), row.get("end_time")) or 0.0
+
+    def to_frame(self):
+        """
+        品名順（品名の無い行を先頭）に並べた集計表を返す
+        """
+        with self._lock:
+            items = sorted(self.totals.items(), key=lambda item: (item[0] is not None, item[0] or ""))
+        return pl.DataFrame(
+            [(hinmei, quantity, duration) for hinmei, (quantity, duration) in items],
+            schema={"品名": pl.Utf8, "生産数合計": pl.Int64, "作業時間合計(分)": pl.Float64},
+            orient="row",
+        )
+
+
+def parse_time(column):
+    """
+    "HH:MM" 形式の列を時刻型に変換する式（形式が不正な値はnullになる）
+    """
+    return pl.col(column).str.strptime(pl.Time, "%H:%M", strict=False)
+
+
+def build_report(rows):
+    """
+    全ての行から、作業時間(分)を加えた詳細データを作成するクエリを返す。
+    詳細データは行数に比例して大きくなるため、実行せずにLazyFrameのまま返す（ファイルへ直接書き出す）。
+    品名ごとの集計は HinmeiSummary が日報の届くたびに加算している。
+
+    Args:
+        rows (pl.LazyFrame): ROW_SCHEMA の列を持つ全ての行
+
+    Returns:
+        pl.LazyFrame: 日本語の列名の詳細データ
+    """
+    detail = rows.with_columns(
+        ((parse_time("end_time").cast(pl.Int64) - parse_time("start_time").cast(pl.Int64)) / 60_000_000_000)
+        .alias("duration_minutes")
+    ).select(list(DETAIL_COLUMNS))
+    return detail.rename(DETAIL_COLUMNS)
+
+
+def write_html_report(path, detail_batches, summary_df, monthly_df=None):
+    """
+    詳細データと品名ごとの集計表（指定時は蓄積分の月ごとの集計表も）をHTMLに書き出す
+    詳細データは少しずつ読み込んだDataFrameの並び（LazyFrame.collect_batches() など）で受け取り、順に書き出す
+    書き終えてから置き換え、途中の状態のHTMLが残らないようにする
+    """
+    temp_path = path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        f.write(HTML_HEADER)
+        f.write("<h2>詳細データ</h2>\n")
+        f.write(html_table_start(DETAIL_COLUMNS.values()))
+        for batch in detail_batches:
+            f.write(html_table_rows(batch.iter_rows()))
+        f.write(html_table_end())
+
+        # 集計表：品名ごとに生産数と作業時間の合計
+        f.write("<h2>品名ごとの集計</h2>\n")
+        f.write(html_table_start(summary_df.columns))
+        f.write(html_table_rows(summary_df.iter_rows()))
+        f.write(html_table_end())
+
+        if monthly_df is not None:
+            f.write("<h2>月ごと・品名ごとの集計（蓄積分）</h2>\n")
+            f.write(html_table_start(monthly_df.columns))
+            f.write(html_table_rows(monthly_df.iter_rows()))
+            f.write(html_table_end())
+        f.write(HTML_FOOTER)
+    os.replace(temp_path, path)
+
+
+def iter_image_paths(folder_path):
+    """
+    フォルダ内のjpgファイルのパスを順に返す
+    """
+    with os.scandir(folder_path) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.name.lower().endswith(".jpg"):
+                yield entry.path
+
+
+def iter_results(image_paths, worker, max_workers):
+    """
+    画像（または画像の組）を最大 max_workers 件ずつ並行して worker で処理し、終わった順に結果を返す。
+    未処理の画像をまとめて投入せず、待ち行列は max_workers の2倍までに抑える。
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = set()
+        for image_path in image_paths:
+            pending.add(executor.submit(worker, image_path))
+            if len(pending) >= max_workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        for future in as_completed(pending):
+            yield future.result()
+
+
+def main(max_workers=8, structured=False, resume=True, pack=False, dedup=False, tiers=None, hedge=False,
+         deadline=None, use_cache=True):
+    """
+    メイン処理
+    - API接続情報の読み込み
+    - 画像フォルダ内のjpgファイルのうち、新しい画像と内容が変わった画像だけを最大 max_workers 件ずつ並行して処理
+    - 各画像の解析結果は、届くたびにジャーナルに記録（中断しても再実行で続きから処理できる）
+    - ジャーナルから日報を1件ずつ読み出し、行を一時ファイルに書き出す（全ての行をメモリに溜めない）
+    - 品名ごとの集計は、日報の結果が届くたびに（処理済みで飛ばした日報も読み込んだ時点で）加算していく
+    - 作業時間を加えた詳細データと集計表をHTML・Parquet・CSVに出力
+    - 抽出結果は保管庫(report_warehouse)にも蓄積し、月ごとの集計表を合わせて出力
+
+    Args:
+        max_workers (int, optional): 同時にAIへ送信する画像の数。デフォルトは8。
+        structured (bool, optional): ImageDescriptionのスキーマを使った構造化出力で抽出するかどうか。
+            Falseならこれまでどおりプロンプトでフォーマットを指示し、応答の中のJSONを読み取る。デフォルトはFalse。
+        resume (bool, optional): 前回までに処理済みで内容が変わっていない画像を飛ばすかどうか。デフォルトはTrue。
+        pack (bool, optional): 複数の画像を1回のリクエストにまとめて送るかどうか。まとめる枚数は画像サイズから決める。
+            まとめて送った応答から抽出できなかった画像だけを1枚ずつ処理し直す。デフォルトはFalse。
+        dedup (bool, optional): 知覚ハッシュで同じ用紙の画像（2回スキャンしたものなど）をまとめ、1枚だけ抽出して
+            結果を使い回すかどうか。過去の実行で抽出した画像とも照合し、統合した画像の一覧をCSVに出力する。デフォルトはFalse。
+        tiers (list[str], optional): 使用するモデルのAPI接続情報ファイルを、速いモデルから順に並べたリスト。
+            先頭のモデルで抽出し、抽出に失敗した画像や値に矛盾がある画像だけを次のモデルで処理し直す。
+            省略時は"api_gpt4o.json"のモデルだけを使う。
+        hedge (bool, optional): 応答がこれまでのp95より遅い画像は同じリクエストを重複して送り、先に返った応答を使うかどうか。
+            重複して送るのは全体の1割まで。デフォルトはFalse。
+        deadline (float, optional): 1回の呼び出しの期限（秒）。過ぎた画像は抽出に失敗したものとして次回の実行で処理する。
+        use_cache (bool, optional): 同じ画像・プロンプトの応答をキャッシュから返すかどうか。デフォルトはTrue。
+    """
+    # API接続情報を読み込み、プロセス内で共有するAzureOpenAIクライアントとモデル名を取得
+    if tiers is None:
+        tiers = ["api_gpt4o.json"]
+        #tiers = ["api_gpt4o_mini.json", "api_gpt4o.json"]
+    tier_clients = [get_client(path) for path in tiers]
+    models = [model for _, model in tier_clients]
+
+    str_system ="あなたは画像から情報を抽出する賢いアシスタントです。"
+    str_user  = """
+    以下の画像に含まれる表について、情報を説明してください。
+    - 数値の間違いは無いようにしっかりと確認すること。
+    - 抽出した結果はJSON形式で以下のフォーマットに従って出力してください。
+    フォーマット例:
+    {
+      "work_date" : "2024/02/01",
+      "name" : "鈴木一郎" ,  
+      "items": [
+        {
+          "hinmei": "タイヤ",
+          "quantity": 10,
+          "start_time": "09:30",
+          "end_time": "11:20"
+        },
+        ...
+      ]
+    }
+
+    JSON出力時の値は以下のデータ型とする。
+      - 日付(work_date)      : 文字列(YYYY/MM/DD)
+      - 氏名(name)           : 文字列
+      - 品名(hinmei)         : 文字列
+      - 生産数(quantity)     : 整数(int)
+      - 開始時刻(start_time) : 文字列(HH:MM)
+      - 終了時刻(end_time)   : 文字列(HH:MM)
+
+    """
+
+    folder_path = "./4_作業日報"
+    output_base = "4_作業日報集計結果"
+    output_html = output_base + ".html"
+
+    # 同じ画像を再実行したときはAPIを呼ばずにキャッシュから返す
+    cache = ResponseCache() if use_cache else None
+
+    # 429を受けたときは全スレッドの送信をまとめて待たせる
+    backoff = AdaptiveBackoff()
+
+    # 画像ごとの抽出結果をジャーナルに記録する
+    # 画像の内容や抽出の設定が変わった場合は記録と一致しないため、処理し直す
+    journal = JobJournal(os.path.abspath(folder_path))
+    if not resume:
+        journal.clear()
+    settings_hash = make_hash(*models, str_system, str_user, structured)
+
+    # 抽出結果を保管庫に蓄積し、日・週・月ごとの集計表を日報1枚ずつ差分で更新する
+    warehouse = ReportWarehouse()
+
+    report_rows = ReportRows()
+    summary = HinmeiSummary()
+    stats = ExtractionStats()
+    payload_stats = PayloadStats()
+    tier_stats = TierStats(models)
+    # 極端に遅い応答に全体の時間が引きずられないよう、遅い画像は重複して送る（まとめて送るリクエストとは応答時間が違うため分ける）
+    hedging = Hedging() if hedge else None
+    pack_hedging = Hedging() if hedge else None
+    telemetry = Telemetry(os.path.basename(folder_path), log_path="api_telemetry.jsonl")
+    skipped_count = 0
+    report_count = 0
+
+    def check(image_path):
+        # 処理が必要な画像なら入力のハッシュを、処理済みで内容が変わっていない画像ならNoneを返す
+        item = os.path.basename(image_path)
+        input_hash = file_hash(image_path, settings_hash)
+        source = os.path.abspath(image_path)
+        if journal.has(item, input_hash):
+            rows = json.loads(journal.get(item))
+            summary.add(rows)
+            if not warehouse.has_report(source, input_hash):
+                # 保管庫を使う前に処理済みだった日報も蓄積する
+                warehouse.replace_report(source, input_hash, rows)
+            return image_path, None
+        # 内容が変わった画像の古い結果は、抽出に失敗しても使わない
+        journal.discard(item)
+        warehouse.remove_report(source)
+        return image_path, input_hash
+
+    def save(image_path, rows):
+        if rows is not None:
+            input_hash = input_hashes[image_path]
+            journal.record(os.path.basename(image_path), input_hash, json.dumps(rows, ensure_ascii=False))
+            warehouse.replace_report(os.path.abspath(image_path), input_hash, rows)
+            summary.add(rows)
+
+    def extract(image_path):
+        try:
+            return process_image_cascade(image_path, tier_clients, str_system, str_user, cache, backoff,
+                                         structured=structured, stats=stats, payload_stats=payload_stats,
+                                         telemetry=telemetry, tier_stats=tier_stats, hedging=hedging, deadline=deadline)
+        except Exception as e:
+            # 壊れた画像などで1枚が失敗しても、バッチ全体は止めずに残りの画像を処理する
+            print(f"抽出に失敗しました: {image_path} ({type(e).__name__}: {e})")
+            stats.record(1, False)
+            return None
+
+    def worker(image_paths):
+        if len(image_paths) > 1:
+            # まとめて送るのは最初の（速い）モデル
+            client, model = tier_clients[0]
+            start = time.perf_counter()
+            try:
+                results = process_pack(image_paths, client, model, str_system, str_user, cache, backoff,
+                                       structured=structured, stats=stats, payload_stats=payload_stats,
+                                       telemetry=telemetry, check_consistency=len(tier_clients) > 1,
+                                       hedging=pack_hedging, deadline=deadline)
+            except Exception as e:
+                # 壊れた画像が含まれている場合などは、1枚ずつ処理し直して失敗した画像だけを記録する
+                print(f"まとめて送れませんでした。1枚ずつ処理し直します ({type(e).__name__}: {e})")
+                results = {image_path: None for image_path in image_paths}
+            seconds = time.perf_counter() - start
+            for rows in results.values():
+                # 抽出できなかった画像は、1枚ずつ処理し直すときに記録する
+                if rows is not None:
+                    tier_stats.record(model, "accepted", seconds)
+        else:
+            results = {image_paths[0]: None}
+        for image_path, rows in results.items():
+            # まとめて送った応答から抽出できなかった画像は、1枚ずつ処理し直す
+            save(image_path, rows if rows is not None else extract(image_path))
+
+    # 処理が必要な画像を探す（ハッシュの計算は並行して行う）
+    input_hashes = {}
+    for image_path, input_hash in iter_results(iter_image_paths(folder_path), check, max_workers):
+        if input_hash is None:
+            skipped_count += 1
+        else:
+            input_hashes[image_path] = input_hash
+    print(f"処理済みのため飛ばした画像: {skipped_count}件")
+
+    pending = sorted(input_hashes)
+
+    # 同じ用紙の画像は代表の1枚だけを抽出し、残りは代表の結果を使い回す
+    duplicates = {}  # 代表の画像 -> [(同じ用紙の画像, 距離), ...]
+    merges = []
+    if dedup:
+        index = PerceptualIndex(settings_hash)
+        image_hashes = dict(iter_results(pending, lambda image_path: (image_path, file_dhash(image_path)), max_workers))
+
+        def same_content(image_path, other_path):
+            # 知覚ハッシュが近いだけでは日付や数量だけが違う別の日報のことがあるため、画素の差分で確かめる
+            if input_hashes.get(image_path) == input_hashes.get(other_path):
+                return True
+            try:
+                return images_match(image_path, other_path)
+            except (OSError, ValueError):
+                return False
+
+        def confirm_indexed(image_path, digest, thumbnail):
+            # 内容のハッシュが一致すればそのまま使い、違う場合は索引に保存した縮小画像と画素の差分で確かめる
+            # （索引の元の画像ファイルが移動・削除されていても確かめられる）
+            if digest == input_hashes[image_path]:
+                return True
+            if thumbnail is None:
+                return False
+            try:
+                return thumbnails_match(file_thumbnail(image_path), thumbnail)
+            except (OSError, ValueError):
+                return False
+
+        representatives = []
+        groups = group_duplicates([(image_path, image_hashes[image_path]) for image_path in pending])
+        # 代表と同じ内容と確かめられなかった画像は、それらだけで新しいグループとして後ろに加えて処理し直す
+        for group in groups:
+            (representative, _), members = group[0], group[1:]
+            confirmed, rest = [], []
+            for image_path, member_distance in members:
+                if same_content(image_path, representative):
+                    confirmed.append((image_path, member_distance))
+                else:
+                    rest.append(image_path)
+            if rest:
+                groups.append([(image_path, hamming(image_hashes[image_path], image_hashes[rest[0]])) for image_path in rest])
+            members = confirmed
+            found = index.find(image_hashes[representative], exclude=os.path.abspath(representative),
+                               confirm=lambda source, digest, thumbnail: confirm_indexed(representative, digest, thumbnail))
+            if found is None:
+                representatives.append(representative)
+                duplicates[representative] = members
+                continue
+            # 過去の実行で抽出済みの画像と同じ用紙なら、グループ全体にその結果を使う
+            source, distance, result = found
+            save(representative, json.loads(result))
+            merges.append(Merge(os.path.abspath(representative), source, distance, "過去の実行"))
+            for image_path, member_distance in members:
+                save(image_path, json.loads(result))
+                merges.append(Merge(os.path.abspath(image_path), os.path.abspath(representative), member_distance, "同じバッチ"))
+        print(f"同じ用紙として統合した画像: {len(pending) - len(representatives)}件")
+        pending = representatives
+
+    # 同じ画像の組は同じリクエストになる（キャッシュが効く）ように、ファイル名順に並べてからまとめる
+    packs = plan_packs(pending) if pack else [[image_path] for image_path in pending]
+    if pack:
+        print(f"{len(pending)}枚の画像を{len(packs)}回のリクエストにまとめて送ります。")
+    for _ in iter_results(packs, worker, max_workers):
+        pass
+
+    if dedup:
+        # 代表の結果を索引に保存し、同じ用紙の画像にも使う（代表の抽出に失敗した場合は次回の実行で処理する）
+        for representative, members in duplicates.items():
+            result = journal.get(os.path.basename(representative), input_hashes[representative])
+            if result is None:
+                continue
+            index.add(os.path.abspath(representative), image_hashes[representative], result, input_hashes[representative],
+                      file_thumbnail(representative))
+            for image_path, distance in members:
+                save(image_path, json.loads(result))
+                merges.append(Merge(os.path.abspath(image_path), os.path.abspath(representative), distance, "同じバッチ"))
+        index.close()
+        if merges:
+            merge_report = output_base + "_重複統合.csv"
+            write_merge_report(merge_report, merges)
+            print(f"{merge_report} に統合した画像の一覧を出力しました。")
+
+    print(f"抽出結果: {stats.summary()}")
+    if len(tier_clients) > 1:
+        print(f"モデルの段階ごとの結果:\n{tier_stats.summary()}")
+    print(f"送信画像: {payload_stats.summary()}")
+    print(telemetry.report())
+    if hedge:
+        print(hedging.summary())
+        if pack:
+            print(pack_hedging.summary())
+    if cache is not None:
+        print(f"キャッシュ: {cache.stats()}")
+        cache.close()
+
+    # ジャーナルから日報を1件ずつ読み出し、一時ファイルに書き出す
+    for image_path in iter_image_paths(folder_path):
+        result = journal.get(os.path.basename(image_path))
+        if result is None:
+            continue
+        report_count += 1
+        report_rows.add(json.loads(result))
+    journal.close()
+
+    # 月ごとの集計は、これまでに蓄積した全ての日報の集計表を引くだけで得られる
+    monthly_df = pl.DataFrame(
+        warehouse.rollup("month", by=("hinmei",)),
+        schema={"period_start": pl.Utf8, "hinmei": pl.Utf8, "quantity": pl.Int64,
+                "duration_minutes": pl.Float64, "rows": pl.Int64},
+    ).rename({"period_start": "月", "hinmei": "品名", "quantity": "生産数合計", "duration_minutes": "作業時間合計(分)", "rows": "件数"})
+    warehouse.close()
+
+    if not report_count:
+        report_rows.close()
+        print("有効なデータがありませんでした。")
+        return
+
+    # 作業時間の計算（品名ごとの集計は届いた日報から加算済み）
+    detail = build_report(report_rows.lazy())
+    summary_df = summary.to_frame()
+
+    # 他のツールで読み込めるように、Parquet と CSV（Excelで開けるようにBOM付き）でも保存する
+    # 詳細データは全体をメモリに展開せず、一時ファイルから少しずつ読みながら書き出す
+    detail_parquet = f"{output_base}_詳細.parquet"
+    detail.sink_parquet(detail_parquet)
+    report_rows.close()
+    detail = pl.scan_parquet(detail_parquet)
+    detail.sink_csv(f"{output_base}_詳細.csv", include_bom=True)
+    for suffix, df in (("品名別", summary_df), ("月別", monthly_df)):
+        df.write_parquet(f"{output_base}_{suffix}.parquet")
+        df.write_csv(f"{output_base}_{suffix}.csv", include_bom=True)
+
+    write_html_report(output_html, detail.collect_batches(chunk_size=10_000), summary_df, monthly_df)
+    print(f"{report_count}件の日報を集計しました。")
+    print(f"{output_html} に詳細データと集計表を出力しました。")
+    print(f"{output_base}_詳細 / {output_base}_品名別 / {output_base}_月別 の .parquet / .csv にも保存しました。")
+
+if __name__ == "__main__":
+    main()
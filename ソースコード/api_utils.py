@@ -1,93 +1,654 @@
-import json
-from openai import AzureOpenAI
-from langchain_openai import AzureChatOpenAI  
-
-def load_api_data(file_path) :
-    """API接続情報をJSONファイルから読み込む関数"""
-    with open(file_path, 'r', encoding='utf-8') as file:
-        return json.load(file)
-
-def create_client(api_data) :
-    """提供されたAPI情報を使ってAzureOpenAIクライアントを作成する関数"""
-    return AzureOpenAI(
-        azure_endpoint=api_data["azure_endpoint"],
-        api_key=api_data["api_key"],
-        api_version=api_data["api_version"],
-    ),  api_data["model"]
-
-
-# def create_client2(api_data) :
-#     """提供されたAPI情報を使ってAzureOpenAIクライアントを作成する関数"""
-#     return AzureChatOpenAI(
-#          deployment_name=api_data["model"], 
-#          openai_api_version=api_data["api_version"], 
-#          openai_api_key=api_data["api_key"],
-#          azure_endpoint=api_data["azure_endpoint"],
-#          temperature=0
-#     )
-
-def get_response(client, model, content) :
-    """
-    チャットを実行し、レスポンスのメッセージコンテンツを返す関数
-
-    Args:
-        client: AzureOpenAIクライアントインスタンス
-        model: 使用するモデル名（文字列）
-        content: ユーザーからのメッセージ内容（文字列）
-
-    Returns:
-        str: チャットの応答メッセージ内容
-    """
-    system_message = {
-        "role": "system",
-        "content": "あなたは優秀なアシスタントです。"
-    }
-    user_message = {
-        "role": "user",
-        "content": content
-    }
-
-    response = client.chat.completions.create(
-        messages=[system_message, user_message],
-        max_completion_tokens=1000,
-        model=model
-    )
-
-#     return response.choices[0].message.content
-
-# def get_image_description(client, model, image_path):
-#     """
-#     画像ファイルをAzureOpenAIに渡し、説明文を取得する関数
-
-#     Args:
-#         client: AzureOpenAIクライアントインスタンス
-#         model: 使用するモデル名（文字列）
-#         image_path: 画像ファイルのパス（文字列）
-
-#     Returns:
-#         str: 画像の説明文
-#     """
-#     with open(image_path, "rb") as image_file:
-#         image_data = image_file.read()
-
-#     # 画像をバイナリとしてmessagesに含める形式はOpenAIのVision API仕様に準拠
-#     # ここでは画像をbase64エンコードしてテキストとして送る例を示す
-#     import base64
-#     encoded_image = base64.b64encode(image_data).decode("utf-8")
-
-#     system_message = {
-#         "role": "system",
-#         "content": "あなたは優秀なアシスタントです。画像の内容を説明してください。"
-#     }
-#     user_message = {
-#         "role": "user",
-#         "content": f"以下の画像を説明してください。\ndata:image/jpeg;base64,{encoded_image}"
-#     }
-
-#     response = client.chat.completions.create(
-#         messages=[system_message, user_message],
-#         #max_completion_tokens=1000,
-#         model=model
-#     )
-
-#     return response.choices[0].message.content
+
+"""
+API接続情報の読み込み、AzureOpenAIクライアントの作成、
+およびチャット応答取得のためのユーティリティ関数群を提供します。
+
+ルートの api_utils.py / api_utils2.py もこのモジュールをそのまま公開しているため、
+並行処理・429時の再試行・応答キャッシュ・テレメトリー（所要時間やトークン数の記録）は
+ここで実装すれば全てのスクリプトに適用されます。
+
+- get_response  : 1件のプロンプト（または画像を含むメッセージ）を送信する。stream=Trueならストリーミング
+- get_responses : 複数件を並行して送信し、入力と同じ順番で結果を返す
+
+deadline（秒）を指定すると、429の再試行も含めた1回の呼び出しをその時間で打ち切る。
+Hedging を指定すると、直近の応答時間のp95を過ぎても応答が無いリクエストを重複して送り、先に返った応答を使う。
+
+"""
+
+import asyncio
+import json
+import logging
+import os
+import random
+import threading
+import time
+import weakref
+from collections import deque, namedtuple
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import httpx
+from openai import AzureOpenAI, AsyncAzureOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient
+from openai import RateLimitError, APITimeoutError, APIConnectionError, InternalServerError
+from openai.types.chat import ChatCompletion
+from response_cache import make_key
+from telemetry import percentile
+
+# 再試行の状況は標準出力ではなくログに出す（回数はテレメトリーにも記録される）
+logger = logging.getLogger("api_utils")
+
+__all__ = [
+    "DEFAULT_SYSTEM_PROMPT",
+    "load_api_data",
+    "create_client",
+    "create_async_client",
+    "get_client",
+    "get_async_client",
+    "AdaptiveBackoff",
+    "Hedging",
+    "set_api_slots",
+    "create_chat_completion",
+    "get_response",
+    "BatchResult",
+    "get_responses",
+    "get_response_async",
+    "stream_response_async",
+]
+
+DEFAULT_SYSTEM_PROMPT = "あなたは優秀なアシスタントです。"
+
+def load_api_data(file_path) :
+    """API接続情報をJSONファイルから読み込む関数"""
+    with open(file_path, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+def create_client(api_data, http_client=None) :
+    """提供されたAPI情報を使ってAzureOpenAIクライアントを作成する関数
+
+    http_clientを指定すると、そのhttpxクライアント（接続プール）を使って通信する。
+    """
+    return AzureOpenAI(
+        azure_endpoint=api_data["azure_endpoint"],
+        api_key=api_data["api_key"],
+        api_version=api_data["api_version"],
+        http_client=http_client,
+    ),  api_data["model"]
+
+def create_async_client(api_data, http_client=None) :
+    """提供されたAPI情報を使ってAsyncAzureOpenAIクライアント（asyncio用）を作成する関数"""
+    return AsyncAzureOpenAI(
+        azure_endpoint=api_data["azure_endpoint"],
+        api_key=api_data["api_key"],
+        api_version=api_data["api_version"],
+        http_client=http_client,
+    ),  api_data["model"]
+
+
+# 共有クライアントの接続プール設定
+# 並行リクエスト数ぶんの接続をkeep-aliveで保持し、TLSハンドシェイクをプロセス内で使い回す
+HTTP_LIMITS = httpx.Limits(max_connections=64, max_keepalive_connections=32, keepalive_expiry=120)
+HTTP_TIMEOUT = httpx.Timeout(600.0, connect=10.0)
+
+_shared_clients = {}
+# イベントループごとの非同期クライアント。ループが破棄されるとエントリも消える
+_async_clients = weakref.WeakKeyDictionary()
+_shared_clients_lock = threading.Lock()
+
+def get_client(file_path) :
+    """
+    API接続情報ファイルごとに1つだけAzureOpenAIクライアントを作成し、プロセス内で使い回す関数
+
+    Args:
+        file_path (str): API接続情報のJSONファイルのパス
+
+    Returns:
+        tuple: (AzureOpenAIクライアントインスタンス, モデル名)
+    """
+    key = ("sync", os.path.abspath(file_path))
+    with _shared_clients_lock:
+        if key not in _shared_clients:
+            http_client = DefaultHttpxClient(limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT)
+            _shared_clients[key] = create_client(load_api_data(file_path), http_client=http_client)
+        return _shared_clients[key]
+
+def get_async_client(file_path) :
+    """
+    API接続情報ファイルごとに1つだけAsyncAzureOpenAIクライアントを作成し、使い回す関数
+
+    非同期の接続プールはイベントループに結び付くため、実行中のイベントループごとに作成する。
+
+    Args:
+        file_path (str): API接続情報のJSONファイルのパス
+
+    Returns:
+        tuple: (AsyncAzureOpenAIクライアントインスタンス, モデル名)
+    """
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+    path = os.path.abspath(file_path)
+    with _shared_clients_lock:
+        if loop is None:
+            clients = _shared_clients.setdefault(("async", None), {})
+        else:
+            clients = _async_clients.setdefault(loop, {})
+        if path not in clients:
+            http_client = DefaultAsyncHttpxClient(limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT)
+            clients[path] = create_async_client(load_api_data(file_path), http_client=http_client)
+        return clients[path]
+
+
+class AdaptiveBackoff:
+    """
+    レート制限(429)に応じて待機時間を調整するクラス
+
+    複数スレッドから共有して使う。どれか1つのリクエストが429を受けると
+    全スレッドの送信を一時停止し、待機時間は429が続くたびに倍増、
+    成功が続くと半減していく。
+    """
+
+    def __init__(self, initial_delay=1.0, max_delay=60.0):
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self._delay = 0.0
+        self._resume_at = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self, deadline_at=None):
+        """
+        送信再開時刻まで待機する
+
+        Args:
+            deadline_at (float, optional): 呼び出しの期限（time.monotonic() の値）。
+                再開時刻が期限を過ぎる場合は、待たずに TimeoutError を送出する
+        """
+        with self._lock:
+            resume_at = self._resume_at
+        if deadline_at is not None and resume_at >= deadline_at:
+            raise TimeoutError("APIの応答が期限までに返りませんでした")
+        remaining = resume_at - time.monotonic()
+        if remaining > 0:
+            time.sleep(remaining)
+
+    def on_rate_limited(self, retry_after=None):
+        """429を受けたときに待機時間を延ばす"""
+        with self._lock:
+            self._delay = min(self.max_delay, max(self.initial_delay, self._delay * 2))
+            delay = retry_after if retry_after is not None else self._delay
+            # 同時に再送が集中しないように揺らぎを加える
+            delay *= random.uniform(1.0, 1.25)
+            self._resume_at = max(self._resume_at, time.monotonic() + delay)
+
+    def on_success(self):
+        """成功したときに待機時間を縮める"""
+        with self._lock:
+            self._delay /= 2
+            if self._delay < self.initial_delay:
+                self._delay = 0.0
+
+
+class Hedging:
+    """
+    応答の遅いリクエストと同じリクエストをもう1件送り（ヘッジ）、先に返った応答を使うための制御
+
+    複数スレッドから共有して使う。直近の応答時間の percentile パーセンタイルを過ぎても応答が無い場合に
+    重複したリクエストを送るため、まれに極端に遅い応答があってもバッチ全体の時間が引きずられにくくなる。
+    重複して送る件数はリクエスト全体の max_extra_ratio 以内に抑え、追加の費用に上限を設ける。
+    ストリーミングのリクエストには使わない。
+    """
+
+    def __init__(self, percentile=95, max_extra_ratio=0.1, min_delay=1.0, window=200, min_samples=10):
+        """
+        Args:
+            percentile (float, optional): 重複して送るまでの待ち時間に使う、直近の応答時間のパーセンタイル。デフォルトは95。
+            max_extra_ratio (float, optional): リクエスト全体に対する、重複して送るリクエストの割合の上限。デフォルトは0.1。
+            min_delay (float, optional): 重複して送るまでの待ち時間の下限（秒）。デフォルトは1.0。
+            window (int, optional): 待ち時間の計算に使う、直近の応答時間の件数。デフォルトは200。
+            min_samples (int, optional): 応答時間がこの件数集まるまでは重複して送らない。デフォルトは10。
+        """
+        self.percentile = percentile
+        self.max_extra_ratio = max_extra_ratio
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def delay(self):
+        """重複して送るまでの待ち時間（秒）を返す。応答時間が十分に集まっていなければNone"""
+        with self._lock:
+            if not self._latencies or len(self._latencies) < self.min_samples:
+                return None
+            return max(self.min_delay, percentile(list(self._latencies), self.percentile))
+
+    def observe(self, seconds):
+        """1件目のリクエストの応答時間を記録する（重複して送った場合も、1件目が返った時点で記録する）"""
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def start_request(self):
+        """リクエストを1件数える"""
+        with self._lock:
+            self.requests += 1
+
+    def try_hedge(self):
+        """追加の費用の上限に収まれば重複して送る1件を数えてTrueを返す"""
+        with self._lock:
+            if self.hedges + 1 > self.max_extra_ratio * self.requests:
+                return False
+            self.hedges += 1
+            return True
+
+    def on_hedge_result(self, hedge_won):
+        """重複して送ったリクエストの結果（重複した側が先に返ったかどうか）を記録する"""
+        if hedge_won:
+            with self._lock:
+                self.hedge_wins += 1
+
+    def summary(self):
+        """
+        重複して送った件数をまとめた文字列を返す
+        """
+        delay = self.delay()
+        delay_text = "-" if delay is None else f"{delay:.2f}秒"
+        return (f"ヘッジ: {self.requests}件中 {self.hedges}件を重複して送信"
+                f" (重複した側が先に返った: {self.hedge_wins}件, 待ち時間: {delay_text})")
+
+
+# ヘッジするリクエストを送るスレッド（最初に使うときに作成する）
+_hedge_executor = None
+_hedge_executor_lock = threading.Lock()
+
+def _get_hedge_executor():
+    global _hedge_executor
+    with _hedge_executor_lock:
+        if _hedge_executor is None:
+            _hedge_executor = ThreadPoolExecutor(max_workers=HTTP_LIMITS.max_connections * 2,
+                                                 thread_name_prefix="api-hedge")
+        return _hedge_executor
+
+
+# 他のプロセスと共有する同時送信数の枠（set_api_slots で設定する）
+_api_slots = None
+
+def set_api_slots(slots):
+    """
+    このプロセスからのAPI呼び出しを、他のプロセスと共有する同時送信数の枠で制限する関数
+
+    複数のPDFをプロセスプールで並行して処理する場合などに、プロセスの初期化時に呼び出す。
+    枠はAPIへのリクエストを送ってから応答（ストリーミングの場合は応答の開始）を受け取るまで占有する。
+
+    Args:
+        slots: multiprocessing.BoundedSemaphore など acquire()/release() を持つ枠。Noneなら制限しない
+    """
+    global _api_slots
+    _api_slots = slots
+
+
+@contextmanager
+def _api_slot():
+    """共有の枠が設定されていれば、枠が空くまで待ってから1つ占有する"""
+    slots = _api_slots
+    if slots is None:
+        yield
+        return
+    slots.acquire()
+    try:
+        yield
+    finally:
+        slots.release()
+
+
+def _retry_after_seconds(error):
+    """RateLimitErrorのRetry-Afterヘッダーから待機秒数を取り出す（無ければNone）"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    value = response.headers.get("retry-after")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def create_chat_completion(client, backoff=None, max_retries=6, cache=None, telemetry=None, label=None,
+                           hedging=None, deadline=None, cacheable=None, stream_usage=False, **kwargs):
+    """
+    client.chat.completions.create を実行し、429の場合は待機して再試行する関数
+
+    SDK内部の再試行は使わない（429を全スレッドで共有する AdaptiveBackoff に確実に伝えるため）。
+    接続エラーやサーバーエラー(5xx)も、この関数の中で少し待って再試行する。
+
+    Args:
+        client: AzureOpenAIクライアントインスタンス
+        backoff (AdaptiveBackoff, optional): スレッド間で共有する待機制御。省略時は呼び出しごとに作成
+        max_retries (int, optional): 429・接続エラー・サーバーエラー時の最大再試行回数。デフォルトは6。
+        cache (ResponseCache, optional): 応答キャッシュ。指定すると同じリクエストはAPIを呼ばずに保存済みの応答を返す
+        telemetry (Telemetry, optional): 所要時間・TTFT・トークン数・再試行回数・キャッシュヒットを記録するテレメトリー
+        label (str, optional): テレメトリーの記録に付ける名前（ページ番号やファイル名など）
+        hedging (Hedging, optional): 応答が遅い場合に同じリクエストを重複して送る制御（ストリーミング時は使わない）
+        deadline (float, optional): 429の再試行や重複して送る分も含めた呼び出し全体の期限（秒）。
+            過ぎた場合は TimeoutError を送出する。省略時は期限なし
+        cacheable (Callable, optional): 応答を受け取り、キャッシュに保存してよければTrueを返す関数（JSONとして読めるかの確認など）。
+            finish_reason が "stop" でない応答（長さの上限で途切れたもの、コンテンツフィルターで止まったもの）は指定に関わらず保存しない
+        stream_usage (bool, optional): ストリーミング時に stream_options={"include_usage": True} を付けて、
+            最後のチャンクでトークン数を受け取るかどうか。古い api_version では400になるため、デフォルトはFalse。
+        **kwargs: chat.completions.create にそのまま渡す引数
+
+    Returns:
+        ChatCompletion: APIの応答（stream=Trueの場合はチャンクを逐次返すイテレータ）
+    """
+    deadline_at = time.monotonic() + deadline if deadline is not None else None
+    if telemetry is None:
+        return _create_chat_completion(client, backoff, max_retries, cache, None, kwargs, hedging, deadline_at, cacheable)
+
+    call = telemetry.start_call(kwargs.get("model"), kwargs.get("messages"), stream=bool(kwargs.get("stream")), label=label)
+    if kwargs.get("stream") and stream_usage:
+        # 応答の最後のチャンクでトークン数を受け取る
+        kwargs.setdefault("stream_options", {"include_usage": True})
+    try:
+        response = _create_chat_completion(client, backoff, max_retries, cache, call, kwargs, hedging, deadline_at,
+                                           cacheable)
+    except Exception as e:
+        call.finish(error=e)
+        raise
+    if kwargs.get("stream"):
+        return call.wrap_stream(response)
+    call.finish(response)
+    return response
+
+
+def _create_chat_completion(client, backoff, max_retries, cache, call, kwargs, hedging=None, deadline_at=None,
+                            cacheable=None):
+    """create_chat_completion の本体。call (CallRecord) があれば再試行・キャッシュヒット・ヘッジを記録する"""
+    if cache is not None and not kwargs.get("stream"):
+        key = make_key(**kwargs)
+        cached = cache.get(key)
+        if cached is not None:
+            if call is not None:
+                call.cache_hit = True
+            return ChatCompletion.model_validate_json(cached)
+        response = _create_chat_completion(client, backoff, max_retries, None, call, kwargs, hedging, deadline_at)
+        # 失敗した応答を保存すると、再実行しても同じ応答が返り続けるため、完結して使えた応答だけを保存する
+        if _is_complete(response) and (cacheable is None or cacheable(response)):
+            cache.set(key, response.model_dump_json())
+        return response
+
+    if backoff is None:
+        backoff = AdaptiveBackoff()
+    for attempt in range(max_retries + 1):
+        # 429の後の待機も期限に含め、待つと期限を過ぎる場合は待たずに打ち切る
+        backoff.wait(deadline_at)
+        _remaining(deadline_at)
+        try:
+            if hedging is not None and not kwargs.get("stream"):
+                response = _send_hedged(client, kwargs, hedging, deadline_at, call)
+            else:
+                response = _send(client, kwargs, deadline_at)
+        except RateLimitError as e:
+            if attempt == max_retries:
+                raise
+            logger.info("レート制限(429)を受けたため再試行します (%d/%d)", attempt + 1, max_retries)
+            if call is not None:
+                call.retries += 1
+            backoff.on_rate_limited(_retry_after_seconds(e))
+            continue
+        except (APIConnectionError, InternalServerError) as e:
+            # 一時的なエラーは他のスレッドの送信を止めずに、この呼び出しだけ少し待って再試行する
+            if attempt == max_retries:
+                raise
+            logger.info("APIのエラー(%s)のため再試行します (%d/%d)", type(e).__name__, attempt + 1, max_retries)
+            delay = min(8.0, 0.5 * 2 ** attempt) * random.uniform(1.0, 1.25)
+            if deadline_at is not None and time.monotonic() + delay >= deadline_at:
+                raise TimeoutError("APIの応答が期限までに返りませんでした") from e
+            time.sleep(delay)
+            continue
+        backoff.on_success()
+        return response
+
+
+def _is_complete(response):
+    """全ての choice が最後まで生成された（finish_reason が "stop" の）応答ならTrueを返す"""
+    return bool(response.choices) and all(choice.finish_reason == "stop" for choice in response.choices)
+
+
+def _remaining(deadline_at):
+    """期限までの残り秒数を返す（期限なしならNone）。過ぎていれば TimeoutError を送出する"""
+    if deadline_at is None:
+        return None
+    remaining = deadline_at - time.monotonic()
+    if remaining <= 0:
+        raise TimeoutError("APIの応答が期限までに返りませんでした")
+    return remaining
+
+
+def _send(client, kwargs, deadline_at=None, cancelled=None):
+    """
+    共有の枠を占有して chat.completions.create を1回実行する
+
+    SDK内部の再試行は止め、429などは呼び出し元の再試行で扱う。期限がある場合は残り時間をリクエストのタイムアウトにする。
+    cancelled (threading.Event) が枠を待つ間にセットされた場合は、送信せずにNoneを返す。
+    """
+    with _api_slot():
+        if cancelled is not None and cancelled.is_set():
+            return None
+        remaining = _remaining(deadline_at)
+        if remaining is None:
+            return client.with_options(max_retries=0).chat.completions.create(**kwargs)
+        try:
+            return client.with_options(timeout=remaining, max_retries=0).chat.completions.create(**kwargs)
+        except APITimeoutError as e:
+            raise TimeoutError("APIの応答が期限までに返りませんでした") from e
+
+
+def _send_hedged(client, kwargs, hedging, deadline_at, call):
+    """
+    リクエストを送り、hedging.delay() 秒を過ぎても応答が無ければ同じリクエストをもう1件送って、
+    先に成功した応答を返す。
+
+    まだ送信していない側（共有の枠を待っている側）は送信せずに取り消す。送信済みの側は同期クライアントでは
+    途中で止められないため、応答を捨てる（期限がある場合はその時点で打ち切られる）。
+    """
+    executor = _get_hedge_executor()
+    cancelled = threading.Event()
+    hedging.start_request()
+    start = time.monotonic()
+
+    def observe(future):
+        if not future.cancelled() and future.exception() is None:
+            hedging.observe(time.monotonic() - start)
+
+    primary = executor.submit(_send, client, kwargs, deadline_at, cancelled)
+    primary.add_done_callback(observe)
+    futures = [primary]
+    delay = hedging.delay()
+    if delay is not None:
+        remaining = _remaining(deadline_at)
+        done, _ = wait(futures, timeout=delay if remaining is None else min(delay, remaining))
+        if not done and hedging.try_hedge():
+            futures.append(executor.submit(_send, client, kwargs, deadline_at, cancelled))
+            if call is not None:
+                call.hedged = True
+
+    pending = set(futures)
+    error = None
+    while pending:
+        done, pending = wait(pending, timeout=_remaining(deadline_at), return_when=FIRST_COMPLETED)
+        if not done:
+            cancelled.set()
+            raise TimeoutError("APIの応答が期限までに返りませんでした")
+        for future in done:
+            if future.exception() is None:
+                cancelled.set()
+                for other in pending:
+                    other.cancel()
+                if len(futures) > 1:
+                    hedging.on_hedge_result(future is not primary)
+                return future.result()
+            error = error or future.exception()
+    raise error
+
+
+def _iter_stream_content(response):
+    """ストリーミング応答からメッセージの断片を順に取り出すジェネレータ"""
+    for chunk in response:
+        if len(chunk.choices) > 0:
+            message = chunk.choices[0].delta.content
+            if message is not None:
+                yield message
+
+
+def get_response(client, model, content, stream=False, system_prompt=DEFAULT_SYSTEM_PROMPT,
+                 cache=None, backoff=None, telemetry=None, label=None, hedging=None, deadline=None, **kwargs):
+    """
+    チャットを実行し、レスポンスのメッセージコンテンツを返す関数。
+    stream=Trueの場合はストリーミングで応答を返すジェネレータを返す。
+
+    Args:
+        client (AzureOpenAI): AzureOpenAIクライアントインスタンス
+        model (str): 使用するモデル名
+        content (str or list): ユーザーからのメッセージ内容（文字列、または画像要素を含むリスト）
+        stream (bool, optional): ストリーミングモードの有無。デフォルトはFalse。
+        system_prompt (str, optional): システムプロンプト
+        cache (ResponseCache, optional): 応答キャッシュ（ストリーミング時は使わない）
+        backoff (AdaptiveBackoff, optional): 429時の待機制御
+        telemetry (Telemetry, optional): 呼び出しの所要時間やトークン数を記録するテレメトリー
+        label (str, optional): テレメトリーの記録に付ける名前
+        hedging (Hedging, optional): 応答が遅い場合に同じリクエストを重複して送る制御（ストリーミング時は使わない）
+        deadline (float, optional): 呼び出し全体の期限（秒）。省略時は期限なし
+        **kwargs: chat.completions.create に追加で渡す引数（max_completion_tokens など）
+
+    Returns:
+        str or generator: stream=Falseなら応答メッセージ文字列、Trueならチャンクを逐次返すジェネレータ
+    """
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": content},
+    ]
+    if stream:
+        response = create_chat_completion(
+            client, backoff=backoff, telemetry=telemetry, label=label, deadline=deadline,
+            model=model, messages=messages, stream=True, **kwargs
+        )
+        return _iter_stream_content(response)
+
+    response = create_chat_completion(
+        client, backoff=backoff, cache=cache, telemetry=telemetry, label=label, hedging=hedging, deadline=deadline,
+        model=model, messages=messages, **kwargs
+    )
+    return response.choices[0].message.content
+
+
+# get_responses の1件分の結果。成功時は content に応答、失敗時は error に例外が入る
+BatchResult = namedtuple("BatchResult", ["content", "error"])
+
+
+def get_responses(client, model, batch, concurrency=8, system_prompt=DEFAULT_SYSTEM_PROMPT,
+                  cache=None, on_result=None, telemetry=None, hedging=None, deadline=None, **kwargs):
+    """
+    複数のプロンプト（または画像を含むメッセージ）を並行して送信し、入力と同じ順番で結果を返す関数
+
+    batchにはジェネレータも渡せる。要素は送信枠が空いたときに1つずつ取り出されるため、
+    PDFのページ変換などを応答待ちの間に進められ、メモリ上に溜まる要素も concurrency 件程度に収まる。
+    429を受けた場合は全件の送信をまとめて待機させてから再試行する。
+
+    Args:
+        client (AzureOpenAI): AzureOpenAIクライアントインスタンス
+        model (str): 使用するモデル名
+        batch (iterable): 各要素がユーザーからのメッセージ内容（文字列、または画像要素を含むリスト）
+        concurrency (int, optional): 同時に送信する件数の上限。デフォルトは8。
+        system_prompt (str, optional): 全件に共通のシステムプロンプト
+        cache (ResponseCache, optional): 応答キャッシュ
+        on_result (callable, optional): on_result(入力の位置, 応答) の形で、成功した要素ごとに完了した時点で呼ばれる関数。
+            途中経過の保存などに使う（送信用のスレッドから呼ばれる）。例外を送出するとその要素は失敗扱いになる
+        telemetry (Telemetry, optional): 各呼び出しの所要時間やトークン数を記録するテレメトリー（入力の位置を名前として記録）
+        hedging (Hedging, optional): 全件で共有する、応答が遅いリクエストを重複して送る制御。
+            指定すると、バッチ全体の時間が一部の極端に遅い応答に引きずられにくくなる
+        deadline (float, optional): 1件ごとの呼び出しの期限（秒）。過ぎた要素は失敗扱いになる
+        **kwargs: chat.completions.create に追加で渡す引数
+
+    Returns:
+        list[BatchResult]: 入力と同じ順番の結果。1件の失敗は他の結果に影響しない
+    """
+    backoff = AdaptiveBackoff()
+    in_flight = threading.BoundedSemaphore(concurrency)
+    futures = []
+
+    def run(index, content):
+        response = get_response(
+            client, model, content,
+            system_prompt=system_prompt, cache=cache, backoff=backoff,
+            telemetry=telemetry, label=str(index), hedging=hedging, deadline=deadline, **kwargs
+        )
+        if on_result is not None:
+            on_result(index, response)
+        return response
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for index, content in enumerate(batch):
+            in_flight.acquire()
+            future = executor.submit(run, index, content)
+            future.add_done_callback(lambda _: in_flight.release())
+            futures.append(future)
+
+    results = []
+    for future in futures:
+        try:
+            results.append(BatchResult(future.result(), None))
+        except Exception as e:
+            results.append(BatchResult(None, e))
+    return results
+
+
+async def get_response_async(client, model, content, system_prompt=DEFAULT_SYSTEM_PROMPT) :
+    """
+    AsyncAzureOpenAIクライアントでチャットを実行し、レスポンスのメッセージコンテンツを返す関数
+
+    asyncio.gather などで複数のプロンプトを同時に送信するために使う。
+
+    Args:
+        client: AsyncAzureOpenAIクライアントインスタンス
+        model: 使用するモデル名（文字列）
+        content: ユーザーからのメッセージ内容（文字列、または画像要素を含むリスト）
+        system_prompt (str, optional): システムプロンプト
+
+    Returns:
+        str: チャットの応答メッセージ内容
+    """
+    response = await client.chat.completions.create(
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": content},
+        ],
+        model=model
+    )
+    return response.choices[0].message.content
+
+async def stream_response_async(client, model, content, system_prompt=DEFAULT_SYSTEM_PROMPT) :
+    """
+    AsyncAzureOpenAIクライアントでチャットを実行し、応答をチャンク単位で返す非同期ジェネレータ
+
+    Args:
+        client: AsyncAzureOpenAIクライアントインスタンス
+        model: 使用するモデル名（文字列）
+        content: ユーザーからのメッセージ内容（文字列、または画像要素を含むリスト）
+        system_prompt (str, optional): システムプロンプト
+
+    Yields:
+        str: 応答メッセージの断片
+    """
+    response = await client.chat.completions.create(
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": content},
+        ],
+        model=model,
+        stream=True
+    )
+    async for chunk in response:
+        if len(chunk.choices) > 0:
+            message = chunk.choices[0].delta.content
+            if message is not None:
+                yield message
@@ -0,0 +1,317 @@
+
+"""
+知覚ハッシュ(dHash)で同じ画像の重複（同じ用紙を2回スキャンしたもの、再出力したものなど）を見つけるユーティリティを提供します。
+
+画像ごとにハッシュを計算し、ハミング距離が閾値以内の画像を同じグループにまとめます。
+グループごとに1枚だけAIで抽出し、他の画像にはその結果を使い回します。
+抽出した結果はハッシュと一緒にSQLiteの索引に保存し、後の実行で同じ画像が来た場合もAIを呼ばずに済ませます。
+様式が同じで日付や数量だけが違う用紙もハッシュは近くなるため、使い回す前に内容のハッシュの一致か
+画素の差分（images_match）で同じ内容であることを確かめます。
+索引には縮小したグレースケールの画像も保存し、後の実行では元の画像ファイルが無くても
+その縮小画像との差分（thumbnails_match）で確かめます。
+ハッシュの計算には Pillow が、画素の差分には NumPy も必要です。
+"""
+
+import csv
+import io
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+try:
+    from PIL import Image, ImageFilter, ImageOps
+except ImportError:  # 重複除去を使わない場合は Pillow は不要
+    Image = None
+
+# ハッシュの一辺（hash_size × hash_size ビット）と、同じ画像とみなすハミング距離の上限
+# 文字の多い資料どうしを取り違えないよう、ビット数を多めにして閾値は小さくしている
+# それでも様式が同じ別の用紙は閾値以内になるため、結果を使い回す前に必ず内容を確かめる
+DEFAULT_HASH_SIZE = 16
+DEFAULT_THRESHOLD = 6
+
+# 索引に保存する縮小画像の長辺（モデルが画像を読む解像度 image_utils.MAX_LONG_SIDE と同じにし、
+# 日付や数量の1文字の違いが差分に残るようにする）
+THUMBNAIL_SIZE = 2048
+
+# 重複として統合した画像1件の記録
+# key     : 統合した画像（結果を使い回した側）
+# source  : 結果の元になった画像
+# distance: ハッシュのハミング距離
+# origin  : "同じバッチ" または "過去の実行"
+Merge = namedtuple("Merge", ["key", "source", "distance", "origin"])
+
+
+def _require_pillow():
+    if Image is None:
+        raise ImportError("重複の検出には Pillow が必要です (pip install pillow)")
+
+
+def dhash(img, hash_size=DEFAULT_HASH_SIZE):
+    """
+    画像の差分ハッシュ(dHash)を計算する関数
+
+    画像をグレースケールの (hash_size+1) × hash_size に縮小し、横に隣り合う画素の明るさの大小をビットにする。
+    拡大縮小や再圧縮、わずかな濃さの違いではほとんど変わらない。
+
+    Args:
+        img (PIL.Image.Image): 画像
+        hash_size (int, optional): ハッシュの一辺。ビット数は hash_size の2乗
+
+    Returns:
+        int: ハッシュ値
+    """
+    small = ImageOps.exif_transpose(img).convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for column in range(hash_size):
+            value = (value << 1) | (pixels[offset + column] > pixels[offset + column + 1])
+    return value
+
+
+def file_dhash(image_path, hash_size=DEFAULT_HASH_SIZE):
+    """
+    画像ファイルの差分ハッシュを計算する関数（大きな画像は縮小して読み込む）
+    """
+    _require_pillow()
+    with Image.open(image_path) as img:
+        # JPEGはデコード時に縮小でき、全画素を展開せずに済む
+        img.draft("L", (hash_size * 8, hash_size * 8))
+        return dhash(img, hash_size)
+
+
+def pixmap_dhash(pix, hash_size=DEFAULT_HASH_SIZE):
+    """
+    PyMuPDFのPixmap（PDFのページを低い解像度で描画したものなど）の差分ハッシュを計算する関数
+    """
+    _require_pillow()
+    return dhash(_pixmap_image(pix), hash_size)
+
+
+def _pixmap_image(pix):
+    """PyMuPDFのPixmapをPILの画像に変換する"""
+    mode = "RGBA" if pix.alpha else ("L" if pix.n == 1 else "RGB")
+    return Image.frombytes(mode, (pix.width, pix.height), pix.samples)
+
+
+def make_thumbnail(img, size=THUMBNAIL_SIZE):
+    """
+    画像を長辺が size 以下のグレースケールに縮小し、索引に保存するPNGのバイト列を返す関数
+
+    Args:
+        img (PIL.Image.Image): 画像
+        size (int, optional): 縮小後の長辺の上限
+
+    Returns:
+        bytes: PNGのバイト列
+    """
+    small = ImageOps.exif_transpose(img).convert("L")
+    small.thumbnail((size, size), Image.LANCZOS)
+    buffer = io.BytesIO()
+    small.save(buffer, "PNG", optimize=True)
+    return buffer.getvalue()
+
+
+def file_thumbnail(image_path, size=THUMBNAIL_SIZE):
+    """
+    画像ファイルの縮小画像（make_thumbnail を参照）を返す関数（大きな画像は縮小して読み込む）
+    """
+    _require_pillow()
+    with Image.open(image_path) as img:
+        img.draft("L", (size, size))
+        return make_thumbnail(img, size)
+
+
+def pixmap_thumbnail(pix, size=THUMBNAIL_SIZE):
+    """
+    PyMuPDFのPixmapの縮小画像（make_thumbnail を参照）を返す関数
+    """
+    _require_pillow()
+    return make_thumbnail(_pixmap_image(pix), size)
+
+
+def images_match(path_a, path_b):
+    """
+    知覚ハッシュが近い2枚の画像ファイルが、同じ内容かを確かめる関数
+
+    両方の縮小画像を thumbnails_match で比べる（索引の画像と比べる場合と同じ基準にする）。
+
+    Args:
+        path_a (str): 画像ファイルのパス
+        path_b (str): 比べる画像ファイルのパス
+
+    Returns:
+        bool: 同じ内容ならTrue
+    """
+    return thumbnails_match(file_thumbnail(path_a), file_thumbnail(path_b))
+
+
+def thumbnails_match(thumbnail_a, thumbnail_b):
+    """
+    2つの縮小画像（make_thumbnail で作ったPNGのバイト列）が、同じ内容かを確かめる関数
+
+    image_diff で位置合わせして差分を取り、変化のあった領域が1つも無い場合だけ同じとみなす。
+    わずかにぼかし、1ピクセルまでの位置のずれを許して比べるため、再スキャンや再出力で細い線の位置や
+    濃さが少し違っても、内容が同じなら一致する。
+
+    Args:
+        thumbnail_a (bytes): 縮小画像
+        thumbnail_b (bytes): 比べる縮小画像
+
+    Returns:
+        bool: 同じ内容ならTrue
+    """
+    from image_diff import diff_images
+    def load(thumbnail):
+        with Image.open(io.BytesIO(thumbnail)) as img:
+            return img.convert("RGB").filter(ImageFilter.GaussianBlur(0.7))
+
+    return not diff_images(load(thumbnail_a), load(thumbnail_b), tolerance=1).boxes
+
+
+def hamming(a, b):
+    """2つのハッシュ値のハミング距離（異なるビットの数）を返す"""
+    return bin(a ^ b).count("1")
+
+
+def group_duplicates(hashes, threshold=DEFAULT_THRESHOLD):
+    """
+    ハッシュが近い画像をグループにまとめる関数
+
+    先頭から順に、既存のグループの代表（最初の画像）との距離が threshold 以内ならそのグループに入れ、
+    どのグループにも近くなければ新しいグループの代表にする。
+
+    Args:
+        hashes (list[tuple]): (画像の識別子, ハッシュ値) のリスト
+        threshold (int, optional): 同じ画像とみなすハミング距離の上限
+
+    Returns:
+        list[list[tuple]]: グループのリスト。各グループは (画像の識別子, 代表との距離) のリストで、先頭が代表
+    """
+    groups = []
+    representatives = []
+    for key, value in hashes:
+        for group, representative in zip(groups, representatives):
+            distance = hamming(value, representative)
+            if distance <= threshold:
+                group.append((key, distance))
+                break
+        else:
+            groups.append([(key, 0)])
+            representatives.append(value)
+    return groups
+
+
+class PerceptualIndex:
+    """
+    画像のハッシュと抽出結果を保存する索引
+
+    namespace（抽出の設定のハッシュなど）ごとに分けて保存し、設定が同じ場合だけ結果を使い回す。
+    複数スレッドから同時に使ってよい。
+    """
+
+    def __init__(self, namespace, path="image_index.sqlite3", threshold=DEFAULT_THRESHOLD):
+        """
+        Args:
+            namespace (str): 結果を使い回してよい範囲の識別子（モデル名やプロンプトから作ったハッシュなど）
+            path (str, optional): 索引ファイルのパス。デフォルトは"image_index.sqlite3"。
+            threshold (int, optional): 同じ画像とみなすハミング距離の上限
+        """
+        self.namespace = namespace
+        self.path = path
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS images ("
+            " namespace TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " hash TEXT NOT NULL,"
+            " result TEXT NOT NULL,"
+            " recorded_at REAL NOT NULL,"
+            " digest TEXT,"
+            " thumbnail BLOB,"
+            " PRIMARY KEY (namespace, key))"
+        )
+        self._conn.commit()
+        # 比較はメモリ上で行う（ハッシュ値は16進文字列で保存している）
+        rows = self._conn.execute("SELECT key, hash FROM images WHERE namespace = ?", (namespace,))
+        self._hashes = {key: int(value, 16) for key, value in rows}
+
+    def find(self, value, exclude=None, confirm=None):
+        """
+        ハッシュが近い保存済みの画像のうち、同じ内容と確かめられた最も近いものを探す
+
+        Args:
+            value (int): ハッシュ値
+            exclude (str, optional): 探す対象から除く画像の識別子（自分自身など）
+            confirm (Callable, optional): (画像の識別子, 保存した内容のハッシュ, 保存した縮小画像) を受け取り、
+                同じ内容ならTrueを返す関数。省略時はハッシュが近いだけで同じ画像とみなす
+
+        Returns:
+            tuple or None: (画像の識別子, 距離, 抽出結果)。threshold 以内に確かめられた画像が無ければNone
+        """
+        with self._lock:
+            candidates = []
+            for key, stored in self._hashes.items():
+                if key == exclude:
+                    continue
+                distance = hamming(value, stored)
+                if distance <= self.threshold:
+                    candidates.append((distance, key))
+        for distance, key in sorted(candidates):
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT result, digest, thumbnail FROM images WHERE namespace = ? AND key = ?",
+                    (self.namespace, key),
+                ).fetchone()
+            if row is None:
+                continue
+            # 画素の差分を取る確認は時間がかかるため、ロックの外で行う
+            if confirm is None or confirm(key, row[1], row[2]):
+                return key, distance, row[0]
+        return None
+
+    def add(self, key, value, result, digest=None, thumbnail=None):
+        """
+        画像のハッシュと抽出結果を保存する
+
+        Args:
+            key (str): 画像の識別子（画像の絶対パス、"PDFのパス#ページ番号" など）
+            value (int): ハッシュ値
+            result (str): 抽出結果（テキストやJSON文字列）
+            digest (str, optional): 抽出した画像の内容のハッシュ（完全に同じ画像かをすぐに確かめるのに使う）
+            thumbnail (bytes, optional): 抽出した画像の縮小画像（make_thumbnail を参照。わずかに画素が違う画像が
+                同じ内容かを、元の画像ファイルが無くても確かめるのに使う）
+        """
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO images (namespace, key, hash, result, recorded_at, digest, thumbnail)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (self.namespace, key, format(value, "x"), result, time.time(), digest, thumbnail),
+            )
+            self._conn.commit()
+            self._hashes[key] = value
+
+    def close(self):
+        """索引ファイルを閉じる"""
+        with self._lock:
+            self._conn.close()
+
+
+def write_merge_report(path, merges):
+    """
+    重複として統合した画像の一覧をCSV（Excelで開けるようにBOM付き）に書き出す
+
+    Args:
+        path (str): 出力するCSVファイルのパス
+        merges (list[Merge]): 統合した画像の記録
+    """
+    with open(path, "w", encoding="utf-8-sig", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["統合した画像", "結果の元の画像", "距離", "種別"])
+        for merge in merges:
+            writer.writerow([merge.key, merge.source, merge.distance, merge.origin])
@@ -0,0 +1,301 @@
+
+"""
+2枚の画像の差分をローカルで検出し、変化のあった領域だけを切り出すユーティリティ関数群を提供します。
+
+変更後の画像を変更前の画像に位置合わせ（平行移動のずれを位相限定相関で推定）した上で、
+画素ごとの差分をNumPyでまとめて計算し、変化のあった画素を近いものどうしまとめて矩形の領域にします。
+AIには切り出した領域の変更前/変更後だけを送り、差分の無い画像の組はAIに送らずに済ませます。
+NumPy と Pillow が必要です。
+"""
+
+import math
+from collections import deque, namedtuple
+
+import numpy as np
+from PIL import Image, ImageOps
+
+# compare_images の結果
+# boxes        : 変化のあった領域 (left, top, right, bottom) のリスト（変更前の画像の座標）
+# changed_ratio: 変化のあった画素の割合
+# shift        : 変更後の画像を位置合わせしたときの移動量 (dx, dy)
+# before, after: 位置合わせ済みの変更前/変更後の画像（PIL.Image、RGB）
+DiffResult = namedtuple("DiffResult", ["boxes", "changed_ratio", "shift", "before", "after"])
+
+
+def load_rgb(image_path):
+    """
+    画像ファイルを読み込み、向きを補正したRGBの画像として返す
+    """
+    with Image.open(image_path) as img:
+        img = ImageOps.exif_transpose(img)
+        return img.convert("RGB")
+
+
+def estimate_shift(before, after, max_side=1024):
+    """
+    変更後の画像が変更前の画像からどれだけ平行移動しているかを、位相限定相関で推定する関数
+
+    計算量を抑えるため、長辺が max_side 以下になるように縮小したグレースケール画像で推定する。
+
+    Args:
+        before (PIL.Image.Image): 変更前の画像
+        after (PIL.Image.Image): 変更後の画像（before と同じ大きさ）
+        max_side (int, optional): 推定に使う画像の長辺の上限
+
+    Returns:
+        tuple: 変更後の画像を変更前に合わせるために動かす量 (dx, dy)（元の画像のピクセル数）
+    """
+    scale = min(1.0, max_side / max(before.size))
+    size = (max(1, round(before.width * scale)), max(1, round(before.height * scale)))
+    a = np.asarray(before.convert("L").resize(size), dtype=np.float32)
+    b = np.asarray(after.convert("L").resize(size), dtype=np.float32)
+    # 端の不連続の影響を抑えるため、平均を引いて窓関数をかける
+    window = np.outer(np.hanning(a.shape[0]), np.hanning(a.shape[1])).astype(np.float32)
+    fa = np.fft.rfft2((a - a.mean()) * window)
+    fb = np.fft.rfft2((b - b.mean()) * window)
+    cross = fa * np.conj(fb)
+    cross /= np.abs(cross) + 1e-9
+    correlation = np.fft.irfft2(cross, s=a.shape)
+    dy, dx = np.unravel_index(np.argmax(correlation), correlation.shape)
+    # 半分を超える移動量は負の方向の移動として扱う
+    if dy > a.shape[0] // 2:
+        dy -= a.shape[0]
+    if dx > a.shape[1] // 2:
+        dx -= a.shape[1]
+    dx, dy = round(dx / scale), round(dy / scale)
+    if scale < 1.0:
+        # 縮小した分の誤差（数ピクセル）を、元の解像度で周囲を探して詰める
+        dx, dy = refine_shift(before, after, dx, dy, radius=math.ceil(1 / scale))
+    return dx, dy
+
+
+def refine_shift(before, after, dx, dy, radius, crop=1024):
+    """
+    (dx, dy) の周囲 radius ピクセルの範囲で、画像中央部の差が最も小さくなる移動量を返す
+    """
+    width, height = before.size
+    left = max(radius, (width - crop) // 2)
+    top = max(radius, (height - crop) // 2)
+    right = min(width - radius, left + crop)
+    bottom = min(height - radius, top + crop)
+    if right <= left or bottom <= top:
+        return dx, dy
+    a = np.asarray(before.convert("L"), dtype=np.int16)[top:bottom, left:right]
+    b = np.asarray(after.convert("L"), dtype=np.int16)
+    best = None
+    for ddy in range(-radius, radius + 1):
+        for ddx in range(-radius, radius + 1):
+            sx, sy = dx + ddx, dy + ddy
+            # after を (sx, sy) 動かした画像の中央部 = after の (left - sx, top - sy) から始まる範囲
+            x0, y0 = left - sx, top - sy
+            if x0 < 0 or y0 < 0 or x0 + (right - left) > width or y0 + (bottom - top) > height:
+                continue
+            error = np.abs(a - b[y0:y0 + bottom - top, x0:x0 + right - left]).mean()
+            if best is None or error < best[0]:
+                best = (error, sx, sy)
+    return (best[1], best[2]) if best is not None else (dx, dy)
+
+
+def shift_image(img, dx, dy):
+    """
+    画像を (dx, dy) だけ平行移動した画像を返す（はみ出した部分は捨て、空いた部分は白で埋める）
+    """
+    shifted = Image.new("RGB", img.size, (255, 255, 255))
+    shifted.paste(img, (dx, dy))
+    return shifted
+
+
+def diff_mask(before, after, threshold=40, tolerance=0):
+    """
+    2枚の画像で色が threshold より大きく変わった画素を True とするマスクを返す関数
+
+    tolerance を指定すると、もう一方の画像の周囲 tolerance ピクセル以内のどの画素とも
+    threshold より大きく違う画素だけを変化ありとする（縮小した画像で、1ピクセル未満の位置のずれによる
+    細い線の差分を無視するため）。
+
+    Args:
+        before (PIL.Image.Image): 変更前の画像（RGB）
+        after (PIL.Image.Image): 変更後の画像（RGB、before と同じ大きさ）
+        threshold (int, optional): RGBいずれかのチャンネルの差がこの値を超えた画素を変化ありとする
+        tolerance (int, optional): 位置のずれとして許すピクセル数。デフォルトは0（同じ位置の画素とだけ比べる）
+
+    Returns:
+        numpy.ndarray: 画像と同じ大きさ (高さ, 幅) のbool配列
+    """
+    a = np.asarray(before)
+    b = np.asarray(after)
+    if tolerance > 0:
+        return (_outside_window(a, b, threshold, tolerance) | _outside_window(b, a, threshold, tolerance)).any(axis=2)
+    # uint8のまま差の絶対値を求め、int16への変換で配列を大きくしない
+    difference = np.maximum(a, b) - np.minimum(a, b)
+    return difference.max(axis=2) > threshold
+
+
+def _outside_window(a, b, threshold, radius):
+    """a の各画素が、b の同じ位置の周囲 radius ピクセルの値の範囲から threshold より大きく外れているかを返す"""
+    height, width = b.shape[:2]
+    padded = np.pad(b, ((radius, radius), (radius, radius), (0, 0)), mode="edge")
+    low = b.copy()
+    high = b.copy()
+    for dy in range(2 * radius + 1):
+        for dx in range(2 * radius + 1):
+            window = padded[dy:dy + height, dx:dx + width]
+            np.minimum(low, window, out=low)
+            np.maximum(high, window, out=high)
+    a = a.astype(np.int16)
+    return (a < low.astype(np.int16) - threshold) | (a > high.astype(np.int16) + threshold)
+
+
+def block_mask(mask, block=8, min_pixels=4):
+    """
+    画素のマスクを block 四方のブロック単位にまとめ、min_pixels 個以上の画素が変化したブロックを True にする
+
+    ノイズ（JPEGの圧縮ひずみなどによる孤立した画素）を除き、領域の検出をブロック単位で行うために使う。
+
+    Returns:
+        numpy.ndarray: (高さ/block, 幅/block) のbool配列（端数は切り上げ）
+    """
+    height, width = mask.shape
+    rows, columns = math.ceil(height / block), math.ceil(width / block)
+    padded = np.zeros((rows * block, columns * block), dtype=bool)
+    padded[:height, :width] = mask
+    counts = padded.reshape(rows, block, columns, block).sum(axis=(1, 3))
+    return counts >= min_pixels
+
+
+def dilate(mask, radius):
+    """
+    bool配列の True の範囲を上下左右に radius マスずつ広げる（近い変化どうしを1つの領域にまとめるため）
+    """
+    result = mask.copy()
+    for _ in range(radius):
+        grown = result.copy()
+        grown[1:, :] |= result[:-1, :]
+        grown[:-1, :] |= result[1:, :]
+        grown[:, 1:] |= result[:, :-1]
+        grown[:, :-1] |= result[:, 1:]
+        result = grown
+    return result
+
+
+def connected_boxes(mask):
+    """
+    bool配列の True のマスを、上下左右につながったものどうしでまとめ、それぞれを囲む矩形を返す
+
+    Returns:
+        list[tuple]: (left, top, right, bottom) のリスト（マス単位、right/bottom は含まない）
+    """
+    visited = np.zeros_like(mask, dtype=bool)
+    rows, columns = mask.shape
+    boxes = []
+    for start_row, start_column in zip(*np.nonzero(mask)):
+        if visited[start_row, start_column]:
+            continue
+        visited[start_row, start_column] = True
+        queue = deque([(start_row, start_column)])
+        top, left, bottom, right = start_row, start_column, start_row, start_column
+        while queue:
+            row, column = queue.popleft()
+            top, bottom = min(top, row), max(bottom, row)
+            left, right = min(left, column), max(right, column)
+            for r, c in ((row - 1, column), (row + 1, column), (row, column - 1), (row, column + 1)):
+                if 0 <= r < rows and 0 <= c < columns and mask[r, c] and not visited[r, c]:
+                    visited[r, c] = True
+                    queue.append((r, c))
+        boxes.append((int(left), int(top), int(right) + 1, int(bottom) + 1))
+    return boxes
+
+
+def merge_boxes(boxes):
+    """
+    重なり合う矩形を、重なりが無くなるまで1つに統合する
+    """
+    boxes = list(boxes)
+    merged = True
+    while merged:
+        merged = False
+        result = []
+        for box in boxes:
+            for i, other in enumerate(result):
+                if box[0] < other[2] and other[0] < box[2] and box[1] < other[3] and other[1] < box[3]:
+                    result[i] = (min(box[0], other[0]), min(box[1], other[1]),
+                                 max(box[2], other[2]), max(box[3], other[3]))
+                    merged = True
+                    break
+            else:
+                result.append(box)
+        boxes = result
+    return sorted(boxes, key=lambda box: (box[1], box[0]))
+
+
+def compare_images(before_path, after_path, threshold=40, block=8, min_pixels=4, merge_gap=4, margin=32,
+                   max_shift=64):
+    """
+    2枚の画像を位置合わせして差分を取り、変化のあった領域を返す関数
+
+    Args:
+        before_path (str): 変更前の画像ファイルのパス
+        after_path (str): 変更後の画像ファイルのパス（大きさが違う場合は変更前に合わせて拡大縮小する）
+        threshold (int, optional): 変化ありとする色の差。デフォルトは40。
+        block (int, optional): 変化を検出するブロックの一辺(px)。デフォルトは8。
+        min_pixels (int, optional): ブロックを変化ありとするのに必要な、変化した画素の数。デフォルトは4。
+        merge_gap (int, optional): この数のブロック以内に近い変化は1つの領域にまとめる。デフォルトは4。
+        margin (int, optional): 領域の周囲に付ける余白(px)。前後の文脈をAIが読めるようにする。デフォルトは32。
+        max_shift (int, optional): 位置合わせで許す移動量の上限(px)。これを超える推定値は誤りとみなして移動しない。
+
+    Returns:
+        DiffResult: 変化のあった領域、変化した画素の割合、位置合わせの移動量、位置合わせ済みの画像
+    """
+    return diff_images(load_rgb(before_path), load_rgb(after_path), threshold=threshold, block=block,
+                       min_pixels=min_pixels, merge_gap=merge_gap, margin=margin, max_shift=max_shift)
+
+
+def diff_images(before, after, threshold=40, block=8, min_pixels=4, merge_gap=4, margin=32, max_shift=64,
+                tolerance=0):
+    """
+    読み込み済みの2枚の画像（PIL.Image、RGB）を位置合わせして差分を取り、変化のあった領域を返す関数
+
+    引数と戻り値は compare_images と同じ（ファイルの代わりに画像を受け取る）。
+    tolerance は diff_mask を参照。
+    """
+    if after.size != before.size:
+        after = after.resize(before.size, Image.LANCZOS)
+
+    dx, dy = estimate_shift(before, after)
+    if (dx or dy) and max(abs(dx), abs(dy)) <= max_shift:
+        after = shift_image(after, dx, dy)
+    else:
+        dx, dy = 0, 0
+
+    mask = diff_mask(before, after, threshold, tolerance)
+    # 位置合わせで空いた端は比較しない
+    if dx > 0:
+        mask[:, :dx] = False
+    elif dx < 0:
+        mask[:, dx:] = False
+    if dy > 0:
+        mask[:dy, :] = False
+    elif dy < 0:
+        mask[dy:, :] = False
+
+    blocks = block_mask(mask, block, min_pixels)
+    if not blocks.any():
+        return DiffResult([], 0.0, (dx, dy), before, after)
+
+    width, height = before.size
+    boxes = []
+    for left, top, right, bottom in connected_boxes(dilate(blocks, merge_gap)):
+        # 広げる前の変化したブロックだけを囲むように縮める
+        region = blocks[top:bottom, left:right]
+        rows = np.flatnonzero(region.any(axis=1))
+        columns = np.flatnonzero(region.any(axis=0))
+        left, right = left + int(columns[0]), left + int(columns[-1]) + 1
+        top, bottom = top + int(rows[0]), top + int(rows[-1]) + 1
+        boxes.append((
+            max(0, left * block - margin),
+            max(0, top * block - margin),
+            min(width, right * block + margin),
+            min(height, bottom * block + margin),
+        ))
+    changed_ratio = float(mask.mean())
+    return DiffResult(merge_boxes(boxes), changed_ratio, (dx, dy), before, after)
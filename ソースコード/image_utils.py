@@ -0,0 +1,332 @@
+
+"""
+画像をAIに渡すためのデータURLへ変換するユーティリティ関数群を提供します。
+
+PDFのページ画像(PyMuPDFのPixmap)はディスクに保存せずメモリ上でJPEGに変換し、
+画像ファイルは1回だけ読み込んでそのままBase64エンコードします。
+
+prepare_image_file / prepare_pixmap は、送信前に画像をモデルが実際に使う解像度まで縮小して
+JPEGに再エンコードし、大きな図面は重なりを持たせたタイルに分割します。
+縮小・分割には Pillow が必要で、Pillow が無い場合は縮小・分割せずにそのまま送ります。
+"""
+
+import base64
+import io
+import math
+import mimetypes
+import threading
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # 縮小・分割を使わない場合は Pillow は不要
+    Image = None
+
+# モデルが画像を読むときの実効解像度（高詳細モード）
+# 長辺を MAX_LONG_SIDE 以内に収めた後、短辺が MAX_SHORT_SIDE になるまで縮小される
+MAX_LONG_SIDE = 2048
+MAX_SHORT_SIDE = 768
+
+DEFAULT_JPEG_QUALITY = 85
+
+
+def encode_bytes(data):
+    """
+    バイト列をBase64エンコードして文字列として返す関数
+
+    Args:
+        data (bytes | bytearray | memoryview): エンコードするバイト列
+
+    Returns:
+        str: Base64エンコードされた文字列
+    """
+    # memoryview経由で渡し、エンコード前の余分なコピーを作らない
+    return base64.b64encode(memoryview(data)).decode('ascii')
+
+
+def bytes_to_data_url(data, mime_type="image/jpeg"):
+    """
+    画像のバイト列をデータURLに変換する関数
+
+    Args:
+        data (bytes): 画像のバイト列
+        mime_type (str, optional): 画像のMIMEタイプ。デフォルトは"image/jpeg"。
+
+    Returns:
+        str: "data:image/jpeg;base64,..." 形式のデータURL
+    """
+    return f"data:{mime_type};base64,{encode_bytes(data)}"
+
+
+def pixmap_to_data_url(pix, quality=DEFAULT_JPEG_QUALITY):
+    """
+    PyMuPDFのPixmapをディスクを介さずにJPEGのデータURLへ変換する関数
+
+    Args:
+        pix (fitz.Pixmap): page.get_pixmap() で取得した画像
+        quality (int, optional): JPEGの画質。デフォルトは85。
+
+    Returns:
+        str: JPEG画像のデータURL
+    """
+    return bytes_to_data_url(pix.tobytes("jpeg", jpg_quality=quality), "image/jpeg")
+
+
+def image_file_to_data_url(image_path):
+    """
+    画像ファイルを読み込み、データURLに変換する関数
+
+    Args:
+        image_path (str): 画像ファイルのパス
+
+    Returns:
+        str: 画像のデータURL（MIMEタイプは拡張子から判定し、不明な場合はJPEG扱い）
+    """
+    mime_type = mimetypes.guess_type(image_path)[0] or "image/jpeg"
+    with open(image_path, "rb") as image_file:
+        return bytes_to_data_url(image_file.read(), mime_type)
+
+
+def image_part(data_url):
+    """
+    データURLをchat.completionsのメッセージに含める画像要素に変換する関数
+
+    Args:
+        data_url (str): 画像のデータURL
+
+    Returns:
+        dict: {"type": "image_url", "image_url": {"url": data_url}}
+    """
+    return {"type": "image_url", "image_url": {"url": data_url}}
+
+
+def fit_scale(width, height, max_long_side=MAX_LONG_SIDE, max_short_side=MAX_SHORT_SIDE):
+    """
+    画像をモデルの実効解像度に収めるための縮小率を返す関数
+
+    Args:
+        width (float): 画像の幅
+        height (float): 画像の高さ
+
+    Returns:
+        float: 縮小率（1.0以下。拡大はしない）
+    """
+    return min(1.0, max_long_side / max(width, height), max_short_side / min(width, height))
+
+
+def fit_dpi(page_rect, dpi):
+    """
+    PDFのページを、モデルの実効解像度を超えない範囲の解像度で描画するためのDPIを返す関数
+
+    Args:
+        page_rect (fitz.Rect): page.rect（単位はポイント = 1/72インチ）
+        dpi (int): 希望する解像度
+
+    Returns:
+        int: 描画に使うDPI（dpi以下）
+    """
+    width = page_rect.width * dpi / 72
+    height = page_rect.height * dpi / 72
+    return max(1, math.floor(dpi * fit_scale(width, height)))
+
+
+class PayloadStats:
+    """
+    縮小・再エンコードによって削減した送信量の集計（スレッド間で共有してよい）
+    """
+
+    def __init__(self):
+        self.images = 0
+        self.original_bytes = 0
+        self.sent_bytes = 0
+        self.original_pixels = 0
+        self.sent_pixels = 0
+        self._lock = threading.Lock()
+
+    def add(self, original_bytes, sent_bytes, original_pixels, sent_pixels):
+        """
+        画像1枚分（タイル分割時は分割後の合計）を記録する
+        original_bytes は元のバイト数が分からない場合（PDFのページなど）は0を渡す
+        """
+        with self._lock:
+            self.images += 1
+            self.original_bytes += original_bytes
+            self.sent_bytes += sent_bytes
+            self.original_pixels += original_pixels
+            self.sent_pixels += sent_pixels
+
+    def summary(self):
+        """
+        削減量をまとめた文字列を返す
+        """
+        text = f"画像{self.images}枚 送信量: {self.sent_bytes:,}バイト"
+        if self.original_bytes:
+            saved = self.original_bytes - self.sent_bytes
+            text += f" (元の画像から{saved:,}バイト削減, {saved / self.original_bytes:.0%})"
+        if self.original_pixels:
+            text += f" 画素数: 元の{self.sent_pixels / self.original_pixels:.0%}"
+        return text
+
+
+def _require_pillow():
+    if Image is None:
+        raise ImportError("画像の縮小・分割には Pillow が必要です (pip install pillow)")
+
+
+def _encode_jpeg(img, quality):
+    """PILの画像をJPEGのバイト列に変換する"""
+    buffer = io.BytesIO()
+    img.save(buffer, "JPEG", quality=quality, optimize=True)
+    return buffer.getbuffer()
+
+
+def _tile_boxes(width, height, tile_size, overlap):
+    """画像を tile_size 四方のタイルに、隣と overlap ピクセル重ねて分割したときの領域の一覧を返す"""
+    step = tile_size - overlap
+    columns = max(1, math.ceil((width - overlap) / step))
+    rows = max(1, math.ceil((height - overlap) / step))
+    boxes = []
+    for row in range(rows):
+        for column in range(columns):
+            # 最後の列・行は画像の端に揃え、タイルの大きさを保つ
+            left = min(column * step, max(0, width - tile_size))
+            top = min(row * step, max(0, height - tile_size))
+            boxes.append((left, top, min(left + tile_size, width), min(top + tile_size, height)))
+    return boxes
+
+
+def prepare_image(img, quality=DEFAULT_JPEG_QUALITY, tile=False, tile_size=1536, overlap=128):
+    """
+    PILの画像をモデルの実効解像度まで縮小してJPEGに再エンコードし、データURLのリストを返す関数
+
+    tile=True の場合、全体を1枚に縮小すると解像度が半分未満になる大きな画像は、
+    tile_size 四方のタイルに overlap ピクセル重ねて分割し、タイルごとに縮小する。
+
+    Args:
+        img (PIL.Image.Image): 画像
+        quality (int, optional): JPEGの画質。デフォルトは85。
+        tile (bool, optional): 大きな画像をタイルに分割するかどうか。デフォルトはFalse。
+        tile_size (int, optional): タイルの一辺（元画像のピクセル数）。デフォルトは1536。
+        overlap (int, optional): 隣り合うタイルの重なり（ピクセル数）。デフォルトは128。
+
+    Returns:
+        tuple: (データURLのリスト, 送信バイト数の合計, 送信画素数の合計)
+    """
+    _require_pillow()
+    img = ImageOps.exif_transpose(img)
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+
+    width, height = img.size
+    if tile and fit_scale(width, height) < 0.5:
+        pieces = [img.crop(box) for box in _tile_boxes(width, height, tile_size, overlap)]
+    else:
+        pieces = [img]
+
+    urls = []
+    sent_bytes = 0
+    sent_pixels = 0
+    for piece in pieces:
+        scale = fit_scale(*piece.size)
+        if scale < 1.0:
+            size = (max(1, round(piece.width * scale)), max(1, round(piece.height * scale)))
+            piece = piece.resize(size, Image.LANCZOS)
+        data = _encode_jpeg(piece, quality)
+        urls.append(bytes_to_data_url(data, "image/jpeg"))
+        sent_bytes += len(data)
+        sent_pixels += piece.width * piece.height
+    return urls, sent_bytes, sent_pixels
+
+
+def prepare_image_file(image_path, quality=DEFAULT_JPEG_QUALITY, tile=False, stats=None):
+    """
+    画像ファイルを縮小・再エンコード（必要ならタイル分割）し、データURLのリストを返す関数
+
+    再エンコードしても元のファイルより小さくならない場合や、Pillow が無い場合は、元のファイルをそのまま送る。
+
+    Args:
+        image_path (str): 画像ファイルのパス
+        quality (int, optional): JPEGの画質。デフォルトは85。
+        tile (bool, optional): 大きな画像をタイルに分割するかどうか。デフォルトはFalse。
+        stats (PayloadStats, optional): 削減量の集計
+
+    Returns:
+        list[str]: データURLのリスト（分割しない場合は1件）
+    """
+    with open(image_path, "rb") as image_file:
+        data = image_file.read()
+    if Image is None:
+        if stats is not None:
+            stats.add(len(data), len(data), 0, 0)
+        mime_type = mimetypes.guess_type(image_path)[0] or "image/jpeg"
+        return [bytes_to_data_url(data, mime_type)]
+    with Image.open(io.BytesIO(data)) as img:
+        original_pixels = img.width * img.height
+        urls, sent_bytes, sent_pixels = prepare_image(img, quality=quality, tile=tile)
+
+    if len(urls) == 1 and sent_bytes >= len(data):
+        mime_type = mimetypes.guess_type(image_path)[0] or "image/jpeg"
+        urls = [bytes_to_data_url(data, mime_type)]
+        sent_bytes, sent_pixels = len(data), original_pixels
+
+    if stats is not None:
+        stats.add(len(data), sent_bytes, original_pixels, sent_pixels)
+    return urls
+
+
+def prepare_pixmap(pix, quality=DEFAULT_JPEG_QUALITY, tile=False, stats=None):
+    """
+    PyMuPDFのPixmapを縮小・再エンコード（必要ならタイル分割）し、データURLのリストを返す関数
+
+    Pillow が無い場合は、縮小・分割せずにJPEGに変換して送る。
+
+    Args:
+        pix (fitz.Pixmap): page.get_pixmap() で取得した画像
+        quality (int, optional): JPEGの画質。デフォルトは85。
+        tile (bool, optional): 大きな画像をタイルに分割するかどうか。デフォルトはFalse。
+        stats (PayloadStats, optional): 削減量の集計
+
+    Returns:
+        list[str]: データURLのリスト（分割しない場合は1件）
+    """
+    if Image is None:
+        data = pix.tobytes("jpeg", jpg_quality=quality)
+        if stats is not None:
+            stats.add(0, len(data), pix.width * pix.height, pix.width * pix.height)
+        return [bytes_to_data_url(data, "image/jpeg")]
+
+    mode = "RGBA" if pix.alpha else ("L" if pix.n == 1 else "RGB")
+    img = Image.frombytes(mode, (pix.width, pix.height), pix.samples)
+    urls, sent_bytes, sent_pixels = prepare_image(img, quality=quality, tile=tile)
+    if stats is not None:
+        stats.add(0, sent_bytes, pix.width * pix.height, sent_pixels)
+    return urls
+
+
+def render_page(page, dpi, quality=DEFAULT_JPEG_QUALITY, tile=False, stats=None):
+    """
+    PDFのページを描画し、AIに送るデータURLのリストを返す関数
+
+    tile=False の場合は、モデルの実効解像度を超えないDPI（dpi以下）で描画するため、
+    読み取られない余分な画素を描画・送信しない。
+    tile=True の場合は dpi で描画し、大きなページはタイルに分割する（Pillow が無い場合は分割しない）。
+
+    Args:
+        page (fitz.Page): 描画するページ
+        dpi (int): 描画する解像度の上限
+        quality (int, optional): JPEGの画質。デフォルトは85。
+        tile (bool, optional): 大きなページをタイルに分割するかどうか。デフォルトはFalse。
+        stats (PayloadStats, optional): 削減量の集計
+
+    Returns:
+        tuple: (データURLのリスト, 描画したPixmap)
+    """
+    if tile:
+        pix = page.get_pixmap(dpi=dpi)
+        return prepare_pixmap(pix, quality=quality, tile=True, stats=stats), pix
+
+    full_pixels = round(page.rect.width * dpi / 72) * round(page.rect.height * dpi / 72)
+    pix = page.get_pixmap(dpi=fit_dpi(page.rect, dpi))
+    data = pix.tobytes("jpeg", jpg_quality=quality)
+    if stats is not None:
+        stats.add(0, len(data), full_pixels, pix.width * pix.height)
+    return [bytes_to_data_url(data, "image/jpeg")], pix
@@ -0,0 +1,148 @@
+
+"""
+バッチ処理の途中経過を記録し、中断した処理を続きから再開するためのジョブジャーナルを提供します。
+
+PDFのページや日報の画像など、1件の処理が終わるたびに (入力のハッシュ → 結果) をSQLiteに記録します。
+再実行時は、入力のハッシュが記録と一致する件は処理を飛ばし、新しい件や内容が変わった件だけを処理します。
+最終的な出力は記録から1件ずつ読み出して書き出すため、結果全体をメモリに溜めずに済みます。
+"""
+
+import hashlib
+import sqlite3
+import threading
+import time
+
+
+def make_hash(*parts):
+    """
+    処理の入力（設定値やプロンプトなど）からハッシュを作成する関数
+
+    Args:
+        *parts: ハッシュに含める値（文字列に変換して連結する）
+
+    Returns:
+        str: SHA-256ハッシュ（16進文字列）
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def file_hash(path, *parts):
+    """
+    ファイルの内容と追加の値からハッシュを作成する関数
+
+    Args:
+        path (str): ファイルのパス
+        *parts: ハッシュに含める追加の値（処理の設定など）
+
+    Returns:
+        str: SHA-256ハッシュ（16進文字列）
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    for part in parts:
+        digest.update(b'\0')
+        digest.update(str(part).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class JobJournal:
+    """
+    1つのジョブ（PDFファイルや日報フォルダなど）の処理結果を件ごとに記録するジャーナル
+
+    複数スレッドから同時に使ってよい。
+    """
+
+    def __init__(self, job, path="job_journal.sqlite3"):
+        """
+        Args:
+            job (str): ジョブの識別子（処理対象の絶対パスなど）
+            path (str, optional): ジャーナルファイルのパス。デフォルトは"job_journal.sqlite3"。
+        """
+        self.job = job
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS journal ("
+            " job TEXT NOT NULL,"
+            " item TEXT NOT NULL,"
+            " input_hash TEXT NOT NULL,"
+            " result TEXT NOT NULL,"
+            " recorded_at REAL NOT NULL,"
+            " PRIMARY KEY (job, item))"
+        )
+        self._conn.commit()
+
+    def get(self, item, input_hash=None):
+        """
+        記録済みの結果を取り出す
+
+        Args:
+            item (str): 件の識別子（ページ番号やファイル名など）
+            input_hash (str, optional): 指定した場合、記録時の入力ハッシュと一致するときだけ返す
+
+        Returns:
+            str or None: 記録済みの結果。無い場合や入力が変わっている場合はNone
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT input_hash, result FROM journal WHERE job = ? AND item = ?", (self.job, item)
+            ).fetchone()
+        if row is None or (input_hash is not None and row[0] != input_hash):
+            return None
+        return row[1]
+
+    def has(self, item, input_hash):
+        """
+        同じ入力の結果が記録済みかどうかを返す
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM journal WHERE job = ? AND item = ? AND input_hash = ?",
+                (self.job, item, input_hash),
+            ).fetchone()
+        return row is not None
+
+    def record(self, item, input_hash, result):
+        """
+        1件の処理結果を記録する（すぐにファイルへ書き込む）
+
+        Args:
+            item (str): 件の識別子
+            input_hash (str): 入力のハッシュ
+            result (str): 処理結果（テキストやJSON文字列）
+        """
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO journal (job, item, input_hash, result, recorded_at) VALUES (?, ?, ?, ?, ?)",
+                (self.job, item, input_hash, result, time.time()),
+            )
+            self._conn.commit()
+
+    def discard(self, item):
+        """
+        1件の記録を削除する（入力が変わり、古い結果を使わないようにする場合など）
+        """
+        with self._lock:
+            self._conn.execute("DELETE FROM journal WHERE job = ? AND item = ?", (self.job, item))
+            self._conn.commit()
+
+    def clear(self):
+        """
+        このジョブの記録を全て削除する（最初からやり直す場合）
+        """
+        with self._lock:
+            self._conn.execute("DELETE FROM journal WHERE job = ?", (self.job,))
+            self._conn.commit()
+
+    def close(self):
+        """ジャーナルファイルを閉じる"""
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,261 @@
+
+"""
+作業日報の抽出結果を蓄積し、日・週・月ごとの集計を差分で更新していくデータ保管庫を提供します。
+
+日報1枚分の行を追加・置き換えるたびに、その日報の分だけ集計表（日/週/月 × 氏名 × 品名）を
+加算・減算するため、月次の集計は全ての画像を処理し直さずに集計表を引くだけで得られます。
+画像フォルダから消えた日報も履歴として残ります。
+
+コマンドラインから集計を表示する場合:
+    python report_warehouse.py month --by hinmei
+    python report_warehouse.py week --by name,hinmei --start 2024-02-01 --end 2024-02-29
+"""
+
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+# 集計する期間の単位
+PERIODS = ("day", "week", "month")
+
+# 集計の内訳に指定できる列
+DIMENSIONS = ("name", "hinmei")
+
+# 日報の日付として受け付ける書式
+DATE_FORMATS = ("%Y/%m/%d", "%Y-%m-%d", "%Y年%m月%d日")
+
+
+def parse_work_date(text):
+    """
+    日報の作業日の文字列を日付に変換する関数
+
+    Returns:
+        datetime.date or None: 変換した日付。書式が不正な場合はNone
+    """
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(str(text).strip(), fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def period_starts(day):
+    """
+    日付が属する日・週（月曜始まり）・月の開始を表す文字列を返す関数
+
+    Returns:
+        dict: {"day": "YYYY-MM-DD", "week": "YYYY-MM-DD", "month": "YYYY-MM"}
+    """
+    return {
+        "day": day.isoformat(),
+        "week": (day - timedelta(days=day.weekday())).isoformat(),
+        "month": day.strftime("%Y-%m"),
+    }
+
+
+def minutes_between(start_time, end_time):
+    """
+    "HH:MM" 形式の開始時刻と終了時刻から作業時間(分)を計算する関数（形式が不正な場合はNone）
+    """
+    try:
+        start = datetime.strptime(str(start_time), "%H:%M")
+        end = datetime.strptime(str(end_time), "%H:%M")
+    except ValueError:
+        return None
+    return (end - start).total_seconds() / 60
+
+
+class ReportWarehouse:
+    """
+    作業日報の行と、期間ごとの集計表を保存するSQLiteの保管庫
+
+    複数スレッドから同時に使ってよい。
+    """
+
+    def __init__(self, path="report_warehouse.sqlite3"):
+        """
+        Args:
+            path (str, optional): 保管庫ファイルのパス。デフォルトは"report_warehouse.sqlite3"。
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS reports ("
+            " source TEXT PRIMARY KEY,"
+            " input_hash TEXT NOT NULL,"
+            " recorded_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS report_rows ("
+            " source TEXT NOT NULL,"
+            " line INTEGER NOT NULL,"
+            " work_date TEXT,"
+            " name TEXT NOT NULL,"
+            " hinmei TEXT NOT NULL,"
+            " quantity INTEGER,"
+            " start_time TEXT,"
+            " end_time TEXT,"
+            " duration_minutes REAL,"
+            " PRIMARY KEY (source, line))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS report_rows_work_date ON report_rows(work_date)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS rollups ("
+            " period TEXT NOT NULL,"
+            " period_start TEXT NOT NULL,"
+            " name TEXT NOT NULL,"
+            " hinmei TEXT NOT NULL,"
+            " quantity INTEGER NOT NULL,"
+            " duration_minutes REAL NOT NULL,"
+            " row_count INTEGER NOT NULL,"
+            " PRIMARY KEY (period, period_start, name, hinmei))"
+        )
+        self._conn.commit()
+
+    def has_report(self, source, input_hash):
+        """
+        同じ入力の日報が保存済みかどうかを返す
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM reports WHERE source = ? AND input_hash = ?", (source, input_hash)
+            ).fetchone()
+        return row is not None
+
+    def replace_report(self, source, input_hash, rows):
+        """
+        日報1枚分の行を保存し、集計表に加算する。保存済みの場合は古い行の分を集計表から差し引いて置き換える。
+
+        Args:
+            source (str): 日報の識別子（画像の絶対パスなど）
+            input_hash (str): 入力のハッシュ（画像の内容と抽出の設定）
+            rows (list[dict]): work_date, name, hinmei, quantity, start_time, end_time をキーとする行
+        """
+        records = []
+        for line, row in enumerate(rows):
+            day = parse_work_date(row.get("work_date"))
+            records.append((
+                source,
+                line,
+                day.isoformat() if day is not None else None,
+                row.get("name") or "",
+                row.get("hinmei") or "",
+                row.get("quantity"),
+                row.get("start_time"),
+                row.get("end_time"),
+                minutes_between(row.get("start_time"), row.get("end_time")),
+            ))
+        with self._lock, self._conn:
+            self._remove(source)
+            self._conn.executemany(
+                "INSERT INTO report_rows (source, line, work_date, name, hinmei, quantity, start_time, end_time,"
+                " duration_minutes) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                records,
+            )
+            self._conn.execute(
+                "INSERT INTO reports (source, input_hash, recorded_at) VALUES (?, ?, ?)",
+                (source, input_hash, time.time()),
+            )
+            self._add_to_rollups(source, 1)
+
+    def remove_report(self, source):
+        """
+        日報1枚分の行を削除し、その分を集計表から差し引く（入力が変わり、古い結果を使わないようにする場合など）
+        """
+        with self._lock, self._conn:
+            self._remove(source)
+
+    def _remove(self, source):
+        self._add_to_rollups(source, -1)
+        self._conn.execute("DELETE FROM report_rows WHERE source = ?", (source,))
+        self._conn.execute("DELETE FROM reports WHERE source = ?", (source,))
+
+    def _add_to_rollups(self, source, sign):
+        # 日報1枚分の行を、日・週・月それぞれの集計表に加算（sign=-1なら減算）する
+        updates = []
+        rows = self._conn.execute(
+            "SELECT work_date, name, hinmei, quantity, duration_minutes FROM report_rows"
+            " WHERE source = ? AND work_date IS NOT NULL",
+            (source,),
+        )
+        for work_date, name, hinmei, quantity, duration in rows:
+            starts = period_starts(datetime.strptime(work_date, "%Y-%m-%d").date())
+            for period in PERIODS:
+                updates.append((period, starts[period], name, hinmei,
+                                sign * (quantity or 0), sign * (duration or 0.0), sign))
+        if not updates:
+            return
+        self._conn.executemany(
+            "INSERT INTO rollups (period, period_start, name, hinmei, quantity, duration_minutes, row_count)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT (period, period_start, name, hinmei) DO UPDATE SET"
+            " quantity = quantity + excluded.quantity,"
+            " duration_minutes = duration_minutes + excluded.duration_minutes,"
+            " row_count = row_count + excluded.row_count",
+            updates,
+        )
+        self._conn.execute("DELETE FROM rollups WHERE row_count <= 0")
+
+    def rollup(self, period, by=("hinmei",), start=None, end=None):
+        """
+        集計表から、期間ごと（と by の列ごと）の生産数・作業時間の合計を返す
+
+        Args:
+            period (str): 期間の単位（"day", "week", "month"）
+            by (tuple, optional): 内訳にする列（"name", "hinmei" の組み合わせ）。デフォルトは品名ごと
+            start (str, optional): この期間の開始以降に絞る（"YYYY-MM-DD"、月の場合は"YYYY-MM"）
+            end (str, optional): この期間の開始以前に絞る
+
+        Returns:
+            list[dict]: period_start, by の列, quantity, duration_minutes, rows をキーとする行
+        """
+        if period not in PERIODS:
+            raise ValueError(f"unknown period: {period}")
+        unknown = [column for column in by if column not in DIMENSIONS]
+        if unknown:
+            raise ValueError(f"unknown rollup columns: {', '.join(unknown)}")
+
+        keys = ["period_start", *by]
+        conditions = ["period = ?"]
+        params = [period]
+        if start is not None:
+            conditions.append("period_start >= ?")
+            params.append(start)
+        if end is not None:
+            conditions.append("period_start <= ?")
+            params.append(end)
+        columns = ", ".join(keys)
+        sql = (
+            f"SELECT {columns}, SUM(quantity), SUM(duration_minutes), SUM(row_count) FROM rollups"
+            f" WHERE {' AND '.join(conditions)} GROUP BY {columns} ORDER BY {columns}"
+        )
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [dict(zip([*keys, "quantity", "duration_minutes", "rows"], row)) for row in rows]
+
+    def close(self):
+        """保管庫ファイルを閉じる"""
+        with self._lock:
+            self._conn.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="作業日報の期間ごとの集計を表示する")
+    parser.add_argument("period", choices=PERIODS)
+    parser.add_argument("--by", default="hinmei", help="内訳にする列（name, hinmei をカンマ区切り）")
+    parser.add_argument("--start", help="この期間の開始以降に絞る")
+    parser.add_argument("--end", help="この期間の開始以前に絞る")
+    parser.add_argument("--path", default="report_warehouse.sqlite3")
+    args = parser.parse_args()
+
+    warehouse = ReportWarehouse(args.path)
+    by = tuple(column.strip() for column in args.by.split(",") if column.strip())
+    for row in warehouse.rollup(args.period, by=by, start=args.start, end=args.end):
+        print("\t".join(str(value) for value in row.values()))
+    warehouse.close()
@@ -0,0 +1,167 @@
+
+"""
+AIの応答をローカルに保存し、同じリクエストを再送しないためのキャッシュを提供します。
+
+キーはリクエスト内容（モデル名、システム/ユーザープロンプト、画像データ、その他のパラメータ）の
+SHA-256ハッシュで、応答はSQLiteファイルに保存します。
+有効期限(TTL)を過ぎた応答は使わず、合計サイズが上限を超えた場合は
+最後に使われた時刻が古いものから削除します（LRU）。
+合計サイズは保存のたびに数え直さず手元で増減させ、期限切れの削除と合計の数え直しは一定回数の保存ごとに行います。
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+
+def make_key(**params):
+    """
+    リクエストのパラメータからキャッシュキーを作成する関数
+
+    Args:
+        **params: chat.completions.create に渡す引数（model, messages など）
+
+    Returns:
+        str: パラメータ全体のSHA-256ハッシュ（16進文字列）
+    """
+    text = json.dumps(params, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """
+    SQLiteに保存する応答キャッシュ
+
+    複数スレッドから同時に使ってよい。ヒット/ミス回数は hits / misses で参照できる。
+    """
+
+    def __init__(self, path="response_cache.sqlite3", max_bytes=512 * 1024 * 1024, ttl_seconds=30 * 24 * 60 * 60,
+                 evict_interval=100):
+        """
+        Args:
+            path (str, optional): キャッシュファイルのパス。デフォルトは"response_cache.sqlite3"。
+            max_bytes (int, optional): 保存する応答の合計サイズの上限。デフォルトは512MB。
+            ttl_seconds (float, optional): 応答の有効期限（秒）。Noneなら無期限。デフォルトは30日。
+            evict_interval (int, optional): 期限切れの応答の削除と合計サイズの数え直しを行う保存の間隔。デフォルトは100回。
+                同じファイルを他のプロセスも使っている場合、その分の増減はこの間隔で反映される
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.evict_interval = evict_interval
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses(accessed_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_created_at ON responses(created_at)")
+        self._conn.commit()
+        self._writes = 0
+        self._total = 0
+        with self._lock:
+            self._purge(time.time())
+            self._conn.commit()
+
+    def get(self, key):
+        """
+        キャッシュから応答を取り出す
+
+        Args:
+            key (str): make_key() で作成したキー
+
+        Returns:
+            str or None: 保存されている応答。無い場合や有効期限切れの場合はNone
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and self.ttl_seconds is not None and now - row[1] > self.ttl_seconds:
+                self._delete(key)
+                self._conn.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def set(self, key, value):
+        """
+        応答をキャッシュに保存し、上限を超えた分を古い順に削除する
+
+        Args:
+            key (str): make_key() で作成したキー
+            value (str): 保存する応答（JSON文字列など）
+        """
+        now = time.time()
+        size = len(value.encode('utf-8'))
+        with self._lock:
+            self._delete(key)
+            self._conn.execute(
+                "INSERT INTO responses (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now, now),
+            )
+            self._total += size
+            self._writes += 1
+            if self._writes % self.evict_interval == 0:
+                self._purge(now)
+            self._evict()
+            self._conn.commit()
+
+    def _delete(self, key):
+        """応答を1件削除し、合計サイズから差し引く"""
+        row = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._total -= row[0]
+
+    def _purge(self, now):
+        """有効期限切れの応答を削除し、合計サイズをファイルから数え直す"""
+        if self.ttl_seconds is not None:
+            self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl_seconds,))
+        self._total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def _evict(self):
+        """合計サイズが上限以下になるまで、最後に使われた時刻が古い応答から削除する"""
+        while self._total > self.max_bytes:
+            rows = self._conn.execute("SELECT key FROM responses ORDER BY accessed_at LIMIT 100").fetchall()
+            if not rows:
+                self._total = 0
+                break
+            for (key,) in rows:
+                if self._total <= self.max_bytes:
+                    break
+                self._delete(key)
+
+    def stats(self):
+        """
+        キャッシュの利用状況を返す
+
+        Returns:
+            dict: hits, misses, entries(保存件数), bytes(合計サイズ)
+        """
+        with self._lock:
+            entries, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": entries, "bytes": total}
+
+    def close(self):
+        """キャッシュファイルを閉じる"""
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,310 @@
+
+"""
+API呼び出しごとの所要時間とトークン使用量を記録し、バッチ全体の集計を出力するテレメトリーを提供します。
+
+1回の呼び出しごとに、所要時間、最初のトークンまでの時間(TTFT、ストリーミング時のみ)、
+プロンプト/生成/画像のトークン数、429による再試行回数、キャッシュヒットの有無を記録します。
+記録は1件ずつJSON形式でログ（logging、指定時はJSON Linesファイルにも）に出力し、
+summary() / report() でバッチ全体の集計を返します。
+
+api_utils の create_chat_completion / get_response / get_responses に telemetry を渡すと記録されます。
+"""
+
+import base64
+import io
+import json
+import logging
+import math
+import threading
+import time
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow が無い環境では画像トークン数を見積もらない
+    Image = None
+
+logger = logging.getLogger("telemetry")
+
+
+def percentile(values, p):
+    """values の p パーセンタイル（最近傍順位法）を返す。空ならNone"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(p / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def image_tokens_for_size(width, height, detail="auto"):
+    """
+    幅・高さから画像1枚分の入力トークン数を見積もる関数
+
+    2048px四方に収まるように縮小し、さらに短辺を768pxにした上で、512pxのタイル1枚につき170トークン、
+    画像ごとに85トークンとして計算する（detail="low" の場合は85トークン）。
+
+    Args:
+        width (int): 画像の幅(px)
+        height (int): 画像の高さ(px)
+        detail (str, optional): image_url の detail 指定
+
+    Returns:
+        int: 見積もったトークン数
+    """
+    if detail == "low":
+        return 85
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return 170 * math.ceil(width / 512) * math.ceil(height / 512) + 85
+
+
+def estimate_image_tokens(url, detail="auto"):
+    """
+    データURLの画像1枚分の入力トークン数を、画像サイズから見積もる関数
+
+    Args:
+        url (str): 画像のデータURL（http(s)のURLは見積もらない）
+        detail (str, optional): image_url の detail 指定
+
+    Returns:
+        int or None: 見積もったトークン数。見積もれない場合はNone
+    """
+    if detail == "low":
+        return 85
+    if Image is None or not url.startswith("data:"):
+        return None
+    try:
+        with Image.open(io.BytesIO(base64.b64decode(url.split(",", 1)[1]))) as img:
+            return image_tokens_for_size(*img.size, detail)
+    except Exception:
+        return None
+
+
+def estimate_image_file_tokens(path, detail="auto"):
+    """
+    画像ファイル1枚分の入力トークン数を見積もる関数（画像のヘッダーだけを読む）
+
+    Returns:
+        int or None: 見積もったトークン数。見積もれない場合はNone
+    """
+    if Image is None:
+        return None
+    try:
+        with Image.open(path) as img:
+            return image_tokens_for_size(*img.size, detail)
+    except Exception:
+        return None
+
+
+def count_images(messages, estimate=True):
+    """
+    メッセージに含まれる画像の枚数と、見積もった画像トークン数の合計を返す関数
+
+    Args:
+        messages (list): chat.completions に渡すメッセージ
+        estimate (bool, optional): 画像をデコードしてトークン数を見積もるかどうか。Falseなら枚数だけを数える。
+
+    Returns:
+        tuple: (画像の枚数, 画像トークン数の見積もり。1枚も見積もれなければNone)
+    """
+    images = 0
+    image_tokens = None
+    for message in messages or []:
+        content = message.get("content")
+        if not isinstance(content, list):
+            continue
+        for part in content:
+            if part.get("type") != "image_url":
+                continue
+            images += 1
+            if not estimate:
+                continue
+            image_url = part.get("image_url") or {}
+            tokens = estimate_image_tokens(image_url.get("url", ""), image_url.get("detail", "auto"))
+            if tokens is not None:
+                image_tokens = (image_tokens or 0) + tokens
+    return images, image_tokens
+
+
+class CallRecord:
+    """
+    1回のAPI呼び出しの記録
+
+    Telemetry.start_call() で作成し、応答を受け取ったら finish() を呼ぶ。
+    ストリーミングの場合は wrap_stream() で包んだ応答を読み終えた時点で記録される。
+    """
+
+    def __init__(self, telemetry, model, messages, stream=False, label=None):
+        self.telemetry = telemetry
+        self.model = model
+        self.stream = stream
+        self.label = label
+        # 画像トークン数の見積もりは画像のデコードが必要なため、APIを呼んだ場合だけ finish() で行う
+        self.images, self.image_tokens = count_images(messages, estimate=False)
+        self._messages = messages
+        self.retries = 0
+        self.cache_hit = False
+        self.hedged = False
+        self.prompt_tokens = None
+        self.completion_tokens = None
+        self.ttft = None
+        self.latency = None
+        self.error = None
+        self._start = time.perf_counter()
+        self._finished = False
+
+    def first_token(self):
+        """最初の本文のチャンクを受け取った時刻を記録する（2回目以降は何もしない）"""
+        if self.ttft is None:
+            self.ttft = time.perf_counter() - self._start
+
+    def set_usage(self, usage):
+        """応答の usage からトークン数を記録する"""
+        if usage is not None:
+            self.prompt_tokens = usage.prompt_tokens
+            self.completion_tokens = usage.completion_tokens
+
+    def finish(self, response=None, error=None):
+        """
+        呼び出しの終了を記録し、テレメトリーに追加する（2回目以降は何もしない）
+
+        Args:
+            response (ChatCompletion, optional): APIの応答（usage を記録する）
+            error (Exception, optional): 失敗した場合の例外
+        """
+        if self._finished:
+            return
+        self._finished = True
+        self.latency = time.perf_counter() - self._start
+        if not self.cache_hit:
+            _, self.image_tokens = count_images(self._messages)
+        self._messages = None
+        if response is not None:
+            self.set_usage(getattr(response, "usage", None))
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        self.telemetry.add(self)
+
+    def wrap_stream(self, response):
+        """
+        ストリーミング応答を包み、最初の本文のチャンクの時刻と、読み終えた時刻を記録するジェネレータ
+        """
+        try:
+            for chunk in response:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    self.first_token()
+                if getattr(chunk, "usage", None) is not None:
+                    self.set_usage(chunk.usage)
+                yield chunk
+        except Exception as e:
+            self.finish(error=e)
+            raise
+        finally:
+            # 途中で読むのをやめた場合も、そこまでの時間で記録する
+            self.finish()
+
+    def to_dict(self):
+        return {
+            "label": self.label,
+            "model": self.model,
+            "stream": self.stream,
+            "latency": self.latency,
+            "ttft": self.ttft,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "images": self.images,
+            "image_tokens": self.image_tokens,
+            "retries": self.retries,
+            "cache_hit": self.cache_hit,
+            "hedged": self.hedged,
+            "error": self.error,
+        }
+
+
+class Telemetry:
+    """
+    1回のバッチ処理（PDF1冊、日報フォルダ1つなど）のAPI呼び出しを記録するテレメトリー
+
+    複数スレッドから同時に使ってよい。
+    """
+
+    def __init__(self, name="batch", log_path=None):
+        """
+        Args:
+            name (str, optional): バッチの名前（ログと集計に付ける）
+            log_path (str, optional): 呼び出しごとの記録を追記するJSON Linesファイルのパス。省略時はloggingにのみ出力
+        """
+        self.name = name
+        self.log_path = log_path
+        self.records = []
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+
+    def start_call(self, model, messages, stream=False, label=None):
+        """
+        API呼び出しの記録を開始する
+
+        Returns:
+            CallRecord: 呼び出しの記録
+        """
+        return CallRecord(self, model, messages, stream=stream, label=label)
+
+    def add(self, record):
+        """終了した呼び出しの記録を追加し、ログに出力する"""
+        entry = {"batch": self.name, **record.to_dict()}
+        line = json.dumps(entry, ensure_ascii=False)
+        with self._lock:
+            self.records.append(record)
+            if self.log_path is not None:
+                with open(self.log_path, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+        logger.info(line)
+
+    def summary(self):
+        """
+        記録した呼び出し全体の集計を返す
+
+        Returns:
+            dict: 呼び出し数、失敗数、キャッシュヒット数、再試行回数、所要時間とTTFTのパーセンタイル、トークン数の合計など
+        """
+        with self._lock:
+            records = list(self.records)
+        api_records = [r for r in records if not r.cache_hit and r.error is None]
+        latencies = [r.latency for r in api_records]
+        ttfts = [r.ttft for r in api_records if r.ttft is not None]
+        return {
+            "batch": self.name,
+            "elapsed_seconds": time.perf_counter() - self._start,
+            "calls": len(records),
+            "errors": sum(r.error is not None for r in records),
+            "cache_hits": sum(r.cache_hit for r in records),
+            "retries": sum(r.retries for r in records),
+            "hedged": sum(r.hedged for r in records),
+            "latency_p50": percentile(latencies, 50),
+            "latency_p95": percentile(latencies, 95),
+            "latency_max": max(latencies) if latencies else None,
+            "ttft_p50": percentile(ttfts, 50),
+            "ttft_p95": percentile(ttfts, 95),
+            "prompt_tokens": sum(r.prompt_tokens or 0 for r in api_records),
+            "completion_tokens": sum(r.completion_tokens or 0 for r in api_records),
+            "images": sum(r.images for r in records),
+            "image_tokens": sum(r.image_tokens or 0 for r in api_records),
+        }
+
+    def report(self):
+        """
+        集計を人が読める形の文字列で返す
+        """
+        s = self.summary()
+
+        def seconds(value):
+            return "-" if value is None else f"{value:.2f}秒"
+
+        return "\n".join([
+            f"[{s['batch']}] 経過時間: {s['elapsed_seconds']:.1f}秒",
+            f"  呼び出し: {s['calls']}件 (キャッシュヒット: {s['cache_hits']}件, 失敗: {s['errors']}件, 429による再試行: {s['retries']}回, 重複送信: {s['hedged']}件)",
+            f"  所要時間: p50 {seconds(s['latency_p50'])}, p95 {seconds(s['latency_p95'])}, 最大 {seconds(s['latency_max'])}",
+            f"  最初のトークンまで: p50 {seconds(s['ttft_p50'])}, p95 {seconds(s['ttft_p95'])}",
+            f"  トークン: 入力 {s['prompt_tokens']} (うち画像の見積もり {s['image_tokens']}, 画像 {s['images']}枚), 出力 {s['completion_tokens']}",
+        ])